@@ -0,0 +1,81 @@
+"""
+Benchmark of compressing a batch file in one stream, as PUT does, versus in
+blocks on a pool of threads while it is written.
+
+Run with `poetry run python benchmarks/compression.py`.
+"""
+
+import argparse
+import gzip
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from target_snowflake.database_target.compression import BlockCompressor, get_codec
+
+
+def make_csv(size_mb: int) -> bytes:
+    rows = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        row = "{},user {},{},{:.4f}\n".format(
+            len(rows),
+            random.randrange(10000),
+            random.choice("abcdef") * 8,
+            random.random(),
+        )
+        rows.append(row)
+        size += len(row)
+    return "".join(rows).encode()
+
+
+def block_compress(data: bytes, codec_name: str, level: int, threads: int) -> int:
+    out = io.BytesIO()
+    out.close = lambda: None  # type: ignore[assignment]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        compressor = BlockCompressor(
+            out,
+            get_codec(codec_name, level),  # type: ignore[arg-type]
+            executor=executor if threads > 1 else None,
+            max_pending_blocks=2 * threads,
+        )
+        # Written in chunks the size of the writers' buffer
+        for i in range(0, len(data), 8192):
+            compressor.write(data[i : i + 8192])
+        compressor.close()
+    return len(out.getvalue())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    data = make_csv(args.size_mb)
+
+    start = time.perf_counter()
+    size = len(gzip.compress(data, compresslevel=args.level))
+    seconds = time.perf_counter() - start
+    print(f"    gzip stream: {seconds:.3f}s, {size / len(data):.1%} of original")
+
+    runs = [("gzip", 1), ("gzip", args.threads)]
+    try:
+        import zstandard  # noqa: F401
+
+        runs += [("zstd", 1), ("zstd", args.threads)]
+    except ImportError:
+        pass
+    for codec_name, threads in runs:
+        start = time.perf_counter()
+        size = block_compress(data, codec_name, args.level, threads)
+        seconds = time.perf_counter() - start
+        print(
+            f"{codec_name} {threads} thread(s): {seconds:.3f}s, "
+            f"{size / len(data):.1%} of original"
+        )
+
+
+if __name__ == "__main__":
+    main()
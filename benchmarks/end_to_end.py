@@ -0,0 +1,173 @@
+"""
+End-to-end benchmark of the target, loading synthetic streams into a local
+SQLite stand-in for Snowflake.
+
+Run with `poetry run python benchmarks/end_to_end.py`. Reports records/sec,
+peak RSS and the time spent in each stage. Stages on the load threads (stage
+and copy) overlap with the others, so the stage times can add up to more than
+the total.
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import logging
+import resource
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict
+
+import target_snowflake.reader
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.database_target.parallel_encoder import ParallelEncoder
+from target_snowflake.sinks import SnowflakeSink
+from target_snowflake.tests.fake_snowflake import FakeSnowflake, LocalSnowflakeTarget
+
+PROPERTIES = [
+    ({"type": "integer"}, lambda row, i: row * i),
+    ({"type": ["null", "string"]}, lambda row, i: f"value {row} of {i}"),
+    ({"type": ["null", "number"]}, lambda row, i: row / (i + 1)),
+    ({"type": ["null", "boolean"]}, lambda row, i: row % 2 == 0),
+    (
+        {"type": ["null", "string"], "format": "date-time"},
+        lambda row, i: datetime.datetime(2021, 1, 1, second=row % 60).isoformat(),
+    ),
+    ({"type": ["null", "object"]}, lambda row, i: {"row": row, "tags": ["a", i]}),
+]
+
+
+def write_input(path: Path, rows: int, width: int, streams: int) -> None:
+    """Write a Singer stream of `rows` records spread over `streams` streams."""
+    properties = {"id": {"type": "integer"}}
+    generators: Dict[str, Callable] = {}
+    for i in range(width - 1):
+        schema, generate = PROPERTIES[i % len(PROPERTIES)]
+        properties[f"col_{i}"] = schema
+        generators[f"col_{i}"] = functools.partial(generate, i=i)
+
+    with open(path, "w") as fp:
+        for stream in range(streams):
+            message = {
+                "type": "SCHEMA",
+                "stream": f"stream_{stream}",
+                "schema": {"type": "object", "properties": properties},
+                "key_properties": ["id"],
+            }
+            fp.write(json.dumps(message) + "\n")
+        for row in range(rows):
+            record = {"id": row}
+            for name, generate in generators.items():
+                record[name] = generate(row)
+            message = {
+                "type": "RECORD",
+                "stream": f"stream_{row % streams}",
+                "record": record,
+            }
+            fp.write(json.dumps(message) + "\n")
+            if row % 10000 == 0:
+                message = {"type": "STATE", "value": {"rows": row}}
+                fp.write(json.dumps(message) + "\n")
+
+
+class Timers:
+    """Add up the wall time spent in wrapped functions by stage."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+
+        return timed
+
+    def instrument(self) -> None:
+        target_snowflake.reader.loads = self.wrap(
+            "parse", target_snowflake.reader.loads
+        )
+        writer_classes = [CSVBatchWriter]
+        try:
+            from target_snowflake.database_target.parquet_writer import (
+                ParquetBatchWriter,
+            )
+
+            writer_classes.append(ParquetBatchWriter)
+        except ImportError:
+            pass
+        for writer_class in writer_classes:
+            for name in ["__init__", "write_record", "close"]:
+                setattr(
+                    writer_class, name, self.wrap("encode", getattr(writer_class, name))
+                )
+        ParallelEncoder.write = self.wrap("encode", ParallelEncoder.write)
+        # JSON Schema validation in the SDK, for comparison
+        SnowflakeSink._validate_and_parse = self.wrap(
+            "validate", SnowflakeSink._validate_and_parse
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--width", type=int, default=30)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument(
+        "--config", type=json.loads, default={}, help="extra target config, as JSON"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = Path(tmpdir) / "input.jsonl"
+        write_input(input_path, args.rows, args.width, args.streams)
+        (Path(tmpdir) / "files").mkdir()
+
+        timers = Timers()
+        timers.instrument()
+        database = FakeSnowflake(Path(tmpdir) / "stage")
+        start = time.perf_counter()
+        target = LocalSnowflakeTarget(
+            database,
+            config={
+                "snowflake": {
+                    "account": "local",
+                    "user": "user",
+                    "password": "password",
+                    "database": "BENCHMARK",
+                },
+                "output_path_prefix": f"{tmpdir}/files/",
+                **args.config,
+            },
+        )
+        with open(input_path) as file_input:
+            target.listen(file_input)
+        elapsed = time.perf_counter() - start
+
+        loaded = sum(
+            len(database.table(f"STREAM_{stream}")) for stream in range(args.streams)
+        )
+        assert loaded == args.rows, f"loaded {loaded} of {args.rows} records"
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{args.rows} records, {args.width} columns, {args.streams} streams: "
+        f"{elapsed:.2f}s, {args.rows / elapsed:,.0f} records/sec, "
+        f"peak RSS {peak_rss_mb:.0f} MB"
+    )
+    seconds = {**timers.seconds, **database.timings}
+    for stage in ["parse", "validate", "migrate", "encode", "stage", "copy"]:
+        print(f"{stage:>8}: {seconds.get(stage, 0):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
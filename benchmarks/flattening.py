@@ -0,0 +1,83 @@
+"""
+Microbenchmark for flattening nested records into rows, walking each record
+recursively versus with the compiled row encoder.
+
+Run with `poetry run python benchmarks/flattening.py`.
+"""
+
+import argparse
+import timeit
+from typing import Any, Dict, Tuple
+
+from target_snowflake.database_target.row_encoder import RowEncoder
+
+
+def make_record(width: int, depth: int, prefix: str = "") -> Dict[str, Any]:
+    """A record with `width` properties, each nested `depth` levels deep."""
+    if depth == 0:
+        return {f"{prefix}col_{i}": i * 1.5 for i in range(width)}
+    return {
+        f"{prefix}obj_{i}": make_record(width, depth - 1, f"{prefix}{i}_")
+        for i in range(width)
+    }
+
+
+def flatten_record(record: dict, prefix: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Flatten a record into column names by walking every nested object."""
+    flattened: Dict[str, Any] = {}
+    for key, value in record.items():
+        path = prefix + (key,)
+        if isinstance(value, dict):
+            flattened.update(flatten_record(value, path))
+        else:
+            flattened["__".join(path).upper()] = value
+    return flattened
+
+
+def leaf_paths(record: dict, prefix: Tuple[str, ...] = ()):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from leaf_paths(value, prefix + (key,))
+        else:
+            yield prefix + (key,)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = [make_record(args.width, args.depth) for _ in range(args.rows)]
+    paths = list(leaf_paths(records[0]))
+    columns = ["__".join(path).upper() for path in paths]
+    encoder = RowEncoder(
+        column_definitions={column: "FLOAT" for column in columns},
+        column_properties=dict(zip(columns, paths)),
+    )
+
+    def recursive():
+        for record in records:
+            flattened = flatten_record(record)
+            tuple(flattened.get(column) for column in columns)
+
+    def compiled():
+        encode = encoder.encode
+        for record in records:
+            encode(record)
+
+    assert encoder.encode(records[0]) == tuple(
+        flatten_record(records[0])[column] for column in columns
+    )
+    for name, run in [("recursive", recursive), ("compiled", compiled)]:
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        print(
+            f"{name:>9}: {best:.3f}s, {args.rows / best:,.0f} records/sec "
+            f"({len(columns)} columns, {args.depth} levels deep)"
+        )
+
+
+if __name__ == "__main__":
+    main()
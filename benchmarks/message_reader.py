@@ -0,0 +1,101 @@
+"""
+Benchmark parsing and dispatching Singer messages, comparing the SDK's reader
+with `FastSingerReader`.
+
+Run with `poetry run python benchmarks/message_reader.py`.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import time
+from typing import Dict
+
+from singer_sdk.io_base import SingerReader
+
+from target_snowflake.reader import FastSingerReader, loads
+
+
+class CountingSink:
+    def __init__(self) -> None:
+        self.records = 0
+
+    def process_record(self, record: dict, context: dict) -> None:
+        self.records += 1
+
+
+class Dispatch:
+    """Route RECORD messages to a sink per stream, like a target does."""
+
+    name = "benchmark"
+    logger = logging.getLogger("benchmark")
+
+    def __init__(self) -> None:
+        self.sinks: Dict[str, CountingSink] = {}
+
+    def _process_schema_message(self, message_dict: dict) -> None:
+        self.sinks[message_dict["stream"]] = CountingSink()
+
+    def _process_record_message(self, message_dict: dict) -> None:
+        self.sinks[message_dict["stream"]].process_record(message_dict["record"], {})
+
+    def _process_state_message(self, message_dict: dict) -> None:
+        pass
+
+    def _process_activate_version_message(self, message_dict: dict) -> None:
+        pass
+
+    def _process_batch_message(self, message_dict: dict) -> None:
+        pass
+
+
+class SDKReader(Dispatch, SingerReader):
+    pass
+
+
+class FastReader(FastSingerReader, Dispatch):
+    pass
+
+
+def make_input(rows: int, width: int, streams: int) -> bytes:
+    now = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+    values = [1234, "some text value", 12.5, True, now, None, {"a": [1, "b"]}]
+    lines = [
+        json.dumps({"type": "SCHEMA", "stream": f"s{i}", "schema": {}})
+        for i in range(streams)
+    ]
+    for row in range(rows):
+        record = {f"col_{i}": values[i % len(values)] for i in range(width)}
+        message = {"type": "RECORD", "stream": f"s{row % streams}", "record": record}
+        lines.append(json.dumps(message))
+        if row % 10000 == 0:
+            lines.append(json.dumps({"type": "STATE", "value": {"row": row}}))
+    return "\n".join(lines).encode() + b"\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--streams", type=int, default=4)
+    args = parser.parse_args()
+
+    data = make_input(args.rows, args.width, args.streams)
+    print(f"{len(data) / 1e6:.0f} MB of input, parsing with {loads.__module__}")
+    for name, reader_class in [("sdk", SDKReader), ("fast", FastReader)]:
+        reader = reader_class()
+        file_input = io.TextIOWrapper(io.BufferedReader(io.BytesIO(data)))
+        start = time.perf_counter()
+        reader._process_lines(file_input)
+        elapsed = time.perf_counter() - start
+        assert sum(sink.records for sink in reader.sinks.values()) == args.rows
+        print(
+            f"{name:>5}: {elapsed:.3f}s, {args.rows / elapsed:,.0f} records/sec, "
+            f"{len(data) / elapsed / 1e6:.0f} MB/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark encoding a batch on worker processes, by number of workers.
+
+Run with `poetry run python benchmarks/parallel_encoding.py`.
+"""
+
+import argparse
+import datetime
+import tempfile
+import time
+from pathlib import Path
+
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.database_target.parallel_encoder import ParallelEncoder
+from target_snowflake.database_target.row_encoder import RowEncoder
+
+TYPES = ["NUMBER", "TEXT", "FLOAT", "BOOLEAN", "TIMESTAMP_TZ", "DATE", "VARIANT"]
+
+
+def make_records(rows: int, width: int):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    values = [1234, "some text value", 12.5, True, now, now.date(), {"a": [1, "b"]}]
+    return [
+        {f"col_{i}": values[i % len(values)] for i in range(width)} for _ in range(rows)
+    ]
+
+
+def write_single(filepath: Path, records, encoder: RowEncoder) -> None:
+    writer = CSVBatchWriter(filepath, encoder=encoder)
+    for record in records:
+        writer.write_record(record)
+    writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--width", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    records = make_records(args.rows, args.width)
+    encoder = RowEncoder(
+        column_definitions={
+            f"COL_{i}": TYPES[i % len(TYPES)] for i in range(args.width)
+        },
+        column_properties={f"COL_{i}": f"col_{i}" for i in range(args.width)},
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for workers in args.workers:
+            filepath = Path(tmpdir) / f"batch-{workers}.csv"
+            if workers <= 1:
+                start = time.perf_counter()
+                write_single(filepath, records, encoder)
+                elapsed = time.perf_counter() - start
+            else:
+                parallel = ParallelEncoder(workers, min_records_per_part=1)
+                # Start the workers outside of the timed run
+                parallel.write(
+                    filepath, records[:workers], CSVBatchWriter, encoder, workers
+                )
+                start = time.perf_counter()
+                parallel.write(filepath, records, CSVBatchWriter, encoder, workers)
+                elapsed = time.perf_counter() - start
+                parallel.close()
+            print(
+                f"{workers:>3} workers: {elapsed:.3f}s, "
+                f"{args.rows / elapsed:,.0f} records/sec ({args.width} columns)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark for writing batch files with and without a compiled row encoder.
+
+Run with `poetry run python benchmarks/row_encoder.py`.
+"""
+
+import argparse
+import datetime
+import tempfile
+import timeit
+from pathlib import Path
+
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.database_target.row_encoder import RowEncoder
+
+TYPES = ["NUMBER", "TEXT", "FLOAT", "BOOLEAN", "TIMESTAMP_TZ", "DATE"]
+
+
+def make_records(rows: int, width: int):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    values = [1234, "some text value", 12.5, True, now, now.date()]
+    return [
+        {f"col_{i}": values[i % len(values)] for i in range(width)} for _ in range(rows)
+    ]
+
+
+def write(filepath: Path, records, encoder=None) -> None:
+    writer = CSVBatchWriter(filepath, encoder=encoder)
+    for record in records:
+        writer.write_record(record)
+    writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--width", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = make_records(args.rows, args.width)
+    encoder = RowEncoder(
+        column_definitions={
+            f"COL_{i}": TYPES[i % len(TYPES)] for i in range(args.width)
+        },
+        column_properties={f"COL_{i}": f"col_{i}" for i in range(args.width)},
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = Path(tmpdir) / "batch.csv"
+        for name, encoder_arg in [("record keys", None), ("row encoder", encoder)]:
+            best = min(
+                timeit.repeat(
+                    lambda: write(filepath, records, encoder_arg),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(
+                f"{name:>12}: {best:.3f}s, "
+                f"{args.rows / best:,.0f} records/sec ({args.width} columns)"
+            )
+
+
+if __name__ == "__main__":
+    main()
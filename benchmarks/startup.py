@@ -0,0 +1,150 @@
+"""
+Benchmark of the target's startup: import time, `--about`, and the time from
+starting to listen to the first record, loading into a local SQLite stand-in
+for Snowflake.
+
+Run with `poetry run python benchmarks/startup.py`. The tap is simulated by a
+thread that sends its first message after `--tap-delay` seconds, and each
+connection's first statement waits `--login-latency` seconds, as a login
+would.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from target_snowflake.tests.fake_snowflake import (
+    FakeConnection,
+    FakeSnowflake,
+    LocalSnowflakeTarget,
+)
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import target_snowflake.target
+print(time.perf_counter() - start, "snowflake.connector" in sys.modules)
+"""
+
+ABOUT_SCRIPT = (
+    "from target_snowflake.target import SnowflakeTarget; SnowflakeTarget.cli()"
+)
+
+
+class SlowLoginConnection(FakeConnection):
+    def __init__(self, database: FakeSnowflake, logger: logging.Logger) -> None:
+        super().__init__(database, logger)
+        self.latency: float = database.login_latency  # type: ignore[attr-defined]
+        self._lock = threading.Lock()
+
+    def _login(self) -> None:
+        with self._lock:
+            if self.latency:
+                time.sleep(self.latency)
+                self.latency = 0
+
+    def execute(self, sql: str, *args) -> None:
+        self._login()
+        super().execute(sql, *args)
+
+    def query(self, sql, **kwargs) -> List[Dict[str, Any]]:
+        self._login()
+        return super().query(sql, **kwargs)
+
+
+class SlowLoginSnowflake(FakeSnowflake):
+    def __init__(self, stage_dir: Path, login_latency: float) -> None:
+        super().__init__(stage_dir)
+        self.login_latency = login_latency
+
+    def connect(self, logger: logging.Logger) -> FakeConnection:
+        return SlowLoginConnection(self, logger)
+
+
+def run_python(*args: str) -> str:
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parent.parent)}
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def tap(write_fd: int, streams: int, delay: float) -> None:
+    time.sleep(delay)
+    with open(write_fd, "w") as fp:
+        for stream in range(streams):
+            schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+            message = {"type": "SCHEMA", "stream": f"stream_{stream}", "schema": schema}
+            fp.write(json.dumps({**message, "key_properties": []}) + "\n")
+        for stream in range(streams):
+            record = {"type": "RECORD", "stream": f"stream_{stream}", "record": {}}
+            fp.write(json.dumps({**record, "record": {"id": 1}}) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--tap-delay", type=float, default=1.0)
+    parser.add_argument("--login-latency", type=float, default=1.0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    seconds, connector_imported = run_python("-c", IMPORT_SCRIPT).split()
+    print(
+        f"          import: {float(seconds):.3f}s "
+        f"(connector imported: {connector_imported})"
+    )
+    start = time.perf_counter()
+    run_python("-c", ABOUT_SCRIPT, "--about")
+    print(f"         --about: {time.perf_counter() - start:.3f}s")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = SlowLoginSnowflake(Path(tmpdir) / "stage", args.login_latency)
+        config = {
+            "snowflake": {
+                "account": "local",
+                "user": "user",
+                "password": "password",
+                "database": "BENCHMARK",
+            },
+            "output_path_prefix": f"{tmpdir}/",
+        }
+        start = time.perf_counter()
+        target = LocalSnowflakeTarget(database, config=config)
+        print(f"       construct: {time.perf_counter() - start:.3f}s")
+
+        first_record_at = []
+        process_record_message = target._process_record_message
+
+        def time_first_record(message_dict: dict) -> None:
+            process_record_message(message_dict)
+            if not first_record_at:
+                first_record_at.append(time.perf_counter())
+
+        target._process_record_message = time_first_record  # type: ignore
+
+        read_fd, write_fd = os.pipe()
+        thread = threading.Thread(
+            target=tap, args=(write_fd, args.streams, args.tap_delay)
+        )
+        start = time.perf_counter()
+        thread.start()
+        target.listen(io.TextIOWrapper(open(read_fd, "rb"), encoding="utf-8"))
+        thread.join()
+        print(
+            f"    first record: {first_record_at[0] - start:.3f}s "
+            f"({args.tap_delay}s tap delay, {args.login_latency}s logins, "
+            f"{args.streams} streams)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Microbenchmark for serializing VARIANT and ARRAY values.
+
+Run with `poetry run python benchmarks/variant_encoder.py`.
+"""
+
+import argparse
+import datetime
+import json
+import timeit
+
+from target_snowflake.database_target.variant_encoder import encode_variant
+
+SHAPES = {
+    "flat object": {"id": 123, "name": "some name", "active": True, "score": 1.5},
+    "nested object": {
+        "id": 123,
+        "tags": ["a", "b", "c"],
+        "address": {"city": "Zürich", "zip": "8001", "geo": [47.37, 8.54]},
+        "updated_at": datetime.datetime(2021, 9, 20, 12, 45),
+    },
+    "short array": ["a", "b", "c"],
+    "long array": list(range(1000)),
+    "empty object": {},
+}
+
+
+def dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    for shape, value in SHAPES.items():
+        number = args.number // 100 if shape == "long array" else args.number
+        results = []
+        for func in [dumps, encode_variant]:
+            seconds = min(timeit.repeat(lambda: func(value), number=number, repeat=3))
+            results.append(number / seconds)
+        print(
+            f"{shape:>13}: json.dumps {results[0]:,.0f}/sec, "
+            f"encode_variant {results[1]:,.0f}/sec ({results[1] / results[0]:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
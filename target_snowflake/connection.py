@@ -0,0 +1,238 @@
+"""Snowflake database connections and the pool they share."""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from logging import Logger
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    # The connector takes longer to import than the rest of the target, so it's
+    # only imported once a session is needed
+    from snowflake.connector import SnowflakeConnection
+
+    from target_snowflake.metrics import Metrics
+
+
+class _SilencedThreads(logging.Filter):
+    """Drop the records logged by threads inside `silence_connector_log`."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.local = threading.local()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(self.local, "silenced", False)
+
+
+_silenced_threads = _SilencedThreads()
+# The connector binds parameters into the statement before logging it
+logging.getLogger("snowflake.connector.cursor").addFilter(_silenced_threads)
+
+
+@contextmanager
+def silence_connector_log() -> Iterator[None]:
+    """Keep the connector from logging the statements run by this thread."""
+    _silenced_threads.local.silenced = True
+    try:
+        yield
+    finally:
+        _silenced_threads.local.silenced = False
+
+
+class PoolMetrics:
+    """Counters describing how a connection pool has been used."""
+
+    def __init__(self) -> None:
+        self.logins = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.failed_health_checks = 0
+
+    def to_dict(self) -> Dict[str, Union[int, float]]:
+        return dict(vars(self))
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of Snowflake sessions.
+
+    Logging in to Snowflake takes seconds, so sessions are kept open and reused
+    instead of logging in for every sink. At most `max_size` sessions are open
+    at once; `checkout` blocks until one is free. Each session is used by one
+    thread at a time.
+
+    Sessions are kept alive by the connector's heartbeat, and a session that has
+    been idle for longer than `health_check_interval` seconds is pinged before
+    being handed out again. Sessions that fail the check are replaced.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        max_size: int = 8,
+        health_check_interval: float = 300,
+        timers: Optional["Metrics"] = None,
+        **kwargs,
+    ) -> None:
+        self.logger = logger
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.metrics = PoolMetrics()
+        self.timers = timers
+        self._connect_args = {"client_session_keep_alive": True, **kwargs}
+        self._idle: List[Tuple["SnowflakeConnection", float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def session(self) -> Iterator["SnowflakeConnection"]:
+        """Check out a session for the duration of the block."""
+        connection = self.checkout()
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def checkout(self) -> "SnowflakeConnection":
+        """Take a session from the pool, logging in if none are idle."""
+        with self._cond:
+            self.metrics.checkouts += 1
+            if not self._idle and self._size >= self.max_size:
+                self.metrics.waits += 1
+                start = time.monotonic()
+                while not self._idle and self._size >= self.max_size:
+                    self._cond.wait()
+                self.metrics.wait_seconds += time.monotonic() - start
+
+            connection: Optional["SnowflakeConnection"] = None
+            if self._idle:
+                connection, last_used = self._idle.pop()
+            else:
+                # Reserve the slot before logging in outside of the lock
+                self._size += 1
+
+        if connection is not None and not self._is_healthy(connection, last_used):
+            with self._cond:
+                self.metrics.failed_health_checks += 1
+            self._close_quietly(connection)
+            connection = None
+
+        if connection is None:
+            try:
+                connection = self._login()
+            except BaseException:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        return connection
+
+    def checkin(self, connection: "SnowflakeConnection") -> None:
+        """Return a session to the pool."""
+        with self._cond:
+            if connection.is_closed():
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Close every idle session."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+    def _login(self) -> "SnowflakeConnection":
+        import snowflake.connector
+
+        with self._cond:
+            self.metrics.logins += 1
+        if self.timers is None:
+            return snowflake.connector.connect(**self._connect_args)
+        with self.timers.timer("connection_login_duration"):
+            return snowflake.connector.connect(**self._connect_args)
+
+    def _is_healthy(self, connection: "SnowflakeConnection", last_used: float) -> bool:
+        if connection.is_closed():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            self.logger.warning("Discarding Snowflake session that failed a ping.")
+            return False
+
+    def _close_quietly(self, connection: "SnowflakeConnection") -> None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class Connection:
+    """
+    A wrapper for a Snowflake database connection.
+
+    Every statement (or list of statements run as one transaction) is run on a
+    session checked out of `pool` for its exclusive use, so each sink can keep
+    its own `Connection` without threading issues while sessions are shared
+    across sinks. Without a pool, the connection gets a private pool of one.
+    """
+
+    def __init__(
+        self, logger: Logger, pool: Optional[ConnectionPool] = None, **kwargs
+    ) -> None:
+        self.logger = logger
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(logger, max_size=1, **kwargs)
+
+    def execute(self, sql: str, *args, secret: bool = False) -> Optional[str]:
+        """
+        Run a statement, returning its Snowflake query ID.
+
+        With `secret`, the parameters hold credentials, so only the statement
+        without them is logged.
+        """
+        with self.pool.session() as connection, connection.cursor() as cur:
+            self.logger.debug(sql)
+            with silence_connector_log() if secret else nullcontext():
+                cur.execute(sql, *args)
+            return cur.sfqid
+
+    def query(self, sql: Union[str, List[str]], **kwargs) -> List[Dict[str, Any]]:
+        from snowflake.connector import DictCursor
+
+        with self.pool.session() as connection, connection.cursor(DictCursor) as cur:
+            is_transaction = False
+            if isinstance(sql, list):
+                self.logger.debug("START TRANSACTION")
+                cur.execute("START TRANSACTION")
+                is_transaction = True
+            else:
+                sql = [sql]
+            try:
+                for query in sql:
+                    self.logger.debug(query)
+                    cur.execute(query, kwargs)
+                    result = cur.fetchall()
+            except Exception:
+                # Don't hand the session back to the pool mid-transaction
+                if is_transaction:
+                    cur.execute("ROLLBACK")
+                raise
+            if is_transaction:
+                cur.execute("COMMIT")
+            return result
+
+    def close(self) -> None:
+        if self._owns_pool:
+            self.pool.close()
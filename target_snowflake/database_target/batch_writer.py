@@ -0,0 +1,118 @@
+"""Base classes for writers of batch files."""
+
+import abc
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+from target_snowflake.database_target.compression import CODECS
+
+COMPRESSED_EXTENSIONS = frozenset("." + codec.extension for codec in CODECS.values())
+
+
+def split_extension(filepath: Path) -> Tuple[str, str]:
+    """
+    Split a batch file's name into its stem and extension, keeping the
+    format's extension with a compression one, e.g. `.csv.gz`.
+    """
+    stem, extension = filepath.stem, filepath.suffix
+    if extension in COMPRESSED_EXTENSIONS and Path(stem).suffix:
+        stem, extension = Path(stem).stem, Path(stem).suffix + extension
+    return stem, extension
+
+
+class BatchFiles(metaclass=abc.ABCMeta):
+    """The file(s) a batch was written to."""
+
+    filepath: Path
+    record_count: int
+    header: List[str]
+
+    @property
+    def filepaths(self) -> List[Path]:
+        """All of the files written for the batch."""
+        return [self.filepath]
+
+    @property
+    @abc.abstractmethod
+    def bytes_written(self) -> int:
+        """The size of the encoded output so far."""
+        pass
+
+
+class BatchWriter(BatchFiles):
+    """Incrementally write the records of a single batch to a file."""
+
+    @abc.abstractmethod
+    def write_record(self, record: dict) -> None:
+        """Append a single record to the file."""
+        pass
+
+    @property
+    def records_in_memory(self) -> int:
+        """The number of records held in memory until they are written out."""
+        return 0
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Flush and close the file."""
+        pass
+
+
+class ShardedBatchWriter(BatchWriter):
+    """
+    Spread the records of a batch across several files.
+
+    The files are written to their own directory, named after `filepath`, so
+    they can be picked up together. Records go to the files in turn, or by a
+    hash of `shard_key` if given, which keeps records with the same key in the
+    same file.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        shard_count: int,
+        open_writer: Callable[[Path], BatchWriter],
+        shard_key: Optional[Callable[[dict], Any]] = None,
+    ) -> None:
+        self.filepath = filepath
+        stem, extension = split_extension(filepath)
+        self.directory = filepath.with_name(stem)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.shard_count = shard_count
+        self.shard_key = shard_key
+        self.shards = [
+            open_writer(self.directory / f"part-{i:03d}{extension}")
+            for i in range(shard_count)
+        ]
+        self.header = self.shards[0].header
+        self._next_shard = 0
+
+    @property
+    def filepaths(self) -> List[Path]:
+        return [shard.filepath for shard in self.shards]
+
+    @property
+    def record_count(self) -> int:  # type: ignore[override]
+        return sum(shard.record_count for shard in self.shards)
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(shard.bytes_written for shard in self.shards)
+
+    @property
+    def records_in_memory(self) -> int:
+        return sum(shard.records_in_memory for shard in self.shards)
+
+    def write_record(self, record: dict) -> None:
+        if self.shard_key is not None:
+            shard = hash(self.shard_key(record)) % self.shard_count
+        else:
+            shard = self._next_shard
+            self._next_shard = (shard + 1) % self.shard_count
+        self.shards[shard].write_record(record)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+        self.header = self.shards[0].header
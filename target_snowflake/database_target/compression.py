@@ -0,0 +1,182 @@
+"""Compress batch files as they are written, a block at a time."""
+
+import abc
+import collections
+import io
+import struct
+import zlib
+from concurrent.futures import Executor, Future
+from typing import Any, BinaryIO, Deque, Dict, Optional, Type
+
+
+class Codec(metaclass=abc.ABCMeta):
+    """A compression format Snowflake can load, split into independent blocks."""
+
+    # The COPY INTO file format's COMPRESSION
+    name: str
+    extension: str
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        self.level = level
+
+    def header(self) -> bytes:
+        return b""
+
+    @abc.abstractmethod
+    def compress_block(self, data: bytes, previous: bytes, last: bool) -> bytes:
+        """
+        Compress one block of the file. `previous` is the block before it, if
+        the format can use it to compress this one better.
+        """
+        pass
+
+    def trailer(self, crc: int, size: int) -> bytes:
+        return b""
+
+
+class GzipCodec(Codec):
+    """
+    Gzip, compressed the way pigz does it.
+
+    Each block is deflated on its own, primed with the end of the block before
+    it, and flushed to a byte boundary, so the blocks join up into a single
+    deflate stream that any gzip reader can decompress.
+    """
+
+    name = "GZIP"
+    extension = "gz"
+    # Deflate can refer back this far
+    window_size = 32 * 1024
+
+    def header(self) -> bytes:
+        # No name or timestamp, so the same rows always compress the same
+        return b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+    def compress_block(self, data: bytes, previous: bytes, last: bool) -> bytes:
+        level = self.level if self.level is not None else 6
+        options: Dict[str, Any] = {}
+        if previous:
+            options["zdict"] = previous[-self.window_size :]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **options)
+        return compressor.compress(data) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+    def trailer(self, crc: int, size: int) -> bytes:
+        return struct.pack("<II", crc, size & 0xFFFFFFFF)
+
+
+class ZstdCodec(Codec):
+    """Zstandard, with each block compressed as a frame of its own."""
+
+    name = "ZSTD"
+    extension = "zst"
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        # zstandard is an optional dependency, only needed for this codec
+        import zstandard  # noqa: F401
+
+        super().__init__(level)
+
+    def compress_block(self, data: bytes, previous: bytes, last: bool) -> bytes:
+        import zstandard
+
+        # Compressors aren't thread safe, and are cheap next to a block
+        level = self.level if self.level is not None else 3
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+CODECS: Dict[str, Type[Codec]] = {"gzip": GzipCodec, "zstd": ZstdCodec}
+
+
+def get_codec(name: Optional[str], level: Optional[int] = None) -> Optional[Codec]:
+    """Return the codec called `name`, or None to leave files uncompressed."""
+    if not name or name == "none":
+        return None
+    if name not in CODECS:
+        raise ValueError(
+            f"Unknown compression '{name}', expected one of: "
+            + ", ".join(["none", *CODECS])
+        )
+    return CODECS[name](level)
+
+
+class BlockCompressor(io.RawIOBase):
+    """
+    A writable file that compresses what is written to it into `raw`.
+
+    Writes are split into blocks of `block_size` bytes, which are compressed
+    concurrently on `executor` and written out in order as they finish, so
+    compressing a large file takes a fraction of the time of compressing it in
+    one stream. Without an executor, blocks are compressed as they fill up.
+
+    At most `max_pending_blocks` blocks are compressed at once; writing blocks
+    while that many are. `tell` is the uncompressed size written so far.
+    """
+
+    def __init__(
+        self,
+        raw: BinaryIO,
+        codec: Codec,
+        executor: Optional[Executor] = None,
+        block_size: int = 1024 * 1024,
+        max_pending_blocks: int = 8,
+    ) -> None:
+        super().__init__()
+        self.raw = raw
+        self.codec = codec
+        self.executor = executor
+        self.block_size = block_size
+        self.max_pending_blocks = max_pending_blocks
+        self._buffer = bytearray()
+        self._previous = b""
+        self._position = 0
+        self._crc = 0
+        self._pending: Deque[Future] = collections.deque()
+        self.raw.write(codec.header())
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data: Any) -> int:
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[: self.block_size])
+            del self._buffer[: self.block_size]
+            self._compress(block, last=False)
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self._compress(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self.raw.write(self._pending.popleft().result())
+            self.raw.write(self.codec.trailer(self._crc, self._position))
+        finally:
+            for future in self._pending:
+                future.cancel()
+            super().close()
+            self.raw.close()
+
+    def _compress(self, block: bytes, last: bool) -> None:
+        self._crc = zlib.crc32(block, self._crc)
+        if self.executor is None:
+            self.raw.write(self.codec.compress_block(block, self._previous, last))
+        else:
+            while self._pending and (
+                self._pending[0].done() or len(self._pending) >= self.max_pending_blocks
+            ):
+                self.raw.write(self._pending.popleft().result())
+            self._pending.append(
+                self.executor.submit(
+                    self.codec.compress_block, block, self._previous, last
+                )
+            )
+        self._previous = block
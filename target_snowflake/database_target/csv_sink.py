@@ -2,19 +2,129 @@
 
 import csv
 import datetime
+import io
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import BinaryIO, Dict, Iterable, List, Optional
 
 import pytz
 from singer_sdk.sinks import BatchSink
 
+from target_snowflake.database_target.batch_writer import BatchFiles, BatchWriter
+from target_snowflake.database_target.external_sort import (
+    ExternalSorter,
+    record_sort_key,
+)
+from target_snowflake.database_target.row_encoder import RowEncoder
+from target_snowflake.database_target.variant_encoder import (
+    StreamedJSON,
+    encode_variant,
+)
+
+
+class CSVBatchWriter(BatchWriter):
+    """
+    Incrementally write the records of a single batch to a CSV file.
+
+    Records are encoded and appended to the file as they are written, so a
+    batch only ever holds one open file handle and the file object's buffer.
+
+    Given an `encoder`, the header is the encoder's columns and each record is
+    written in that column order. Without one, the header is taken from the
+    keys of the first record, and objects and arrays are written as JSON.
+
+    Values the encoder returns as `StreamedJSON` are written to the file a
+    piece at a time, quoted and escaped the same way the CSV writer would.
+
+    Given a `fileobj`, the file is written to it instead of to `filepath`.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        encoder: Optional[RowEncoder] = None,
+        buffer_size: int = -1,
+        fileobj: Optional[BinaryIO] = None,
+    ) -> None:
+        self.filepath = filepath
+        self.encoder = encoder
+        self.record_count = 0
+        self.header: List[str] = []
+        self._raw: BinaryIO
+        if fileobj is not None:
+            self._raw = io.BufferedWriter(fileobj)  # type: ignore[arg-type]
+        else:
+            self._raw = open(filepath, "wb", buffering=buffer_size)
+        self._fp = io.TextIOWrapper(self._raw, encoding="utf-8", newline="")
+        self._size = 0
+        self._writer = csv.writer(self._fp, delimiter=",")
+        self._streamed_indexes: List[int] = []
+        if encoder is not None:
+            self.header = encoder.columns
+            self._writer.writerow(self.header)
+            self._streamed_indexes = encoder.streamed_indexes
+
+    def write_record(self, record: dict) -> None:
+        """Append a single record to the file."""
+        if self.encoder is not None:
+            row = self.encoder.encode(record)
+            for i in self._streamed_indexes:
+                if row[i].__class__ is StreamedJSON:
+                    self._write_streamed_row(row)
+                    break
+            else:
+                self._writer.writerow(row)
+            self.record_count += 1
+            return
+
+        if self.record_count == 0:
+            self.header = list(record.keys())
+            self._writer.writerow(self.header)
+
+        self._writer.writerow(
+            [
+                encode_variant(value) if isinstance(value, (dict, list)) else value
+                for value in record.values()
+            ]
+        )
+        self.record_count += 1
+
+    def _write_streamed_row(self, row: tuple) -> None:
+        write = self._fp.write
+        field_writer = csv.writer(self._fp, delimiter=",", lineterminator="")
+        for i, value in enumerate(row):
+            if i:
+                write(",")
+            if value.__class__ is StreamedJSON:
+                # JSON text always contains quotes, so is always enclosed
+                write('"')
+                for chunk in value.chunks():
+                    write(chunk.replace('"', '""'))
+                write('"')
+            elif value is not None and value != "":
+                # Empty values are left unenclosed, so they load as NULL
+                field_writer.writerow((value,))
+        write(self._writer.dialect.lineterminator)
+
+    @property
+    def bytes_written(self) -> int:
+        # Doesn't count text still waiting to be encoded, which is a few KB at most
+        return self._raw.tell() if not self._raw.closed else self._size
+
+    def close(self) -> None:
+        """Flush and close the underlying file."""
+        self._fp.flush()
+        self._size = self._raw.tell()
+        self._fp.close()
+
 
 class CSVSink(BatchSink):
     """CSV target sink class."""
 
     max_size = sys.maxsize  # We want all records in one batch
+    file_extension = "csv"
 
+    @property
     def timestamp_time(self) -> datetime.datetime:
         try:
             return self._timestamp_time
@@ -25,17 +135,34 @@ class CSVSink(BatchSink):
             return self._timestamp_time
 
     @property
-    def filepath_replacement_map(self) -> Dict[str, str]:
+    def streaming_writes(self) -> bool:
+        """
+        Return `True` to write each record to the batch file as it arrives.
+
+        Sorting needs the whole batch up front, so it always falls back to
+        buffering the batch.
+        """
+        return self.config.get("streaming_writes", False) and not self.sort_properties
+
+    @property
+    def sort_properties(self) -> List[str]:
+        """The properties to sort the records of each batch file by."""
+        if self.config.get("record_sort_property_name"):
+            return [self.config["record_sort_property_name"]]
+        return []
+
+    def filepath_replacement_map(self, context: dict) -> Dict[str, str]:
         return {
             "stream_name": self.stream_name,
+            "batch_id": context.get("batch_id", ""),
+            "file_extension": self.file_extension,
             "datestamp": self.timestamp_time.strftime(self.config["datestamp_format"]),
             "timestamp": self.timestamp_time.strftime(self.config["timestamp_format"]),
         }
 
-    @property
-    def destination_path(self) -> Path:
+    def destination_path(self, context: dict) -> Path:
         result = self.config["file_naming_scheme"]
-        for key, val in self.filepath_replacement_map.items():
+        for key, val in self.filepath_replacement_map(context).items():
             replacement_pattern = "{" f"{key}" "}"
             if replacement_pattern in result:
                 result = result.replace(replacement_pattern, val)
@@ -45,21 +172,39 @@ class CSVSink(BatchSink):
 
         return Path(result)
 
-    def _write_csv(self, filepath: Path, records: List[dict]) -> None:
+    @property
+    def row_encoder(self) -> Optional[RowEncoder]:
+        """
+        Return the encoder used to turn records into rows.
+
+        Override to write a fixed set of columns; by default the columns are
+        taken from the first record of each batch.
+        """
+        return None
+
+    def open_writer(self, filepath: Path) -> BatchWriter:
+        """Open a writer for a new batch file."""
+        return CSVBatchWriter(filepath, encoder=self.row_encoder)
+
+    def _write_csv(self, filepath: Path, records: Iterable[dict]) -> BatchFiles:
         """Write a CSV file."""
-        with open(filepath, "wt") as fp:
-            writer = csv.writer(fp, delimiter=",")
-            for i, record in enumerate(records, start=1):
-                if i == 1:
-                    writer.writerow(record.keys())
+        writer = self.open_writer(filepath)
+        try:
+            for record in records:
+                writer.write_record(record)
+        finally:
+            writer.close()
+        return writer
 
-                writer.writerow(record.values())
+    def _record_written_file(self, context: dict, writer: BatchFiles) -> None:
+        context["filepaths"] = writer.filepaths
+        context["record_count"] = writer.record_count
+        context["bytes_written"] = writer.bytes_written
+        context["header"] = writer.header
 
-    def process_batch(self, context: dict) -> None:
-        """Write out any prepped records and return once fully written."""
-        output_file: Path = self.destination_path
-        self.logger.info(f"Writing to destination file '{output_file.resolve()}'...")
-        new_contents: dict
+    def start_batch(self, context: dict) -> None:
+        """Pick the destination file for the batch, opening it if streaming."""
+        output_file: Path = self.destination_path(context)
         create_new = (
             self.config["overwrite_behavior"] == "replace_file"
             or not output_file.exists()
@@ -67,15 +212,68 @@ class CSVSink(BatchSink):
         if not create_new:
             raise NotImplementedError("Append mode is not yet supported.")
 
-        if not isinstance(context["records"], list):
-            self.logger.warning(f"No values in {self.stream_name} records collection.")
-            context["records"] = []
+        context["filepath"] = output_file
+        if self.streaming_writes:
+            self.logger.info(
+                f"Streaming records to destination file '{output_file.resolve()}'..."
+            )
+            context["writer"] = self.open_writer(output_file)
+        elif self.sort_properties:
+            # Spill sorted runs next to the batch files
+            context["sorter"] = ExternalSorter(
+                record_sort_key(self.sort_properties),
+                run_size=self.config.get("sort_buffer_rows", 25000),
+                directory=output_file.parent,
+            )
+
+    def process_record(self, record: dict, context: dict) -> None:
+        """
+        Buffer the record, or append it to the batch file when streaming.
+
+        When sorting, records are buffered by the batch's `ExternalSorter`.
+        """
+        writer: Optional[BatchWriter] = context.get("writer")
+        if writer is not None:
+            writer.write_record(record)
+        elif "sorter" in context:
+            context["sorter"].add(record)
+        else:
+            super().process_record(record, context)
 
-        records: List[Dict[str, Any]] = context["records"]
-        if "record_sort_property_name" in self.config:
-            sort_property_name = self.config["record_sort_property_name"]
-            records = sorted(records, key=lambda x: x[sort_property_name])
+    def process_batch(self, context: dict) -> None:
+        """Write out any prepped records and return once fully written."""
+        output_file: Path = context["filepath"]
+        writer: Optional[BatchWriter] = context.pop("writer", None)
+        if writer is not None:
+            writer.close()
+            self._record_written_file(context, writer)
+            self.logger.info(
+                f"Wrote {writer.record_count} records to '{output_file.resolve()}'."
+            )
+            return
 
-        self.logger.info(f"Writing {len(context['records'])} records to file...")
+        self.logger.info(f"Writing to destination file '{output_file.resolve()}'...")
+        sorter: Optional[ExternalSorter] = context.pop("sorter", None)
+        records: Iterable[dict]
+        if isinstance(context.get("records"), list):
+            records = context["records"]
+            if self.sort_properties:
+                # Sort in place rather than holding a sorted copy of the batch
+                context["records"].sort(key=record_sort_key(self.sort_properties))
+            self.logger.info(f"Writing {len(context['records'])} records to file...")
+        elif sorter is not None:
+            records = sorter
+            self.logger.info(
+                f"Merging {len(sorter)} records from {len(sorter.runs) + 1} sorted "
+                "run(s) to file..."
+            )
+        else:
+            self.logger.warning(f"No values in {self.stream_name} records collection.")
+            records = []
 
-        self._write_csv(output_file, context["records"])
+        try:
+            files: BatchFiles = self._write_csv(output_file, records)
+        finally:
+            if sorter is not None:
+                sorter.close()
+        self._record_written_file(context, files)
@@ -0,0 +1,122 @@
+"""Sort batches larger than memory by spilling sorted runs to disk."""
+
+import datetime
+import decimal
+import heapq
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+SortKey = Callable[[dict], Tuple]
+
+
+def sortable(value: Any) -> Tuple:
+    """
+    Return a key that orders values of mixed types without raising.
+
+    Numbers sort before strings, which sort before other types (grouped by
+    type), and nulls sort last as in Snowflake's default `ORDER BY`. Values
+    that aren't comparable themselves, like objects, sort by their text.
+    Naive datetimes and times sort as UTC, as they are loaded.
+    """
+    if value is None:
+        return (3,)
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    if isinstance(value, (datetime.datetime, datetime.time)):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return (2, type(value).__name__, value)
+    if isinstance(value, datetime.date):
+        return (2, type(value).__name__, value)
+    return (2, type(value).__name__, str(value))
+
+
+def record_sort_key(properties: Sequence[str]) -> SortKey:
+    """Return a sort key for records on the given properties, in order."""
+    if len(properties) == 1:
+        (name,) = properties
+        return lambda record: sortable(record.get(name))
+    return lambda record: tuple(sortable(record.get(name)) for name in properties)
+
+
+class ExternalSorter:
+    """
+    Sort records in bounded memory.
+
+    Records are buffered until `run_size` have been added, then the buffer is
+    sorted and written to a temporary file as a sorted run. Iterating over the
+    sorter merges the runs and the final buffer, so at most `run_size`
+    records, plus one per run, are held in memory at once. Records are
+    pickled, so they come back with the same types they went in with.
+
+    Sorting is stable: records with equal keys keep the order they were added.
+    """
+
+    def __init__(
+        self, key: SortKey, run_size: int = 25000, directory: Optional[Path] = None
+    ) -> None:
+        self.key = key
+        self.run_size = run_size
+        self.directory = directory
+        self.runs: List[Path] = []
+        self._buffer: List[dict] = []
+        self._spilled = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer) + self._spilled
+
+    @property
+    def records_in_memory(self) -> int:
+        return len(self._buffer)
+
+    def add(self, record: dict) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self.run_size:
+            self._spill()
+
+    def __iter__(self) -> Iterator[dict]:
+        self._buffer.sort(key=self.key)
+        if not self.runs:
+            yield from self._buffer
+            self._buffer = []
+            return
+
+        try:
+            runs = [self._read_run(path) for path in self.runs]
+            yield from heapq.merge(*runs, iter(self._buffer), key=self.key)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Remove the spilled runs."""
+        for path in self.runs:
+            path.unlink()
+        self.runs = []
+        self._buffer = []
+        self._spilled = 0
+
+    def _spill(self) -> None:
+        self._buffer.sort(key=self.key)
+        fd, filename = tempfile.mkstemp(prefix="sort-run-", dir=self.directory)
+        with os.fdopen(fd, "wb") as fp:
+            # Pickle each record on its own, so neither side keeps a memo of
+            # every record in the run
+            for record in self._buffer:
+                pickle.dump(record, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(Path(filename))
+        self._spilled += len(self._buffer)
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(path: Path) -> Iterator[dict]:
+        with open(path, "rb", buffering=1024 * 1024) as fp:
+            while True:
+                try:
+                    yield pickle.load(fp)
+                except EOFError:
+                    return
@@ -0,0 +1,111 @@
+"""Parquet batch file writer."""
+
+from pathlib import Path
+from typing import Any, BinaryIO, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from target_snowflake.database_target.batch_writer import BatchWriter
+from target_snowflake.database_target.row_encoder import RowEncoder
+from target_snowflake.database_target.schema_migrator import ColumnType
+
+ARROW_TYPES = {
+    # Snowflake's NUMBER holds 38 digits, more than fit in an int64
+    "NUMBER": pa.decimal128(38, 0),
+    "FLOAT": pa.float64(),
+    "TEXT": pa.string(),
+    "BOOLEAN": pa.bool_(),
+    "DATE": pa.date32(),
+    "TIMESTAMP_TZ": pa.timestamp("us", tz="UTC"),
+    # Semi-structured values are written as JSON text and parsed on load
+    "VARIANT": pa.string(),
+    "ARRAY": pa.string(),
+}
+
+
+def convert_sql_type_to_arrow_type(type: ColumnType) -> pa.DataType:
+    """Return the Parquet column type used to stage a column of the given type."""
+    return ARROW_TYPES.get(type, pa.string())
+
+
+class ParquetBatchWriter(BatchWriter):
+    """
+    Incrementally write the records of a single batch to a Parquet file.
+
+    Encoded rows are buffered until a row group is full and then written out
+    as dictionary encoded, compressed columns, so memory use is bounded by the
+    row group size rather than the batch size.
+
+    Given a `fileobj`, the file is written to it instead of to `filepath`.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        encoder: RowEncoder,
+        row_group_size: int = 50000,
+        compression: str = "snappy",
+        fileobj: Optional[BinaryIO] = None,
+    ) -> None:
+        self.filepath = filepath
+        self.encoder = encoder
+        self.row_group_size = row_group_size
+        self.record_count = 0
+        self.header: List[str] = encoder.columns
+        self.schema = pa.schema(
+            [
+                (column, convert_sql_type_to_arrow_type(type))
+                for column, type in encoder.column_definitions.items()
+            ]
+        )
+        self._rows: List[tuple] = []
+        self._fp = fileobj if fileobj is not None else open(filepath, "wb")
+        self._writer = pq.ParquetWriter(
+            self._fp, self.schema, compression=compression, use_dictionary=True
+        )
+        self._size = 0
+
+    @property
+    def bytes_written(self) -> int:
+        # Only counts row groups that have been written out
+        return self._fp.tell() if not self._fp.closed else self._size
+
+    @property
+    def records_in_memory(self) -> int:
+        return len(self._rows)
+
+    def write_record(self, record: dict) -> None:
+        """Append a single record to the file."""
+        self._rows.append(self.encoder.encode(record))
+        self.record_count += 1
+        if len(self._rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def close(self) -> None:
+        """Write any buffered rows and close the file."""
+        if self._rows:
+            self._write_row_group()
+        self._writer.close()
+        self._size = self._fp.tell()
+        self._fp.close()
+
+    def _write_row_group(self) -> None:
+        columns = zip(*self._rows) if self._rows else ()
+        arrays = [
+            self._to_array(values, field.type)
+            for values, field in zip(columns, self.schema)
+        ]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._rows = []
+
+    @staticmethod
+    def _to_array(values: Sequence[Any], type: pa.DataType) -> pa.Array:
+        try:
+            return pa.array(values, type=type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # e.g. dates and timestamps that arrived as strings
+            return pa.array(
+                [None if value is None else str(value) for value in values],
+                type=pa.string(),
+            ).cast(type)
@@ -0,0 +1,133 @@
+"""Compile a stream's column definitions into a fast record-to-row encoder."""
+
+import datetime
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from target_snowflake.database_target.schema_migrator import ColumnType, PropertyPath
+from target_snowflake.database_target.variant_encoder import (
+    StreamedJSON,
+    encode_variant,
+)
+
+# Statements that convert the value in `{v}` for a column of each type, inlined
+# into the compiled encoder to avoid a function call per value. `None` means
+# the value is written as is: the CSV writer calls `str()` on it, which already
+# produces a format Snowflake parses for that type (e.g. `True`, `1.5` or
+# `2021-09-20 12:45:00+00:00`).
+CONVERTERS: Dict[ColumnType, Optional[str]] = {
+    # bool is a subclass of int, but "True" is not a valid NUMBER
+    "NUMBER": "if {v}.__class__ is bool: {v} = int({v})",
+    "FLOAT": "if {v}.__class__ is bool: {v} = float({v})",
+    "TIMESTAMP_TZ": None,
+    # str() of a datetime includes the time, which doesn't parse as a DATE
+    "DATE": "if {v}.__class__ is datetime: {v} = {v}.date()",
+    "BOOLEAN": None,
+    "VARIANT": "if {v} is not None: {v} = encode_variant({v})",
+    "ARRAY": "if {v} is not None: {v} = encode_variant({v})",
+    # Values of a narrower type may be kept in a TEXT column
+    "TEXT": "if {v} is not None and {v}.__class__ is not str: {v} = str({v})",
+}
+
+NESTED_TYPES = ("VARIANT", "ARRAY")
+
+# Used instead for nested columns when large values are streamed
+STREAMING_CONVERTER = (
+    "if {v} is not None: {v} = StreamedJSON({v}) "
+    "if ({v}.__class__ is dict or {v}.__class__ is list) "
+    "and len({v}) > {threshold} else encode_variant({v})"
+)
+
+
+class RowEncoder:
+    """
+    Turn records into rows with a fixed column order.
+
+    The encoder is compiled once per stream from the migrator's column
+    definitions into a single function that builds the row tuple in one pass.
+    Properties missing from a record are encoded as `None`, and properties that
+    aren't in the schema are dropped.
+
+    Flattened columns are read from nested objects by their path of keys. The
+    lookups are unrolled into the encoder, and each object on the way is only
+    looked up once per record, however many columns are read from it. A path
+    through a missing or non-object value gives `None`.
+
+    Nested values are encoded as JSON text. If `stream_threshold` is set,
+    objects and arrays with more elements than that are encoded as
+    `StreamedJSON` instead, for writers that can write them piece by piece.
+    """
+
+    def __init__(
+        self,
+        column_definitions: Dict[str, ColumnType],
+        column_properties: Dict[str, PropertyPath],
+        stream_threshold: Optional[int] = None,
+    ) -> None:
+        """
+        Compile the encoder.
+
+        Args:
+            column_definitions: Map of column names to their SQL data types, in
+                the order the columns should be written.
+            column_properties: Map of column names to the record property each
+                column is read from, or the path of keys to a nested property.
+            stream_threshold: Number of elements above which nested values
+                are encoded as `StreamedJSON`.
+        """
+        self.columns: List[str] = list(column_definitions)
+        self.column_definitions = column_definitions
+        self.column_properties = column_properties
+        self.stream_threshold = stream_threshold
+        # Positions in the row that may hold a `StreamedJSON`
+        self.streamed_indexes: List[int] = []
+        if stream_threshold is not None:
+            self.streamed_indexes = [
+                i
+                for i, type in enumerate(column_definitions.values())
+                if type in NESTED_TYPES
+            ]
+        self.encode: Callable[[dict], tuple] = self._compile()
+
+    def _compile(self) -> Callable[[dict], tuple]:
+        lines = ["def encode(record):", "    get = record.get"]
+        # Variables holding the object at each path, looked up as needed
+        objects: Dict[Tuple[str, ...], str] = {(): "record"}
+
+        def lookup(path: Tuple[str, ...]) -> str:
+            if path not in objects:
+                parent = lookup(path[:-1])
+                getter = "get" if parent == "record" else f"{parent}.get"
+                name = objects[path] = f"o{len(objects)}"
+                lines.append(f"    {name} = {getter}({path[-1]!r})")
+                lines.append(f"    if {name}.__class__ is not dict: {name} = EMPTY")
+            return objects[path]
+
+        values = []
+        for i, (column, type) in enumerate(self.column_definitions.items()):
+            v = f"v{i}"
+            path = self.column_properties[column]
+            if isinstance(path, str):
+                lines.append(f"    {v} = get({path!r})")
+            else:
+                parent = lookup(path[:-1])
+                getter = "get" if parent == "record" else f"{parent}.get"
+                lines.append(f"    {v} = {getter}({path[-1]!r})")
+            converter = CONVERTERS.get(type)
+            if self.stream_threshold is not None and type in NESTED_TYPES:
+                converter = STREAMING_CONVERTER
+            if converter is not None:
+                lines.append(
+                    "    " + converter.format(v=v, threshold=self.stream_threshold)
+                )
+            values.append(f"{v}, ")
+        lines.append("    return ({})".format("".join(values)))
+
+        namespace: Dict[str, Any] = {
+            "datetime": datetime.datetime,
+            "encode_variant": encode_variant,
+            "StreamedJSON": StreamedJSON,
+            "EMPTY": MappingProxyType({}),
+        }
+        exec("\n".join(lines), namespace)
+        return namespace["encode"]
@@ -1,10 +1,16 @@
 import abc
+import threading
 import time
-from typing import Any, Dict, List, Mapping, Optional
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Union
 
 from singer_sdk.sinks import Sink
 
 ColumnType = str
+# A top level record property, or the keys leading to a nested one
+PropertyPath = Union[str, Tuple[str, ...]]
+
+# Joins the keys of a flattened property in its column name
+FLATTEN_SEPARATOR = "__"
 
 
 def convert_jsonschema_types_to_lists(jsonschema: dict) -> dict:
@@ -30,6 +36,96 @@ def convert_jsonschema_types_to_lists(jsonschema: dict) -> dict:
     return new_schema
 
 
+class TableSchemaCache:
+    """
+    A thread-safe, in-process cache of table name to column definitions.
+
+    The cache is meant to be filled by a single introspection pass over the
+    whole schema and shared by every migrator writing to that schema. Once
+    loaded, a table missing from the cache is known not to exist. Tables can be
+    invalidated individually, after which they are unknown until refreshed.
+    """
+
+    def __init__(self) -> None:
+        self._tables: Dict[str, Optional[Dict[str, ColumnType]]] = {}
+        self._invalidated: Set[str] = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, tables: Dict[str, Dict[str, ColumnType]]) -> None:
+        """Replace the cache with the full set of tables in the schema."""
+        with self._lock:
+            self._tables = {name: dict(columns) for name, columns in tables.items()}
+            self._invalidated = set()
+            self._loaded = True
+
+    def is_known(self, table_name: str) -> bool:
+        """Return `True` if the cache can answer for the table."""
+        with self._lock:
+            return table_name in self._tables or (
+                self._loaded and table_name not in self._invalidated
+            )
+
+    def get(self, table_name: str) -> Optional[Dict[str, ColumnType]]:
+        """Return a copy of the table's columns, or None if it doesn't exist."""
+        with self._lock:
+            columns = self._tables.get(table_name)
+            return dict(columns) if columns is not None else None
+
+    def set_table(
+        self, table_name: str, columns: Optional[Dict[str, ColumnType]]
+    ) -> None:
+        """Record the columns of a table, or None if it doesn't exist."""
+        with self._lock:
+            self._tables[table_name] = dict(columns) if columns is not None else None
+            self._invalidated.discard(table_name)
+
+    def add_column(self, table_name: str, column_name: str, type: ColumnType) -> None:
+        with self._lock:
+            columns = self._tables.get(table_name)
+            if columns is not None:
+                columns[column_name] = type
+
+    def rename_column(self, table_name: str, old_name: str, new_name: str) -> None:
+        with self._lock:
+            columns = self._tables.get(table_name)
+            if columns is not None and old_name in columns:
+                columns[new_name] = columns.pop(old_name)
+
+    def invalidate(self, table_name: str) -> None:
+        """Forget what is known about a table so it is looked up again."""
+        with self._lock:
+            self._tables.pop(table_name, None)
+            self._invalidated.add(table_name)
+
+
+class MigrationPlan:
+    """The changes needed to bring a table in line with its stream's schema."""
+
+    def __init__(self, table_name: str) -> None:
+        self.table_name = table_name
+        self.create_columns: Optional[Dict[str, ColumnType]] = None
+        self.renamed_columns: Dict[str, str] = {}
+        self.added_columns: Dict[str, ColumnType] = {}
+
+    def create_table(self, column_definitions: Dict[str, ColumnType]) -> None:
+        self.create_columns = dict(column_definitions)
+
+    def rename_column(self, old_name: str, new_name: str) -> None:
+        self.renamed_columns[old_name] = new_name
+
+    def add_column(self, column_name: str, type: ColumnType) -> None:
+        self.added_columns[column_name] = type
+
+    @property
+    def is_empty(self) -> bool:
+        return (
+            self.create_columns is None
+            and not self.renamed_columns
+            and not self.added_columns
+        )
+
+
 class SchemaMigrator(metaclass=abc.ABCMeta):
     def __init__(
         self,
@@ -56,33 +152,70 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
         Create or update the table schema for the given stream.
 
         This is the main entrypoint method for this class.
+
+        If the migration fails because the known table schema was out of date
+        (see `is_stale_schema_error`), the table is looked up again and the
+        migration retried once.
         """
-        existing_schema = self.get_table(self.table_name)
-        if not existing_schema:
+        try:
+            return self._sync_table_schema()
+        except Exception as e:
+            if not self.is_stale_schema_error(e):
+                raise
             self.logger.info(
-                f"Creating table '{self.table_name}' for stream "
-                f"'{self.stream_name}' with key properties: {self.key_properties}"
+                f"Schema of table '{self.table_name}' changed underneath us, "
+                "refreshing it and retrying the migration"
             )
-            self.create_table(
-                self.table_name, self.key_properties, self.column_definitions
-            )
-            return self.column_definitions
+            self.invalidate_table(self.table_name)
+            return self._sync_table_schema()
+
+    def _sync_table_schema(self) -> Dict[str, ColumnType]:
+        plan = self.plan_migration(self.get_table(self.table_name))
+        self.apply_migration_plan(plan)
+        return self.column_definitions
+
+    def plan_migration(
+        self, existing_schema: Optional[Dict[str, ColumnType]]
+    ) -> MigrationPlan:
+        """Work out every change the table needs before making any of them."""
+        plan = MigrationPlan(self.table_name)
+        if not existing_schema:
+            plan.create_table(self.column_definitions)
+            return plan
 
         for column_name, type in self.column_definitions.items():
             if column_name not in existing_schema:
-                self.logger.info(
-                    "Adding column '{column_name}' to table '{table_name}'"
-                )
-                self.add_column(self.table_name, column_name, type)
+                plan.add_column(column_name, type)
             elif type != existing_schema[column_name]:
-                self.on_column_conflict(column_name, existing_schema[column_name], type)
-            else:
-                self.logger.debug(
-                    f"Table '{self.table_name}' for stream '{self.stream_name}' "
-                    " already exists with the proper schema"
+                self.on_column_conflict(
+                    plan, column_name, existing_schema[column_name], type
                 )
 
-        return self.column_definitions
+        if plan.is_empty:
+            self.logger.debug(
+                f"Table '{self.table_name}' for stream '{self.stream_name}' "
+                "already exists with the proper schema"
+            )
+        return plan
+
+    def apply_migration_plan(self, plan: MigrationPlan) -> None:
+        """Make the changes in `plan` with as few statements as possible."""
+        if plan.create_columns is not None:
+            self.logger.info(
+                f"Creating table '{plan.table_name}' for stream "
+                f"'{self.stream_name}' with key properties: {self.key_properties}"
+            )
+            self.create_table(plan.table_name, self.key_properties, plan.create_columns)
+            return
+
+        for old_name, new_name in plan.renamed_columns.items():
+            self.rename_column(plan.table_name, old_name, new_name)
+        if plan.added_columns:
+            self.logger.info(
+                f"Adding columns {list(plan.added_columns)} "
+                f"to table '{plan.table_name}'"
+            )
+            self.add_columns(plan.table_name, plan.added_columns)
 
     @property
     def config(self) -> Mapping[str, Any]:
@@ -95,6 +228,58 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
             self._column_definitions = self.create_column_definitions(self.schema)
         return self._column_definitions
 
+    @property
+    def column_properties(self) -> Dict[str, PropertyPath]:
+        """
+        Return a mapping of column names to the record properties they hold.
+
+        Flattened properties are given by their path of keys in the record.
+        """
+        return {
+            self.convert_property_path_to_column_name(path): (
+                path[0] if len(path) == 1 else path
+            )
+            for path in self.flatten_properties(self.schema)
+        }
+
+    @property
+    def flatten_max_depth(self) -> int:
+        """How many levels of nested objects to expand into columns."""
+        return self.config.get("flatten_max_depth") or 0
+
+    def flatten_properties(self, schema: dict) -> Dict[Tuple[str, ...], dict]:
+        """
+        Return the definition of each property that gets its own column, by
+        its path of keys in the record.
+
+        Objects with declared properties are expanded into a column for each
+        of them, up to `flatten_max_depth` levels deep. Deeper objects, and
+        objects that can also be other types, are kept whole.
+        """
+        flattened: Dict[Tuple[str, ...], dict] = {}
+
+        def flatten(properties: dict, prefix: Tuple[str, ...]) -> None:
+            for name, definition in properties.items():
+                path = prefix + (name,)
+                if len(path) <= self.flatten_max_depth and self._is_flattenable(
+                    definition
+                ):
+                    flatten(definition["properties"], path)
+                else:
+                    flattened[path] = definition
+
+        flatten(schema["properties"], ())
+        return flattened
+
+    @staticmethod
+    def _is_flattenable(definition: dict) -> bool:
+        types = set(definition.get("type", []))
+        return (
+            "object" in types
+            and types <= {"object", "null"}
+            and bool(definition.get("properties"))
+        )
+
     @property
     def table_name(self) -> str:
         if not self._table_name:
@@ -102,18 +287,38 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
         return self._table_name
 
     def on_column_conflict(
-        self, column_name: str, old_type: ColumnType, new_type: ColumnType
+        self,
+        plan: MigrationPlan,
+        column_name: str,
+        old_type: ColumnType,
+        new_type: ColumnType,
     ):
         """
-        Handle a change in data type for a column.
-
-        The default implementation versions the column by renaming the old column
-        unless `raise_on_column_conflicts` is enabled.
+        Plan how to handle a change in data type for a column.
+
+        If `type_lattice` is set and the old type is at least as wide as the
+        new one, the column is kept as it is. Otherwise the default
+        implementation versions the column by renaming the old column unless
+        `raise_on_column_conflicts` is enabled. The new column is of the
+        narrowest type both types widen to, so that the column doesn't have to
+        be versioned again when the type changes back.
         """
+        common_type = self.common_type(old_type, new_type)
+        if common_type == old_type:
+            self.logger.debug(
+                f"Column '{column_name}' on table '{self.table_name}' changed from "
+                f"{old_type} to {new_type}, which fits in the existing column"
+            )
+            self.column_definitions[column_name] = old_type
+            return
+        if common_type is not None:
+            new_type = common_type
+            self.column_definitions[column_name] = new_type
+
         if self.raise_on_column_conflicts:
             raise Exception(
-                f"Column '{column_name}' on table '{self.table_name}' changed from ",
-                f"{old_type} to {new_type}.",
+                f"Column '{column_name}' on table '{self.table_name}' changed from "
+                f"{old_type} to {new_type}."
             )
 
         new_column_name = self.version_column_name(column_name)
@@ -123,8 +328,40 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
             f"Versioning column by renaming it to '{new_column_name}' and "
             "adding a new column in it's place."
         )
-        self.rename_column(self.table_name, column_name, new_column_name)
-        self.add_column(self.table_name, column_name, new_type)
+        plan.rename_column(column_name, new_column_name)
+        plan.add_column(column_name, new_type)
+
+    @property
+    def type_lattice(self) -> Optional[Dict[ColumnType, ColumnType]]:
+        """
+        Map each data type to the next wider type that can hold all its values,
+        e.g. `{"NUMBER": "FLOAT", "FLOAT": "TEXT"}`.
+
+        Return None (the default) to version the column on every type change.
+        """
+        return None
+
+    def common_type(
+        self, old_type: ColumnType, new_type: ColumnType
+    ) -> Optional[ColumnType]:
+        """
+        Return the narrowest type in `type_lattice` that both types widen to,
+        or None if there isn't one.
+        """
+        lattice = self.type_lattice
+        if lattice is None:
+            return None
+
+        wider_types = [old_type]
+        while wider_types[-1] in lattice and len(wider_types) <= len(lattice):
+            wider_types.append(lattice[wider_types[-1]])
+        # A lattice from the config may have cycles, so bound both walks
+        type: Optional[ColumnType] = new_type
+        for _ in range(len(lattice) + 1):
+            if type is None or type in wider_types:
+                return type
+            type = lattice.get(type)
+        return None
 
     @property
     def raise_on_column_conflicts(self) -> bool:
@@ -137,10 +374,10 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
         SQL data types.
         """
         return {
-            self.convert_property_name_to_column_name(
-                name
+            self.convert_property_path_to_column_name(
+                path
             ): self.convert_jsonschema_to_sql_type(definition)
-            for name, definition in schema["properties"].items()
+            for path, definition in self.flatten_properties(schema).items()
         }
 
     def convert_stream_name_to_table_name(self, stream_name: str) -> str:
@@ -151,6 +388,21 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
         """Convert the name of a record property to a column name for the table."""
         return column_name
 
+    def convert_property_path_to_column_name(self, path: Tuple[str, ...]) -> str:
+        """Convert the path of a (possibly flattened) property to a column name."""
+        return self.convert_property_name_to_column_name(FLATTEN_SEPARATOR.join(path))
+
+    def is_stale_schema_error(self, error: Exception) -> bool:
+        """
+        Return `True` if `error` means a migration was planned against an out of
+        date table schema, e.g. a table created by another process.
+        """
+        return False
+
+    def invalidate_table(self, table_name: str) -> None:
+        """Forget any cached schema for the table."""
+        pass
+
     def version_column_name(self, column_name: str) -> str:
         """Return a new name for a versioned column."""
         return "{}_{}".format(column_name, time.strftime("%Y%m%d_%H%M"))
@@ -200,6 +452,15 @@ class SchemaMigrator(metaclass=abc.ABCMeta):
         """
         pass
 
+    def add_columns(self, table_name: str, columns: Dict[str, ColumnType]) -> None:
+        """
+        Add several columns to an existing table.
+
+        Override to add them in a single statement.
+        """
+        for column_name, type in columns.items():
+            self.add_column(table_name, column_name, type)
+
     @abc.abstractmethod
     def rename_column(self, table_name: str, old_name: str, new_name: str) -> None:
         """
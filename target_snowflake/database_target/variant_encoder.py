@@ -0,0 +1,58 @@
+"""Serialize nested values for VARIANT and ARRAY columns as compact JSON."""
+
+import json
+from typing import Any, Iterator
+
+try:
+    # orjson is an optional dependency which serializes several times faster
+    import orjson
+
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Building the encoder once, rather than on every `json.dumps` call with
+# non-default options, is most of the cost for small values. Datetimes are
+# written with `str()` either way, so output doesn't depend on orjson.
+_encoder = json.JSONEncoder(
+    ensure_ascii=False, check_circular=False, separators=(",", ":"), default=str
+)
+
+
+def encode_variant(value: Any) -> str:
+    """Return the compact JSON text of a nested value."""
+    cls = value.__class__
+    if cls is dict or cls is list:
+        if not value:
+            return "{}" if cls is dict else "[]"
+    elif cls is str:
+        return _encoder.encode(value)
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=str, option=ORJSON_OPTIONS).decode()
+        except TypeError:
+            # e.g. integers wider than 64 bits
+            pass
+    return _encoder.encode(value)
+
+
+class StreamedJSON:
+    """
+    A nested value that is large enough to be written out piece by piece.
+
+    `chunks` yields the JSON text in small pieces, so it can be written to the
+    batch file without building the whole text, and an escaped copy of it, in
+    memory.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def chunks(self) -> Iterator[str]:
+        return _encoder.iterencode(self.value)
+
+    def __str__(self) -> str:
+        return encode_variant(self.value)
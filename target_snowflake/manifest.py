@@ -0,0 +1,132 @@
+"""A local journal of batch loads, so a crashed run can finish them."""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+WRITTEN = "written"
+STAGED = "staged"
+COPIED = "copied"
+
+
+class LoadManifest:
+    """
+    A durable record of each batch's files and how far their load has got.
+
+    Events are appended to a JSON lines file and synced to disk before the
+    load moves on, so after a crash the file says which batches were written
+    locally, which were uploaded to the stage and which were copied into
+    their table.
+
+    Alongside, it records each STATE before it is emitted, with the batches
+    that still had to be loaded for it to be safe. If the run dies while those
+    loads are in progress, `recoverable` returns the latest such STATE whose
+    batches can all be finished from their local or staged files, so the next
+    run can finish them and emit the STATE instead of having the tap extract
+    the records again.
+
+    Once a STATE has been emitted every batch before it is loaded, and the
+    file is emptied.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # Batches handed to a load pipeline and not yet copied
+        self._pending: Set[str] = set()
+
+    def submitted(self, batch_id: str) -> None:
+        with self._lock:
+            self._pending.add(batch_id)
+
+    def written(self, batch_id: str, **details: Any) -> None:
+        """Record that a batch's files were written, and how to load them."""
+        self._append({"event": WRITTEN, "batch": batch_id, **details})
+
+    def staged(self, batch_id: str, staged_files: List[str]) -> None:
+        self._append({"event": STAGED, "batch": batch_id, "staged_files": staged_files})
+
+    def copied(self, batch_id: str) -> None:
+        self._append({"event": COPIED, "batch": batch_id})
+        with self._lock:
+            self._pending.discard(batch_id)
+
+    def checkpoint(self, state: dict) -> None:
+        """Record a STATE that is about to be emitted once its loads finish."""
+        with self._lock:
+            batches = sorted(self._pending)
+        self._append({"event": "state", "value": state, "batches": batches})
+
+    def clear(self) -> None:
+        """Forget every batch, once they are all loaded."""
+        with self._lock:
+            if self.path.exists():
+                open(self.path, "w").close()
+
+    def recoverable(self) -> Tuple[Optional[dict], List[dict]]:
+        """
+        Return the latest STATE that can be recovered, and the batches that
+        must be loaded before it is emitted, in the order they were written.
+
+        Each batch is its `written` event, plus `staged_files` once it was
+        uploaded. Batches that aren't needed for the STATE aren't returned, as
+        the tap will send their records again.
+        """
+        batches: Dict[str, dict] = {}
+        states: List[dict] = []
+        for event in self._read():
+            kind = event.pop("event")
+            if kind == WRITTEN:
+                # Streamed batches are staged as they're written
+                status = STAGED if event.get("streamed") else WRITTEN
+                batches[event["batch"]] = {**event, "status": status}
+            elif kind == "state":
+                states.append(event)
+            elif event["batch"] in batches:
+                batches[event["batch"]].update(event, status=kind)
+
+        for state in reversed(states):
+            needed = set(state["batches"])
+            if all(self._can_finish(batches.get(batch_id)) for batch_id in needed):
+                return state["value"], [
+                    batch
+                    for batch_id, batch in batches.items()
+                    if batch_id in needed and batch["status"] != COPIED
+                ]
+        return None, []
+
+    @staticmethod
+    def _can_finish(batch: Optional[dict]) -> bool:
+        if batch is None:
+            # Never written, so its records only existed in memory
+            return False
+        if batch.get("streamed"):
+            # Only ever on the stage, which is where they're loaded from
+            return True
+        if batch["status"] == WRITTEN or batch["upsert"]:
+            # Upserts are loaded again from their local files
+            return all(os.path.exists(file) for file in batch["files"])
+        return True
+
+    def _append(self, event: dict) -> None:
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as fp:
+                fp.write(line)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def _read(self) -> List[dict]:
+        if not self.path.exists():
+            return []
+        events = []
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line may be cut short by the crash
+                    break
+        return events
@@ -0,0 +1,107 @@
+"""Accounting for the memory held by buffered records across sinks."""
+
+import sys
+import threading
+from typing import Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def deep_sizeof(value: object) -> int:
+    """Return the size in bytes of a decoded JSON value and everything in it."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + deep_sizeof(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += deep_sizeof(item)
+    return size
+
+
+class RecordSizeEstimator:
+    """
+    Estimate how much memory a stream's records take up.
+
+    Measuring every record would cost about as much as parsing it, so only
+    one in every `sample_every` records is measured, starting with the first.
+    """
+
+    def __init__(self, sample_every: int = 100) -> None:
+        self.sample_every = sample_every
+        self.bytes_per_record = 0.0
+        self._seen = 0
+
+    def observe(self, record: dict) -> None:
+        if self._seen % self.sample_every == 0:
+            size = deep_sizeof(record)
+            if not self.bytes_per_record:
+                self.bytes_per_record = size
+            else:
+                # Favour recent records, as the shape of the data drifts
+                self.bytes_per_record = 0.8 * self.bytes_per_record + 0.2 * size
+        self._seen += 1
+
+
+class MemoryBudget:
+    """
+    A limit on the memory held by records buffered across all sinks.
+
+    Once usage passes `budget_bytes`, the largest sinks are drained until
+    usage is back under `low_water` of the budget, so the target doesn't
+    immediately cross the budget again.
+
+    Drained batches wait on their load pipeline before they are written out,
+    so their records still count towards usage until then, through `queue`
+    and `dequeue`.
+    """
+
+    def __init__(self, budget_bytes: int, low_water: float = 0.75) -> None:
+        self.budget_bytes = budget_bytes
+        self.low_water = low_water
+        self._queued_bytes = 0
+        self._queue_changed = threading.Condition()
+
+    @property
+    def queued_bytes(self) -> int:
+        """The memory held by drained batches that haven't been written yet."""
+        return self._queued_bytes
+
+    def queue(self, nbytes: int) -> None:
+        with self._queue_changed:
+            self._queued_bytes += nbytes
+
+    def dequeue(self, nbytes: int) -> None:
+        with self._queue_changed:
+            self._queued_bytes -= nbytes
+            self._queue_changed.notify_all()
+
+    def over_budget(self, usage: Dict[T, int]) -> bool:
+        """Return `True` if buffered and queued records exceed the budget."""
+        return sum(usage.values()) + self._queued_bytes > self.budget_bytes
+
+    def wait_for_queue(self, buffered_bytes: int, timeout: Optional[float]) -> bool:
+        """
+        Block until the queued batches have been written out far enough for
+        usage to be back under the low water mark, given `buffered_bytes`
+        still buffered. Returns `False` if `timeout` passes first.
+        """
+        limit = max(self.budget_bytes * self.low_water - buffered_bytes, 0)
+        with self._queue_changed:
+            return self._queue_changed.wait_for(
+                lambda: self._queued_bytes <= limit, timeout
+            )
+
+    def sinks_to_drain(self, usage: Dict[T, int]) -> List[T]:
+        """Given the bytes buffered by each sink, return those to drain."""
+        if not self.over_budget(usage):
+            return []
+        total = sum(usage.values()) + self._queued_bytes
+
+        to_drain = []
+        for sink, size in sorted(usage.items(), key=lambda item: -item[1]):
+            if total <= self.budget_bytes * self.low_water or not size:
+                break
+            to_drain.append(sink)
+            total -= size
+        return to_drain
@@ -0,0 +1,137 @@
+"""Timers and counters for each stage of a load, reported as Singer metrics."""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from logging import Logger
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+# Tags that identify a single batch or statement are too many to be labels
+UNLABELED_TAGS = frozenset(["batch_id", "query_id"])
+
+MetricKey = Tuple[str, FrozenSet[Tuple[str, str]]]
+
+
+class Metrics:
+    """
+    Record timers and counters, tagged with e.g. the stream and batch ID.
+
+    Every measurement is logged as a Singer metric line, i.e.
+    `METRIC: {"type": "timer", "metric": ..., "value": ..., "tags": {...}}`.
+
+    If `textfile` is set, totals are also written to it in the Prometheus text
+    format, for the node exporter's textfile collector. Timers are written as
+    summaries of `<metric>_seconds` and counters as `<metric>_total`, labelled
+    with their tags other than batch and query IDs.
+    """
+
+    prefix = "target_snowflake"
+
+    def __init__(self, logger: Logger, textfile: Optional[str] = None) -> None:
+        self.logger = logger
+        self.textfile = textfile
+        self._counters: Dict[MetricKey, float] = {}
+        self._timers: Dict[MetricKey, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        # Load threads write the textfile after each batch
+        self._write_lock = threading.Lock()
+
+    def counter(self, metric: str, value: float, **tags: Any) -> None:
+        """Count `value` more of `metric`."""
+        self._log("counter", metric, value, tags)
+        key = self._key(metric, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, metric: str, **tags: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Time the block.
+
+        Yields the tags, so tags only known at the end (like a query ID) can be
+        added. The `status` tag records whether the block raised.
+        """
+        start = time.perf_counter()
+        tags["status"] = "succeeded"
+        try:
+            yield tags
+        except BaseException:
+            tags["status"] = "failed"
+            raise
+        finally:
+            self.time(metric, time.perf_counter() - start, **tags)
+
+    def time(self, metric: str, seconds: float, **tags: Any) -> None:
+        """Record an already measured duration of `metric`."""
+        self._log("timer", metric, seconds, tags)
+        key = self._key(metric, tags)
+        with self._lock:
+            count, total = self._timers.get(key, (0, 0.0))
+            self._timers[key] = (count + 1, total + seconds)
+
+    def write_textfile(self) -> None:
+        """Write the totals so far to `textfile`, replacing it atomically."""
+        if not self.textfile:
+            return
+        # Serialized, so that a later snapshot is never replaced by an earlier
+        # one and threads don't move each other's temporary file away
+        with self._write_lock:
+            self._write_textfile(self.textfile)
+
+    def _write_textfile(self, textfile: str) -> None:
+        with self._lock:
+            counters = sorted(self._counters.items(), key=self._sort_key)
+            timers = sorted(self._timers.items(), key=self._sort_key)
+
+        families: Dict[str, Tuple[str, List[str]]] = {}
+        for (metric, labels), value in counters:
+            name = f"{self.prefix}_{metric}_total"
+            samples = families.setdefault(name, ("counter", []))[1]
+            samples.append(f"{name}{self._labels(labels)} {value}")
+        for (metric, labels), (count, total) in timers:
+            name = f"{self.prefix}_{metric}_seconds"
+            samples = families.setdefault(name, ("summary", []))[1]
+            samples.append(f"{name}_count{self._labels(labels)} {count}")
+            samples.append(f"{name}_sum{self._labels(labels)} {total}")
+
+        lines = []
+        for name, (type, samples) in families.items():
+            lines.append(f"# TYPE {name} {type}")
+            lines.extend(samples)
+
+        tmp_path = f"{textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, textfile)
+
+    def _log(self, type: str, metric: str, value: float, tags: Dict[str, Any]) -> None:
+        point = {"type": type, "metric": metric, "value": value, "tags": tags}
+        self.logger.info("METRIC: %s", json.dumps(point, default=str))
+
+    @staticmethod
+    def _key(metric: str, tags: Dict[str, Any]) -> MetricKey:
+        return metric, frozenset(
+            (name, str(value))
+            for name, value in tags.items()
+            if name not in UNLABELED_TAGS
+        )
+
+    @staticmethod
+    def _sort_key(item: Tuple[MetricKey, Any]) -> Tuple[str, List[Tuple[str, str]]]:
+        (metric, labels), _ = item
+        return metric, sorted(labels)
+
+    @staticmethod
+    def _labels(labels: FrozenSet[Tuple[str, str]]) -> str:
+        if not labels:
+            return ""
+        return "{%s}" % ",".join(
+            '{}="{}"'.format(
+                re.sub(r"\W", "_", name),
+                value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"),
+            )
+            for name, value in sorted(labels)
+        )
@@ -1,8 +1,24 @@
 """Database table creator and migrator."""
 
+import re
 from typing import Dict, List, Optional
 
-from target_snowflake.database_target.schema_migrator import ColumnType, SchemaMigrator
+from target_snowflake.connection import Connection
+from target_snowflake.database_target.schema_migrator import (
+    ColumnType,
+    SchemaMigrator,
+    TableSchemaCache,
+)
+
+# The next wider type for each column type, i.e. the type a column is widened
+# to when a stream's records no longer fit in it
+DEFAULT_TYPE_LATTICE: Dict[ColumnType, ColumnType] = {
+    "NUMBER": "FLOAT",
+    "FLOAT": "TEXT",
+    "BOOLEAN": "TEXT",
+    "DATE": "TIMESTAMP_TZ",
+    "TIMESTAMP_TZ": "TEXT",
+}
 
 
 class SnowflakeSchemaMigrator(SchemaMigrator):
@@ -14,29 +30,117 @@ class SnowflakeSchemaMigrator(SchemaMigrator):
     def connection(self):
         return self.sink.connection
 
+    @property
+    def table_cache(self) -> TableSchemaCache:
+        return self.sink.table_cache
+
+    @property
+    def type_lattice(self) -> Optional[Dict[ColumnType, ColumnType]]:
+        if not self.config.get("widen_column_types"):
+            return None
+        return self.config.get("column_type_lattice") or DEFAULT_TYPE_LATTICE
+
+    def execute_ddl(self, sql: str) -> None:
+        self.connection.execute(sql)
+        self.sink.metrics.counter("ddl_statement_count", 1, stream=self.stream_name)
+
     def get_table(self, table_name: str) -> Optional[Dict[str, ColumnType]]:
+        if not self.table_cache.is_known(table_name):
+            tables = self.introspect_schema(
+                self.connection,
+                self.config["snowflake"]["database"],
+                self.table_schema,
+                table_name=table_name,
+            )
+            self.table_cache.set_table(table_name, tables.get(table_name))
+        return self.table_cache.get(table_name)
+
+    @staticmethod
+    def introspect_schema(
+        connection: Connection,
+        database: str,
+        table_schema: str,
+        table_name: Optional[str] = None,
+    ) -> Dict[str, Dict[str, ColumnType]]:
+        """
+        Return the columns of every table in the schema, or only `table_name`.
+
+        This reads INFORMATION_SCHEMA rather than `SHOW COLUMNS`, which lists
+        at most 10K columns.
+        """
+        sql = (
+            'SELECT table_name, column_name, data_type FROM "{}".INFORMATION_SCHEMA.COLUMNS '
+            "WHERE table_schema = %(table_schema)s".format(database)
+        )
+        if table_name is not None:
+            sql += " AND table_name = %(table_name)s"
+        sql += " ORDER BY table_name, ordinal_position"
+
+        tables: Dict[str, Dict[str, ColumnType]] = {}
+        res = connection.query(sql, table_schema=table_schema, table_name=table_name)
+        for column in res:
+            columns = tables.setdefault(column["TABLE_NAME"], {})
+            columns[column["COLUMN_NAME"]] = column["DATA_TYPE"]
+        return tables
+
+    def get_clustering_key(self, table_name: str) -> List[str]:
+        """Return the columns of the table's clustering key, if it has one."""
         res = self.connection.query(
-            [
-                'SHOW COLUMNS IN SCHEMA "{}"."{}";'.format(
-                    self.config["snowflake"]["database"],
-                    self.table_schema,
-                ),
-                """
-            SELECT "column_name" AS column_name,
-                    CASE PARSE_JSON("data_type"):type::varchar
-                        WHEN 'FIXED' THEN 'NUMBER'
-                        WHEN 'REAL'  THEN 'FLOAT'
-                        ELSE PARSE_JSON("data_type"):type::varchar
-                    END data_type
-            FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))
-            WHERE "table_name" = %(table_name)s;
-            """,
-            ],
+            'SELECT clustering_key FROM "{}".INFORMATION_SCHEMA.TABLES '
+            "WHERE table_schema = %(table_schema)s "
+            "AND table_name = %(table_name)s".format(
+                self.config["snowflake"]["database"]
+            ),
+            table_schema=self.table_schema,
             table_name=table_name,
         )
-        if not res:
-            return None
-        return {column["COLUMN_NAME"]: column["DATA_TYPE"] for column in res}
+        if not res or not res[0]["CLUSTERING_KEY"]:
+            return []
+        return self.parse_clustering_key(res[0]["CLUSTERING_KEY"])
+
+    @staticmethod
+    def parse_clustering_key(clustering_key: str) -> List[str]:
+        """
+        Return the column each expression of a clustering key is on, e.g.
+        `['CREATED_AT', 'id']` for `LINEAR(TO_DATE(CREATED_AT), "id")`.
+
+        Sorting on the column orders rows the same way as the usual
+        expressions on it (dates, truncations), so that is good enough.
+        """
+        match = re.fullmatch(r"\s*LINEAR\((.*)\)\s*", clustering_key, re.DOTALL)
+        expressions = match.group(1) if match else clustering_key
+        # Drop string literals, like the 'DAY' in DATE_TRUNC('DAY', TS)
+        expressions = re.sub(r"'(?:[^']|'')*'", "''", expressions)
+
+        columns: List[str] = []
+        depth, start = 0, 0
+        for i, char in enumerate(expressions + ","):
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "," and depth == 0:
+                identifier = re.search(
+                    r'"((?:[^"]|"")+)"|([A-Za-z_][\w$]*)\b(?!\s*\()',
+                    expressions[start:i],
+                )
+                if identifier:
+                    quoted, bare = identifier.groups()
+                    columns.append(
+                        quoted.replace('""', '"') if quoted else bare.upper()
+                    )
+                start = i + 1
+        return columns
+
+    def invalidate_table(self, table_name: str) -> None:
+        self.table_cache.invalidate(table_name)
+
+    def is_stale_schema_error(self, error: Exception) -> bool:
+        from snowflake.connector.errors import ProgrammingError
+
+        return isinstance(error, ProgrammingError) and (
+            "already exists" in str(error) or "does not exist" in str(error)
+        )
 
     def create_table(
         self,
@@ -54,7 +158,8 @@ class SnowflakeSchemaMigrator(SchemaMigrator):
         sql += ", ".join(columns)
         sql += ")"
 
-        self.connection.execute(sql)
+        self.execute_ddl(sql)
+        self.table_cache.set_table(table_name, column_definitions)
 
     def convert_stream_name_to_table_name(self, stream_name: str) -> str:
         return stream_name.upper()
@@ -63,14 +168,30 @@ class SnowflakeSchemaMigrator(SchemaMigrator):
         return column_name.upper()
 
     def add_column(self, table_name: str, column_name: str, type: ColumnType) -> None:
-        self.connection.execute(
+        self.execute_ddl(
             'ALTER TABLE "{}"."{}" ADD COLUMN "{}" {}'.format(
                 self.table_schema, table_name, column_name, type
             )
         )
+        self.table_cache.add_column(table_name, column_name, type)
+
+    def add_columns(self, table_name: str, columns: Dict[str, ColumnType]) -> None:
+        # DDL commits implicitly, so this can't be made atomic with the renames;
+        # a single statement is the best we can do.
+        self.execute_ddl(
+            'ALTER TABLE "{}"."{}" ADD COLUMN {}'.format(
+                self.table_schema,
+                table_name,
+                ", ".join(
+                    '"{}" {}'.format(name, type) for name, type in columns.items()
+                ),
+            )
+        )
+        for column_name, type in columns.items():
+            self.table_cache.add_column(table_name, column_name, type)
 
     def rename_column(self, table_name: str, old_name: str, new_name: str) -> None:
-        self.connection.execute(
+        self.execute_ddl(
             'ALTER TABLE "{}"."{}" RENAME COLUMN "{}" to "{}"'.format(
                 self.table_schema,
                 table_name,
@@ -78,6 +199,7 @@ class SnowflakeSchemaMigrator(SchemaMigrator):
                 new_name,
             )
         )
+        self.table_cache.rename_column(table_name, old_name, new_name)
 
     def convert_jsonschema_to_sql_type(self, property_schema: dict) -> str:
         # https://docs.snowflake.com/en/sql-reference/intro-summary-data-types.html
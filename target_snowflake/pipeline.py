@@ -0,0 +1,101 @@
+"""Background loading of batch files into Snowflake."""
+
+import collections
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Deque, Optional
+
+LoadJob = Callable[[], None]
+
+
+class LoadPipeline:
+    """
+    Run batch loads in the background while the next batch fills.
+
+    Loads run one at a time in submission order, so a table always sees its
+    batches in order. At most `max_inflight` loads may be queued or running at
+    once; `submit` blocks until a slot frees up, which applies backpressure to
+    record intake. With `max_inflight` set to 0 loads run inline.
+
+    Loads run on `executor`, which can be shared by the pipelines of many
+    tables so that they load concurrently on a bounded number of threads. A
+    pipeline only ever has one load on the executor at a time, and queues the
+    next when it finishes. Without an executor, the pipeline starts its own
+    worker thread.
+    """
+
+    def __init__(
+        self, name: str, max_inflight: int = 2, executor: Optional[Executor] = None
+    ) -> None:
+        self.name = name
+        self.max_inflight = max_inflight
+        self._slots = threading.BoundedSemaphore(max(max_inflight, 1))
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._jobs: Deque[LoadJob] = collections.deque()
+        self._running = False
+        self._cond = threading.Condition()
+        self._error: Optional[BaseException] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"load-{self.name}"
+            )
+        return self._executor
+
+    def submit(self, job: LoadJob) -> None:
+        """Queue a load, blocking while the pipeline is full."""
+        self.raise_if_failed()
+        if not self.max_inflight:
+            job()
+            return
+
+        self._slots.acquire()
+        with self._cond:
+            self._jobs.append(job)
+            if not self._running:
+                self._running = True
+                self.executor.submit(self._run_next)
+
+    def join(self) -> None:
+        """Block until every submitted load has finished."""
+        with self._cond:
+            while self._running:
+                self._cond.wait()
+        self.raise_if_failed()
+
+    def close(self) -> None:
+        """Wait for outstanding loads and stop the worker."""
+        with self._cond:
+            while self._running:
+                self._cond.wait()
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.raise_if_failed()
+
+    def _run_next(self) -> None:
+        with self._cond:
+            job = self._jobs.popleft()
+        try:
+            # Once a load has failed, skip the rest so that nothing later is
+            # committed out of order.
+            if self._error is None:
+                job()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._slots.release()
+            with self._cond:
+                if self._jobs:
+                    self.executor.submit(self._run_next)
+                else:
+                    self._running = False
+                    self._cond.notify_all()
+
+    def raise_if_failed(self) -> None:
+        """Raise the error of a failed load, if any."""
+        if self._error is not None:
+            raise self._error
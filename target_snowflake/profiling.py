@@ -0,0 +1,168 @@
+"""Opt-in profiling of the phases of a load, for finding slow Python code."""
+
+import collections
+import contextlib
+import cProfile
+import pstats
+import random
+import re
+import sys
+import threading
+from logging import Logger
+from pathlib import Path
+from typing import Any, ContextManager, Counter, Dict, Iterator, Optional, Tuple
+
+PSTATS = "pstats"
+COLLAPSED = "collapsed"
+
+# A phase, and the stream it ran for if any
+ProfileKey = Tuple[str, Optional[str]]
+
+
+class Profiler:
+    """
+    Profile a sample of the calls to each phase of a load, per stream.
+
+    Each time a phase runs it is profiled with probability `sample_rate`, so
+    profiling can be left on for a while in production at a fraction of its
+    full cost. Calls of one phase inside another that is being profiled are
+    covered by the outer profile.
+
+    Profiles are written to `directory` by `write`, one file per stream and
+    phase, e.g. `users.write_csv.pstats`:
+
+    - "pstats" profiles every function call with cProfile, for `pstats` or
+      snakeviz.
+    - "collapsed" samples the stack every `interval` seconds, and writes one
+      line per stack with its sample count, for flamegraph.pl or speedscope.
+      Its overhead depends on the interval rather than on the number of calls.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        directory: Optional[str] = None,
+        format: str = PSTATS,
+        sample_rate: float = 1.0,
+        interval: float = 0.01,
+    ) -> None:
+        if format not in (PSTATS, COLLAPSED):
+            raise ValueError(
+                f"Unknown profile format '{format}', expected one of: "
+                f"{PSTATS}, {COLLAPSED}"
+            )
+        self.logger = logger
+        self.directory = Path(directory) if directory else None
+        self.format = format
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._stats: Dict[ProfileKey, pstats.Stats] = {}
+        self._stacks: Dict[ProfileKey, Counter[str]] = {}
+        # Threads in a profiled phase, and which phase
+        self._active: Dict[int, ProfileKey] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def phase(self, name: str, stream: Optional[str] = None) -> ContextManager[None]:
+        """Profile the block, if this call is sampled."""
+        if (
+            self.directory is None
+            or getattr(self._local, "profiling", False)
+            or random.random() >= self.sample_rate
+        ):
+            return contextlib.nullcontext()
+        return self._profile((name, stream))
+
+    @contextlib.contextmanager
+    def _profile(self, key: ProfileKey) -> Iterator[None]:
+        self._local.profiling = True
+        try:
+            if self.format == PSTATS:
+                with self._cprofile(key):
+                    yield
+            else:
+                with self._sample_stacks(key):
+                    yield
+        finally:
+            self._local.profiling = False
+
+    @contextlib.contextmanager
+    def _cprofile(self, key: ProfileKey) -> Iterator[None]:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Newer Pythons allow one cProfile at a time across all threads
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if key in self._stats:
+                    self._stats[key].add(profile)
+                else:
+                    self._stats[key] = pstats.Stats(profile)
+
+    @contextlib.contextmanager
+    def _sample_stacks(self, key: ProfileKey) -> Iterator[None]:
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = key
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name="profiler", daemon=True
+                )
+                self._sampler.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._active[thread_id]
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, key in self._active.items():
+                    frame: Any = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(
+                            f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                        )
+                        frame = frame.f_back
+                    stacks = self._stacks.setdefault(key, collections.Counter())
+                    stacks[";".join(reversed(stack))] += 1
+
+    def write(self) -> None:
+        """Stop profiling, and write out the profiles collected so far."""
+        if self.directory is None:
+            return
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for key, stats in self._stats.items():
+                stats.dump_stats(self._path(key))
+            for key, stacks in self._stacks.items():
+                with open(self._path(key), "w") as fp:
+                    for stack, count in sorted(stacks.items()):
+                        fp.write(f"{stack} {count}\n")
+        self.logger.info(f"Wrote profiles to '{self.directory}'")
+
+    def _path(self, key: ProfileKey) -> Path:
+        name, stream = key
+        if stream is not None:
+            # Stream names may contain e.g. slashes
+            name = "{}.{}".format(re.sub(r"[^\w.-]", "_", stream), name)
+        return self.directory / f"{name}.{self.format}"  # type: ignore[operator]
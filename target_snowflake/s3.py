@@ -0,0 +1,110 @@
+"""Upload files to S3 as they are written."""
+
+import io
+from concurrent.futures import Executor, Future
+from typing import Any, List, Optional
+
+
+class S3MultipartUpload(io.RawIOBase):
+    """
+    A writable file that uploads itself to S3 while it is written.
+
+    Writes are buffered until a part of `part_size` bytes is full, and each
+    part is then uploaded on `executor` while writing carries on. Closing the
+    file uploads the last part and completes the upload. At most
+    `max_pending_parts` parts are held in memory waiting to be uploaded;
+    writing blocks while that many are.
+
+    If anything fails, the upload is aborted, so no partial object is left
+    behind.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        bucket: str,
+        key: str,
+        executor: Executor,
+        part_size: int = 16 * 1024 * 1024,
+        max_pending_parts: int = 4,
+    ) -> None:
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.executor = executor
+        # S3 requires every part but the last to be at least 5 MB
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.max_pending_parts = max_pending_parts
+        self._buffer = bytearray()
+        self._position = 0
+        self._parts: List[Future] = []
+        self._upload_id: Optional[str] = client.create_multipart_upload(
+            Bucket=bucket, Key=key
+        )["UploadId"]
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data: Any) -> int:
+        self._buffer += data
+        self._position += len(data)
+        try:
+            while len(self._buffer) >= self.part_size:
+                part = bytes(self._buffer[: self.part_size])
+                del self._buffer[: self.part_size]
+                self._upload_part(part)
+        except BaseException:
+            self.abort()
+            raise
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._parts:
+                self._upload_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": [part.result() for part in self._parts]},
+            )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self) -> None:
+        """Abandon the upload, discarding the parts uploaded so far."""
+        if self._upload_id is None:
+            return
+        for part in self._parts:
+            part.cancel()
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+        )
+        self._upload_id = None
+
+    def _upload_part(self, data: bytes) -> None:
+        pending = [part for part in self._parts if not part.done()]
+        if len(pending) >= self.max_pending_parts:
+            pending[0].result()
+        part_number = len(self._parts) + 1
+        self._parts.append(self.executor.submit(self._send_part, part_number, data))
+
+    def _send_part(self, part_number: int, data: bytes) -> dict:
+        res = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": res["ETag"]}
@@ -1,10 +1,25 @@
 """Snowflake target sink class, which handles writing streams."""
 
-from typing import Dict, List, Optional
+import functools
+import operator
+import threading
+import uuid
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type
 
 from singer_sdk.target_base import Target
 
-from target_snowflake.database_target.csv_sink import CSVSink
+from target_snowflake.database_target.batch_writer import (
+    BatchFiles,
+    BatchWriter,
+    ShardedBatchWriter,
+)
+from target_snowflake.database_target.compression import BlockCompressor, Codec
+from target_snowflake.database_target.csv_sink import CSVBatchWriter, CSVSink
+from target_snowflake.database_target.row_encoder import RowEncoder
+from target_snowflake.database_target.schema_migrator import ColumnType
+from target_snowflake.memory import RecordSizeEstimator
 from target_snowflake.migrator import SnowflakeSchemaMigrator
 
 
@@ -22,24 +37,491 @@ class SnowflakeSink(CSVSink):
 
         self.connection = target.connect()
         self._has_migrated = False
+        self._migration: Optional[Future] = None
         self.migrator = SnowflakeSchemaMigrator(sink=self)
+        self._row_encoder: Optional[RowEncoder] = None
         self.table_schema = target.table_schema
+        self.table_cache = target.table_cache
+        self.stage = target.stage
+        self.files_per_batch: int = target.files_per_batch
+        self.parallel_encoder = target.parallel_encoder
+        self.codec: Optional[Codec] = target.codec
+        self.compression_executor = target.compression_executor
+        self.metrics = target.metrics
+        self.profiler = target.profiler
+        self.memory_budget = target.memory_budget
+        self.manifest = target.manifest
+        # Shared by every sink loading the same table, to keep its loads in order
+        self.pipeline = target.pipeline_for(self.migrator.table_name)
+        if self.config["load_method"] == "upsert" and not self.key_properties:
+            self.logger.warning(
+                f"Stream '{stream_name}' has no key properties to upsert on, "
+                "appending instead"
+            )
+        self._bytes_per_row: Optional[float] = None
+        self.record_sizes = RecordSizeEstimator()
+        self._batch_writer: Optional[BatchWriter] = None
+        self._record_key = (
+            operator.itemgetter(*self.key_properties) if self.is_upsert else None
+        )
+        self._clustering_properties: List[str] = []
+        self._shard_key: Optional[Callable[[dict], Any]] = None
+        if self.config["file_sharding"] == "key_hash" and self.key_properties:
+            self._shard_key = operator.itemgetter(*self.key_properties)
+
+    @property
+    def batch_size_bytes(self) -> int:
+        return self.config["batch_size_mb"] * 1024 * 1024
 
     @property
     def max_size(self):
-        return self.config["batch_size_rows"]
+        """
+        Return the number of rows to put in a batch.
 
-    def start_batch(self, context: dict) -> None:
-        # TODO: perhaps Sync should have a callback hook at the beginning of execution?
+        This is `batch_size_rows`, or fewer if the rows seen so far for the
+        stream are wide enough that a full batch would exceed `batch_size_mb`.
+        """
+        if self._bytes_per_row is None:
+            return self.config["batch_size_rows"]
+        return max(
+            1,
+            min(
+                self.config["batch_size_rows"],
+                int(self.batch_size_bytes / self._bytes_per_row),
+            ),
+        )
+
+    @property
+    def is_full(self) -> bool:
+        if super().is_full:
+            return True
+        # When streaming, the file on disk is the exact measure of the batch
+        return (
+            self._batch_writer is not None
+            and self._batch_writer.bytes_written >= self.batch_size_bytes
+        )
+
+    def _observe_batch_size(self, record_count: int, bytes_written: int) -> None:
+        """Update the estimate of bytes per row from a written batch."""
+        if not record_count:
+            return
+        bytes_per_row = bytes_written / record_count
+        if self._bytes_per_row is None:
+            self._bytes_per_row = bytes_per_row
+        else:
+            # Favour recent batches, as the shape of the data drifts
+            self._bytes_per_row = 0.5 * self._bytes_per_row + 0.5 * bytes_per_row
+
+    @property
+    def is_upsert(self) -> bool:
+        """Return `True` to merge batches into the table on the key properties."""
+        return self.config["load_method"] == "upsert" and bool(self.key_properties)
+
+    @property
+    def streaming_writes(self) -> bool:
+        # Deduplicating needs the whole batch before anything is written
+        return super().streaming_writes and not self.is_upsert
+
+    @property
+    def staging_format(self) -> str:
+        return self.config["staging_format"]
+
+    @property
+    def file_extension(self) -> str:  # type: ignore[override]
+        if self.codec is not None:
+            return "{}.{}".format(self.staging_format, self.codec.extension)
+        return self.staging_format
+
+    @property
+    def row_encoder(self) -> RowEncoder:
+        if self._row_encoder is None:
+            self._row_encoder = RowEncoder(
+                self.migrator.column_definitions,
+                self.migrator.column_properties,
+                # Parquet values are columnar, so can't be streamed
+                stream_threshold=self.config["variant_stream_threshold"]
+                if self.staging_format == "csv"
+                else None,
+            )
+        return self._row_encoder
+
+    def open_writer(self, filepath: Path) -> BatchWriter:
+        """
+        Open the writer for a batch.
+
+        With more than one file per batch, the batch is split across files that
+        Snowflake can load in parallel.
+        """
+        if self.files_per_batch <= 1:
+            return self.open_file_writer(filepath)
+
+        return ShardedBatchWriter(
+            filepath,
+            self.files_per_batch,
+            open_writer=functools.partial(self.open_file_writer, sharded=True),
+            shard_key=self._shard_key,
+        )
+
+    @property
+    def writer_class(self) -> Type[BatchWriter]:
+        """The writer for a single file in the staging format."""
+        if self.staging_format == "parquet":
+            # pyarrow is an optional dependency, only needed for Parquet staging
+            from target_snowflake.database_target.parquet_writer import (
+                ParquetBatchWriter,
+            )
+
+            return ParquetBatchWriter
+        return CSVBatchWriter
+
+    def open_file_writer(self, filepath: Path, sharded: bool = False) -> BatchWriter:
+        """Open the writer for a single batch file, or one of a batch's shards."""
+        fileobj = self.stage.open_upload(filepath, self.migrator.table_name, sharded)
+        if self.codec is not None:
+            fileobj = BlockCompressor(  # type: ignore[assignment]
+                fileobj or open(filepath, "wb"),
+                self.codec,
+                executor=self.compression_executor,
+            )
+        return self.writer_class(  # type: ignore[call-arg]
+            filepath, encoder=self.row_encoder, fileobj=fileobj
+        )
+
+    def _write_csv(self, filepath: Path, records: Iterable[dict]) -> BatchFiles:
+        """Write the batch, encoding large batches on worker processes if enabled."""
+        with self.profiler.phase("write_csv", self.stream_name):
+            if (
+                self.parallel_encoder is None
+                or not isinstance(records, list)
+                or not self.parallel_encoder.should_encode(records)
+            ):
+                return super()._write_csv(filepath, records)
+
+            return self.parallel_encoder.write(
+                filepath,
+                records,
+                self.writer_class,
+                self.row_encoder,
+                part_count=max(self.files_per_batch, self.parallel_encoder.workers),
+                part_key=self._shard_key,
+                codec=self.codec,
+            )
+
+    def begin_migration(self, executor: Executor, table_lock: threading.Lock) -> None:
+        """
+        Start migrating the table in the background.
+
+        This lets tables for different streams migrate concurrently, while
+        `table_lock` keeps migrations of the same table from overlapping.
+        """
+
+        def migrate():
+            with table_lock:
+                return self.migrate_table()
+
+        self._migration = executor.submit(migrate)
+
+    def migrate_table(self) -> Dict[str, ColumnType]:
+        with self.metrics.timer(
+            "schema_migration_duration", stream=self.stream_name
+        ), self.profiler.phase("sync_table_schema", self.stream_name):
+            column_definitions = self.migrator.sync_table_schema()
+            if self.config["sort_by_clustering_key"]:
+                self._clustering_properties = self.clustering_properties()
+            return column_definitions
+
+    def clustering_properties(self) -> List[str]:
+        """Return the record properties of the table's clustering key."""
+        column_properties = self.migrator.column_properties
+        properties = []
+        for column in self.migrator.get_clustering_key(self.migrator.table_name):
+            name = column_properties.get(column)
+            # Batches are only sorted on top level properties
+            if isinstance(name, str):
+                properties.append(name)
+        if properties:
+            self.logger.info(
+                f"Sorting batches for stream '{self.stream_name}' by the table's "
+                f"clustering key: {properties}"
+            )
+        return properties
+
+    @property
+    def sort_properties(self) -> List[str]:
+        """
+        Sort by `record_sort_property_name`, or else the table's clustering key
+        if `sort_by_clustering_key` is set.
+
+        Files sorted on the clustering key load into well-clustered
+        micro-partitions, which queries can prune.
+        """
+        return super().sort_properties or self._clustering_properties
+
+    def wait_for_migration(self) -> None:
         if not self._has_migrated:
-            self.migrator.sync_table_schema()
+            if self._migration is not None:
+                self._migration.result()
+            else:
+                self.migrate_table()
             self._has_migrated = True
+
+    def start_batch(self, context: dict) -> None:
+        # TODO: perhaps Sync should have a callback hook at the beginning of execution?
+        self.wait_for_migration()
         super().start_batch(context)
+        self._batch_writer = context.get("writer")
+
+    @property
+    def records_in_memory(self) -> int:
+        """The number of records of the pending batch held in memory."""
+        return self._count_records_in_memory(self._pending_batch or {})
+
+    @staticmethod
+    def _count_records_in_memory(context: dict) -> int:
+        if "records_by_key" in context:
+            return len(context["records_by_key"])
+        if "sorter" in context:
+            return context["sorter"].records_in_memory
+        if "writer" in context:
+            return context["writer"].records_in_memory
+        return len(context.get("records", ()))
+
+    @property
+    def buffered_bytes(self) -> int:
+        """An estimate of the memory held by records of the pending batch."""
+        return int(self.records_in_memory * self.record_sizes.bytes_per_record)
+
+    def process_record(self, record: dict, context: dict) -> None:
+        self.record_sizes.observe(record)
+        if self._record_key is None:
+            super().process_record(record, context)
+            return
+
+        # Keep only the latest record for each key, so MERGE only has to deal
+        # with distinct keys.
+        records_by_key = context.setdefault("records_by_key", {})
+        key = self._record_key(record)
+        if key in records_by_key:
+            self.tally_duplicate_merged()
+        records_by_key[key] = record
 
     def process_batch(self, context: dict) -> None:
-        super().process_batch(context)
-        self.logger.info(f"TODO: load '{self.destination_path}' into Snowflake...")
+        """
+        Hand the batch off to the table's load pipeline.
+
+        This returns as soon as the batch is queued, so the next batch can
+        fill while this one is written, uploaded and copied into the table,
+        and batches of different tables are drained concurrently.
+        """
+        with self.profiler.phase("process_batch", self.stream_name):
+            self._process_batch(context)
+
+    def _process_batch(self, context: dict) -> None:
+        tags = {"stream": self.stream_name, "batch_id": context["batch_id"]}
+        queued_bytes = int(
+            self._count_records_in_memory(context) * self.record_sizes.bytes_per_record
+        )
+        if self.memory_budget is not None:
+            # The records stay in memory until the batch is written out
+            self.memory_budget.queue(queued_bytes)
+        if "records_by_key" in context:
+            context["records"] = list(context.pop("records_by_key").values())
+        self._batch_writer = None
+        if self.manifest is not None:
+            self.manifest.submitted(context["batch_id"])
+
+        # Time spent blocked here is time record intake waits on loads
+        with self.metrics.timer("load_queue_wait_duration", **tags):
+            self.pipeline.submit(
+                functools.partial(
+                    self.write_and_load_batch, context, tags, queued_bytes
+                )
+            )
+
+    def write_and_load_batch(
+        self, context: dict, tags: Dict[str, Any], queued_bytes: int = 0
+    ) -> None:
+        """Write the batch file(s), then load them into the table."""
+        try:
+            with self.metrics.timer("batch_write_duration", **tags):
+                super().process_batch(context)
+        finally:
+            # Release the records, now they are written out
+            context.pop("records", None)
+            if self.memory_budget is not None:
+                self.memory_budget.dequeue(queued_bytes)
+        self._observe_batch_size(context["record_count"], context["bytes_written"])
+        self.metrics.counter("batch_bytes", context["bytes_written"], **tags)
+        self.metrics.counter("batch_file_count", len(context["filepaths"]), **tags)
+        columns = {
+            column: self.row_encoder.column_definitions[column]
+            for column in context["header"]
+        }
+        if self.manifest is not None:
+            # Files uploaded as they were written are only on the stage
+            streamed_files = [
+                self.stage.streamed_name(filepath) for filepath in context["filepaths"]
+            ]
+            streamed = bool(streamed_files) and None not in streamed_files
+            self.manifest.written(
+                context["batch_id"],
+                stream=self.stream_name,
+                schema=self.schema,
+                key_properties=self.key_properties,
+                files=[str(filepath) for filepath in context["filepaths"]],
+                record_count=context["record_count"],
+                columns=columns,
+                upsert=self.is_upsert,
+                streamed=streamed,
+                **({"staged_files": streamed_files} if streamed else {}),
+            )
+        with self.profiler.phase("load_batch", self.stream_name):
+            self.load_batch_file(
+                context["filepaths"], context["record_count"], columns, tags
+            )
+
+    def load_batch_file(
+        self,
+        filepaths: List[Path],
+        record_count: int,
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Upload written batch files to the stage and copy them into the table."""
+        tags = tags or {"stream": self.stream_name}
+        if record_count:
+            self.logger.info(
+                f"Loading {len(filepaths)} file(s) from '{filepaths[0].parent}' "
+                "into Snowflake..."
+            )
+            staged_files = self.stage.upload(
+                self.connection, filepaths, self.migrator.table_name, tags=tags
+            )
+            if self.manifest is not None and "batch_id" in tags:
+                self.manifest.staged(tags["batch_id"], staged_files)
+            self.copy_staged_files(staged_files, columns, tags)
+            self.metrics.counter("record_count", record_count, **tags)
+            self.metrics.write_textfile()
+        if self.manifest is not None and "batch_id" in tags:
+            self.manifest.copied(tags["batch_id"])
+        self.remove_batch_files(filepaths)
+
+    @staticmethod
+    def remove_batch_files(filepaths: List[Path]) -> None:
+        for filepath in filepaths:
+            if filepath.exists():
+                filepath.unlink()
+        if len(filepaths) > 1 and filepaths[0].parent.exists():
+            filepaths[0].parent.rmdir()
+
+    def copy_staged_files(
+        self,
+        staged_files: List[str],
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Copy a batch's staged files into the table, merging them if upserting."""
+        if self.is_upsert:
+            self.upsert_staged_files(staged_files, columns, tags)
+        else:
+            self.stage.copy(
+                self.connection,
+                staged_files,
+                self.migrator.table_name,
+                columns,
+                tags=tags,
+            )
+
+    def resume_batch(self, batch: dict) -> None:
+        """
+        Finish loading a batch recorded in the manifest by an earlier run.
+
+        Files that were staged are copied from the stage. A staged file that
+        has since been purged was already copied into the table, as Snowflake
+        only purges files once they are loaded. Upserted batches are uploaded
+        again from their local files, as the staging table they were copied
+        into may not have been merged, unless they were streamed to the stage
+        and never written locally.
+        """
+        assert self.manifest is not None
+        self.wait_for_migration()
+        tags = {"stream": self.stream_name, "batch_id": batch["batch"]}
+        filepaths = [Path(file) for file in batch["files"]]
+        if "staged_files" not in batch or (
+            self.is_upsert and not batch.get("streamed")
+        ):
+            self.load_batch_file(
+                filepaths, batch["record_count"], batch["columns"], tags
+            )
+            return
+
+        staged_files = self.stage.still_staged(self.connection, batch["staged_files"])
+        self.logger.info(
+            f"Resuming the load of {len(staged_files)} staged file(s) into "
+            f"'{self.migrator.table_name}'..."
+        )
+        if staged_files:
+            self.copy_staged_files(staged_files, batch["columns"], tags)
+        self.manifest.copied(batch["batch"])
+        self.remove_batch_files(filepaths)
+
+    def upsert_staged_files(
+        self,
+        staged_files: List[str],
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Copy staged batch files into a transient staging table and merge it in.
+
+        The staging table is a regular (transient) table rather than a temporary
+        one, since each statement may run on a different pooled session.
+        """
+        table_name = self.migrator.table_name
+        staging_table = "{}_STAGING_{}".format(table_name, uuid.uuid4().hex.upper())
+        self.connection.execute(
+            'CREATE TRANSIENT TABLE "{0}"."{1}" LIKE "{0}"."{2}"'.format(
+                self.table_schema, staging_table, table_name
+            )
+        )
+        try:
+            self.stage.copy(
+                self.connection, staged_files, staging_table, columns, tags=tags
+            )
+            with self.metrics.timer(
+                "batch_merge_duration", **(tags or {})
+            ) as timer_tags:
+                timer_tags["query_id"] = self.connection.execute(
+                    self.merge_sql(staging_table, list(columns))
+                )
+        finally:
+            self.connection.execute(
+                'DROP TABLE IF EXISTS "{}"."{}"'.format(
+                    self.table_schema, staging_table
+                )
+            )
+
+    def merge_sql(self, staging_table: str, columns: List[str]) -> str:
+        """Return the MERGE statement upserting `staging_table` into the table."""
+        key_columns = [
+            self.migrator.convert_property_name_to_column_name(name)
+            for name in self.key_properties
+        ]
+        return (
+            'MERGE INTO "{schema}"."{table}" t USING "{schema}"."{staging}" s '
+            "ON {on} "
+            "WHEN MATCHED THEN UPDATE SET {update} "
+            "WHEN NOT MATCHED THEN INSERT ({insert}) VALUES ({values})".format(
+                schema=self.table_schema,
+                table=self.migrator.table_name,
+                staging=staging_table,
+                on=" AND ".join('t."{0}" = s."{0}"'.format(c) for c in key_columns),
+                update=", ".join('t."{0}" = s."{0}"'.format(c) for c in columns),
+                insert=", ".join('"{}"'.format(c) for c in columns),
+                values=", ".join('s."{}"'.format(c) for c in columns),
+            )
+        )
 
-        # copy the file to the stage
-        # load the file from the stage into the database
-        # (optional) archive the file
+    def clean_up(self) -> None:
+        self.pipeline.close()
+        self.connection.close()
@@ -1,15 +1,30 @@
+import threading
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from types import MappingProxyType
-from typing import Any, Mapping
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, List, Mapping, Optional
 
 from singer_sdk.target_base import Target
 
+from target_snowflake.database_target.compression import Codec
+from target_snowflake.database_target.schema_migrator import ColumnType
+from target_snowflake.s3 import S3MultipartUpload
+
+if TYPE_CHECKING:
+    from target_snowflake.target import Connection
+
 
 class Stage:
     def __init__(self, target: Target) -> None:
+        """Open the stage's own connection and take its settings from `target`."""
         self.connection = target.connect()
         self.logger = target.logger
         self._config = dict(target.config)
+        self.table_schema = target.table_schema
+        self.metrics = target.metrics
+        # What the sink compresses CSV files with as it writes them
+        self.codec: Optional[Codec] = target.codec  # type: ignore[attr-defined]
 
     @property
     def config(self) -> Mapping[str, Any]:
@@ -22,14 +37,84 @@ class Stage:
 
     @abstractmethod
     def prepare(self):
+        """Create the stage, if needed, before any batch is loaded."""
+        pass
+
+    def open_upload(
+        self, filepath: Path, table_name: str, sharded: bool = False
+    ) -> Optional[BinaryIO]:
+        """
+        Return a file to write the batch file at `filepath` to, which uploads
+        it as it is written, or None to write it locally and upload it after.
+
+        `sharded` is `True` for one of the files of a batch split across files
+        in its own directory. Either way, `upload` is then called with
+        `filepath`.
+        """
+        return None
+
+    def streamed_name(self, filepath: Path) -> Optional[str]:
+        """Return the staged name of a file uploaded as it was written, if it was."""
+        return None
+
+    def load(
+        self,
+        connection: "Connection",
+        local_files: List[Path],
+        table_name: str,
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Upload `local_files` and copy them into `table_name` in one COPY INTO.
+
+        `connection` is the calling sink's connection, so loads for different
+        sinks can run on separate threads. `columns` maps the table columns to
+        their types, in the order they appear in the files. When there is more
+        than one file, they are the only files in their directory. `tags` are
+        added to the metrics recorded for the load.
+        """
+        staged_files = self.upload(connection, local_files, table_name, tags)
+        self.copy(connection, staged_files, table_name, columns, tags)
+
+    @abstractmethod
+    def upload(
+        self,
+        connection: "Connection",
+        local_files: List[Path],
+        table_name: str,
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """Upload `local_files` for `table_name`, returning their staged names."""
         pass
 
     @abstractmethod
-    def load(self, local_csv_file: str) -> None:
+    def copy(
+        self,
+        connection: "Connection",
+        staged_files: List[str],
+        table_name: str,
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Copy already staged files into `table_name`.
+
+        Files that were already loaded into the table are skipped, by
+        Snowflake's load metadata, so copying the same files twice is safe.
+        """
+        pass
+
+    @abstractmethod
+    def still_staged(
+        self, connection: "Connection", staged_files: List[str]
+    ) -> List[str]:
+        """Return those of `staged_files` that haven't been removed from the stage."""
         pass
 
     @abstractmethod
     def cleanup(self):
+        """Release the stage's resources once every batch is loaded."""
         pass
 
 
@@ -52,18 +137,378 @@ class NamedStage(Stage):
         """
         return self.config["stage"]
 
+    @property
+    def stage_location(self) -> str:
+        """The fully qualified stage reference used in PUT and COPY statements."""
+        return '@"{}"."{}"'.format(self.table_schema, self.stage_name)
+
     @property
     def purge_stage_on_complete(self) -> bool:
-        """Return `True` to"""
+        """Return `True` to remove files from the stage once they are loaded."""
+        return self.config.get("purge_stage_on_complete", True)
+
+    @property
+    def staging_format(self) -> str:
+        """The format batch files are staged in, "csv" or "parquet"."""
+        return self.config["staging_format"]
+
+    @property
+    def file_format(self) -> str:
+        """The COPY INTO file format matching the files written by the sink."""
+        if self.staging_format == "parquet":
+            return "TYPE = 'PARQUET'"
+        # The CSV writer doesn't escape backslashes, so don't treat them as
+        # escapes in unenclosed fields either
+        file_format = (
+            "TYPE = 'CSV' SKIP_HEADER = 1 FIELD_OPTIONALLY_ENCLOSED_BY = '\"' "
+            "ESCAPE_UNENCLOSED_FIELD = NONE"
+        )
+        if self.compresses_on_write:
+            file_format += " COMPRESSION = {}".format(
+                self.codec.name if self.codec is not None else "NONE"
+            )
+        return file_format
+
+    @property
+    def compresses_on_write(self) -> bool:
+        """
+        Return `True` if the sink decides how CSV files are compressed, rather
+        than leaving it to PUT.
+        """
+        return bool(self.config.get("staging_compression"))
 
     def prepare(self):
-        pass
-        # self.connection.execute("""
-        # CREATE OR REPLACE STAGE "{}"
-        # FILE_FORMAT = (TYPE = 'CSV' )
-        # """)
+        """Create the internal stage if it doesn't exist."""
+        self.connection.execute(
+            'CREATE STAGE IF NOT EXISTS "{}"."{}"'.format(
+                self.table_schema, self.stage_name
+            )
+        )
+
+    def upload(
+        self,
+        connection: "Connection",
+        local_files: List[Path],
+        table_name: str,
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """PUT `local_files` to the stage under the table's name."""
+        tags = tags or {}
+        if len(local_files) == 1:
+            source, prefix = local_files[0].resolve().as_posix(), table_name
+        else:
+            # Upload every file of the batch with one (parallel) PUT
+            directory = local_files[0].parent.resolve()
+            source = "{}/*".format(directory.as_posix())
+            prefix = "{}/{}".format(table_name, directory.name)
+        with self.metrics.timer("batch_upload_duration", **tags):
+            res = self.put(connection, source, prefix)
+        self.metrics.counter(
+            "batch_bytes_compressed",
+            sum(row.get("target_size") or 0 for row in res),
+            **tags,
+        )
+        return ["{}/{}".format(prefix, row["target"]) for row in res]
+
+    def copy(
+        self,
+        connection: "Connection",
+        staged_files: List[str],
+        table_name: str,
+        columns: Dict[str, ColumnType],
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Copy staged files into `table_name`, timing the COPY INTO."""
+        with self.metrics.timer("batch_copy_duration", **(tags or {})) as timer_tags:
+            timer_tags["query_id"] = self.copy_into(
+                connection, staged_files, table_name, columns
+            )
+
+    def still_staged(
+        self, connection: "Connection", staged_files: List[str]
+    ) -> List[str]:
+        """LIST the prefixes of `staged_files` for those still on the stage."""
+        remaining = set()
+        for prefix in sorted({file.rsplit("/", 1)[0] for file in staged_files}):
+            for row in connection.query(
+                "LIST {}/{}/".format(self.stage_location, prefix)
+            ):
+                # Names are listed under the (lowercased) stage name
+                remaining.add(row["name"].split("/", 1)[1])
+        return [file for file in staged_files if file in remaining]
+
+    def put(
+        self, connection: "Connection", source: str, prefix: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Upload local files to the stage under `prefix`, returning a row for
+        each file with its staged name (`target`) and size (`target_size`).
+
+        `source` is a file path, or a pattern matching several files.
+        """
+        # Parquet files are compressed internally
+        auto_compress = self.staging_format != "parquet" and not (
+            self.compresses_on_write
+        )
+        res = connection.query(
+            "PUT 'file://{}' {}/{}/ AUTO_COMPRESS = {} OVERWRITE = TRUE".format(
+                source,
+                self.stage_location,
+                prefix,
+                "TRUE" if auto_compress else "FALSE",
+            )
+        )
+        return res
+
+    def copy_into(
+        self,
+        connection: "Connection",
+        staged_files: List[str],
+        table_name: str,
+        columns: Dict[str, ColumnType],
+    ) -> Optional[str]:
+        """Copy already staged files into the table, returning the query ID."""
+        self.logger.info(
+            f"Copying {len(staged_files)} staged file(s) into '{table_name}'..."
+        )
+        return connection.execute(
+            'COPY INTO "{}"."{}" ({}) FROM {} FILES = ({}) '
+            "FILE_FORMAT = ({}) PURGE = {}".format(
+                self.table_schema,
+                table_name,
+                ", ".join('"{}"'.format(column) for column in columns),
+                self.copy_source(columns),
+                ", ".join("'{}'".format(file) for file in staged_files),
+                self.file_format,
+                "TRUE" if self.purge_stage_on_complete else "FALSE",
+            )
+        )
+
+    def copy_source(self, columns: Dict[str, ColumnType]) -> str:
+        """
+        Return what COPY INTO reads from.
+
+        CSV columns load by position. Parquet columns are matched by name,
+        with semi-structured columns parsed from the JSON text they're staged
+        as (which `MATCH_BY_COLUMN_NAME` can't do).
+        """
+        if self.staging_format != "parquet":
+            return self.stage_location
+
+        fields = []
+        for column, type in columns.items():
+            field = '$1:"{}"'.format(column)
+            if type in ("VARIANT", "ARRAY"):
+                fields.append("PARSE_JSON({})".format(field))
+            else:
+                fields.append("{}::{}".format(field, type))
+        return "(SELECT {} FROM {})".format(", ".join(fields), self.stage_location)
 
     def cleanup(self):
-        # COPY INTO...
-        # (optional) REMOVE
-        pass
+        """Close the stage's connection."""
+        # COPY INTO purges loaded files as it goes; anything left over is from a
+        # failed load and is kept around for inspection.
+        self.connection.close()
+
+
+class S3Stage(NamedStage):
+    """
+    Stage implementation for an external stage on S3.
+
+    Batch files are uploaded with boto3, using concurrent multipart uploads,
+    rather than with PUT. With `s3_streaming_upload`, they are uploaded part by
+    part as they are written, instead of being written to a local file first.
+    """
+
+    def __init__(self, target: Target) -> None:
+        """Set up the S3 client and part uploads lazily, on first use."""
+        super().__init__(target)
+        self._client: Any = None
+        self._client_lock = threading.Lock()
+        self._part_executor: Optional[ThreadPoolExecutor] = None
+        # Files uploaded as they were written, by their local path
+        self._streamed: Dict[Path, str] = {}
+
+    @property
+    def bucket(self) -> str:
+        """The bucket the stage's files are uploaded to."""
+        return self.config["s3_bucket"]
+
+    @property
+    def prefix(self) -> str:
+        """The key prefix of the stage's files in the bucket."""
+        prefix = self.config.get("s3_prefix") or ""
+        return prefix if not prefix or prefix.endswith("/") else prefix + "/"
+
+    @property
+    def part_size(self) -> int:
+        """The size of each part of a multipart upload, in bytes."""
+        return self.config.get("s3_part_size_mb", 16) * 1024 * 1024
+
+    @property
+    def max_concurrency(self) -> int:
+        """The number of parts uploaded at once, per file."""
+        return self.config.get("s3_max_concurrency", 8)
+
+    @property
+    def client(self) -> Any:
+        """The boto3 S3 client, created on first use."""
+        with self._client_lock:
+            if self._client is None:
+                # boto3 takes a while to import, and is only needed for S3
+                import boto3
+
+                self._client = boto3.session.Session(
+                    aws_access_key_id=self.config.get("aws_access_key_id"),
+                    aws_secret_access_key=self.config.get("aws_secret_access_key"),
+                    aws_session_token=self.config.get("aws_session_token"),
+                    region_name=self.config.get("s3_region"),
+                ).client("s3", endpoint_url=self.config.get("s3_endpoint_url"))
+            return self._client
+
+    @property
+    def part_executor(self) -> ThreadPoolExecutor:
+        """The pool of threads uploading parts of streamed files."""
+        with self._client_lock:
+            if self._part_executor is None:
+                self._part_executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix="s3-part"
+                )
+            return self._part_executor
+
+    @property
+    def stage_name(self):
+        """
+        The name of the external stage.
+
+        It is kept apart from the internal stage, and is replaced on every run
+        so it always points at the configured bucket and prefix.
+        """
+        return self.config.get("s3_stage") or "target-snowflake-s3"
+
+    def prepare(self):
+        """
+        Point the external stage at the bucket.
+
+        A storage integration is used when one is configured. Otherwise the
+        AWS keys are given inline: they are kept out of the target's logs, but
+        the connector binds them into the statement on the client, so they
+        are visible in Snowflake's query history.
+        """
+        params = {"url": "s3://{}/{}".format(self.bucket, self.prefix)}
+        secret = False
+        if self.config.get("s3_storage_integration"):
+            credentials = "STORAGE_INTEGRATION = {}".format(
+                self.config["s3_storage_integration"]
+            )
+        elif self.config.get("aws_access_key_id"):
+            credentials = (
+                "CREDENTIALS = (AWS_KEY_ID = %(key_id)s AWS_SECRET_KEY = %(secret)s)"
+            )
+            params["key_id"] = self.config["aws_access_key_id"]
+            params["secret"] = self.config["aws_secret_access_key"]
+            secret = True
+        else:
+            credentials = ""
+        self.connection.execute(
+            'CREATE OR REPLACE STAGE "{}"."{}" URL = %(url)s {}'.format(
+                self.table_schema, self.stage_name, credentials
+            ).strip(),
+            params,
+            secret=secret,
+        )
+
+    def staged_name(self, filepath: Path, table_name: str, sharded: bool) -> str:
+        """
+        Return the name of a batch file on the stage.
+
+        Like PUT to the internal stage, files of a sharded batch, which share
+        their names with every other sharded batch, are kept under the
+        batch's directory.
+        """
+        if sharded:
+            return "{}/{}/{}".format(table_name, filepath.parent.name, filepath.name)
+        return "{}/{}".format(table_name, filepath.name)
+
+    def open_upload(
+        self, filepath: Path, table_name: str, sharded: bool = False
+    ) -> Optional[BinaryIO]:
+        """Open a multipart upload of `filepath` if `s3_streaming_upload` is set."""
+        if not self.config.get("s3_streaming_upload"):
+            return None
+        staged_name = self.staged_name(filepath, table_name, sharded)
+        self._streamed[filepath] = staged_name
+        return S3MultipartUpload(  # type: ignore[return-value]
+            self.client,
+            self.bucket,
+            self.prefix + staged_name,
+            self.part_executor,
+            part_size=self.part_size,
+        )
+
+    def streamed_name(self, filepath: Path) -> Optional[str]:
+        """Return the staged name of `filepath`, if it was streamed."""
+        return self._streamed.get(filepath)
+
+    def upload(
+        self,
+        connection: "Connection",
+        local_files: List[Path],
+        table_name: str,
+        tags: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """Upload `local_files` to the bucket, except those already streamed."""
+        from boto3.s3.transfer import TransferConfig, create_transfer_manager
+
+        tags = tags or {}
+        staged_files = []
+        uploads = []
+        config = TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.max_concurrency,
+        )
+        with self.metrics.timer("batch_upload_duration", **tags):
+            # Every part of every file shares the same pool of connections
+            with create_transfer_manager(self.client, config) as manager:
+                for filepath in local_files:
+                    staged_name = self._streamed.pop(filepath, None)
+                    if staged_name is None:
+                        staged_name = self.staged_name(
+                            filepath, table_name, sharded=len(local_files) > 1
+                        )
+                        uploads.append(
+                            manager.upload(
+                                str(filepath), self.bucket, self.prefix + staged_name
+                            )
+                        )
+                    staged_files.append(staged_name)
+                for upload in uploads:
+                    upload.result()
+        self.metrics.counter(
+            "batch_bytes_compressed",
+            sum(
+                filepath.stat().st_size for filepath in local_files if filepath.exists()
+            ),
+            **tags,
+        )
+        return staged_files
+
+    def still_staged(
+        self, connection: "Connection", staged_files: List[str]
+    ) -> List[str]:
+        """Return those of `staged_files` still in the bucket."""
+        remaining = []
+        for staged_name in staged_files:
+            res = self.client.list_objects_v2(
+                Bucket=self.bucket, Prefix=self.prefix + staged_name, MaxKeys=1
+            )
+            if res.get("KeyCount"):
+                remaining.append(staged_name)
+        return remaining
+
+    def cleanup(self):
+        """Close the connection and stop the part upload threads."""
+        super().cleanup()
+        if self._part_executor is not None:
+            self._part_executor.shutdown()
@@ -1,60 +1,49 @@
 """Snowflake target class."""
 
-from logging import Logger
-from typing import Any, Dict, List, Optional, Union
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Any, Counter, Dict, List, Optional, Type
 
-import snowflake.connector
 from singer_sdk import typing as th
+from singer_sdk.sinks import Sink
 from singer_sdk.target_base import Target
 
+from target_snowflake.connection import Connection, ConnectionPool
+from target_snowflake.database_target.compression import Codec, get_codec
+from target_snowflake.database_target.parallel_encoder import ParallelEncoder
+from target_snowflake.database_target.schema_migrator import TableSchemaCache
+from target_snowflake.manifest import LoadManifest
+from target_snowflake.memory import MemoryBudget
+from target_snowflake.metrics import Metrics
+from target_snowflake.migrator import SnowflakeSchemaMigrator
+from target_snowflake.pipeline import LoadPipeline
+from target_snowflake.profiling import Profiler
+from target_snowflake.reader import FastSingerReader
 from target_snowflake.sinks import SnowflakeSink
-from target_snowflake.stages import NamedStage
-
-
-class Connection:
-    """
-    A wrapper for a Snowflake database connection.
-
-    This is to give each sink it's own connection to avoid threading
-    issues.
-    """
-
-    def __init__(self, logger: Logger, **kwargs) -> None:
-        self.logger = logger
-        self.connection = snowflake.connector.connect(**kwargs)
-
-    def execute(self, sql: str, *args) -> None:
-        with self.connection.cursor() as cur:
-            self.logger.debug(sql)
-            cur.execute(sql, *args)
-
-    def query(self, sql: Union[str, List[str]], **kwargs) -> List[Dict[str, Any]]:
-        with self.connection.cursor(snowflake.connector.DictCursor) as cur:
-            is_transaction = False
-            if isinstance(sql, list):
-                self.logger.debug("START TRANSACTION")
-                cur.execute("START TRANSACTION")
-                is_transaction = True
-            else:
-                sql = [sql]
-            for query in sql:
-                self.logger.debug(query)
-                cur.execute(query, kwargs)
-                result = cur.fetchall()
-            if is_transaction:
-                cur.execute("COMMIT")
-            return result
-
-    def close(self) -> None:
-        self.connection.close()
-
-
-class SnowflakeTarget(Target):
+from target_snowflake.stages import NamedStage, S3Stage, Stage
+
+WAREHOUSE_NODES = {
+    "X-SMALL": 1,
+    "SMALL": 2,
+    "MEDIUM": 4,
+    "LARGE": 8,
+    "X-LARGE": 16,
+    "2X-LARGE": 32,
+    "3X-LARGE": 64,
+    "4X-LARGE": 128,
+    "5X-LARGE": 256,
+    "6X-LARGE": 512,
+}
+
+# Records read between checks of the memory budget
+MEMORY_CHECK_INTERVAL = 1000
+
+
+class SnowflakeTarget(FastSingerReader, Target):
     """Singer Target for Snowflake database."""
 
     name = "target-snowflake"
     default_sink_class = SnowflakeSink
-    stage_class = NamedStage
 
     config_jsonschema = th.PropertiesList(
         th.Property(
@@ -71,38 +60,368 @@ class SnowflakeTarget(Target):
             required=True,
         ),
         # Stage and Storage config
-        # Flattening config
+        # Levels of nested objects to expand into a column per property
+        th.Property("flatten_max_depth", th.IntegerType, default=0),
         # metadata flag?
         # csv:
-        #   record_sort_property_name
-        #   overwrite_behavior
-        #   output_path_prefix
-        #   timestamp_timezone
-        #   datestamp_format
-        #   timestamp_format
+        th.Property("record_sort_property_name", th.StringType),
+        th.Property("sort_by_clustering_key", th.BooleanType, default=False),
+        # Records held in memory while sorting, the rest are spilled to disk
+        th.Property("sort_buffer_rows", th.IntegerType, default=25000),
+        th.Property("overwrite_behavior", th.StringType, default="replace_file"),
+        th.Property("output_path_prefix", th.StringType),
+        th.Property("timestamp_timezone", th.StringType, default="UTC"),
+        th.Property("datestamp_format", th.StringType, default="%Y-%m-%d"),
+        th.Property("timestamp_format", th.StringType, default="%Y-%m-%d.T%H%M%S"),
+        th.Property(
+            "file_naming_scheme",
+            th.StringType,
+            default="{stream_name}-{timestamp}-{batch_id}.{file_extension}",
+        ),
+        th.Property("streaming_writes", th.BooleanType, default=False),
+        th.Property("staging_format", th.StringType, default="csv"),  # or "parquet"
+        # Compress CSV files while writing them, with "gzip" or "zstd", rather
+        # than when PUT uploads them
+        th.Property("staging_compression", th.StringType),
+        th.Property("compression_level", th.IntegerType),
+        th.Property("compression_threads", th.IntegerType, default=4),
         th.Property("stage", th.StringType, default="target-snowflake"),
+        th.Property("purge_stage_on_complete", th.BooleanType, default=True),
+        # Stage files in an S3 bucket instead of an internal stage
+        th.Property("s3_bucket", th.StringType),
+        th.Property("s3_prefix", th.StringType, default="target-snowflake/"),
+        # The external stage, which is replaced to point at the bucket
+        th.Property("s3_stage", th.StringType, default="target-snowflake-s3"),
+        th.Property("s3_region", th.StringType),
+        th.Property("s3_endpoint_url", th.StringType),
+        # Prefer a storage integration: AWS keys given inline for the stage end
+        # up in Snowflake's query history
+        th.Property("s3_storage_integration", th.StringType),
+        th.Property("aws_access_key_id", th.StringType),
+        th.Property("aws_secret_access_key", th.StringType),
+        th.Property("aws_session_token", th.StringType),
+        th.Property("s3_part_size_mb", th.IntegerType, default=16),
+        th.Property("s3_max_concurrency", th.IntegerType, default=8),
+        # Upload batch files as they are written rather than once they're done
+        th.Property("s3_streaming_upload", th.BooleanType, default=False),
+        th.Property("max_inflight_batches", th.IntegerType, default=2),
+        # Threads writing and loading batches, shared by all streams
+        th.Property("max_concurrent_drains", th.IntegerType, default=4),
+        th.Property("load_method", th.StringType, default="append"),  # or "upsert"
+        th.Property("connection_pool_size", th.IntegerType, default=8),
+        th.Property("max_concurrent_migrations", th.IntegerType, default=4),
         th.Property("batch_size_rows", th.IntegerType, default=100000),
+        th.Property("batch_size_mb", th.IntegerType, default=250),
+        # Limit on memory held by buffered records across all streams
+        th.Property("memory_budget_mb", th.IntegerType),
+        # Defaults to a number suited to the warehouse size
+        th.Property("files_per_batch", th.IntegerType),
+        th.Property("file_sharding", th.StringType, default="round_robin"),
+        th.Property("encoding_workers", th.IntegerType, default=0),
+        # Objects and arrays with more elements are written out piece by piece
+        th.Property("variant_stream_threshold", th.IntegerType, default=10000),
         th.Property("raise_on_column_conflicts", th.BooleanType, default=False),
+        # Keep columns whose type changes to one they can hold, rather than
+        # versioning them
+        th.Property("widen_column_types", th.BooleanType, default=False),
+        # Map of each type to the next wider type, defaults to e.g.
+        # NUMBER -> FLOAT -> TEXT
+        th.Property("column_type_lattice", th.ObjectType()),
+        # Journal of batch loads, so loads cut short by a crash are finished
+        # by the next run
+        th.Property("load_manifest", th.StringType),
+        # Finish the loads in the manifest, for a recovery run on empty input.
+        # Otherwise the tap sends their records again, and they're discarded
+        th.Property("resume_loads", th.BooleanType, default=False),
+        # Write metrics for the Prometheus node exporter's textfile collector
+        th.Property("metrics_textfile", th.StringType),
+        # Write profiles of a sample of each phase's calls to this directory
+        th.Property("profile_dir", th.StringType),
+        th.Property(
+            "profile_format", th.StringType, default="pstats"
+        ),  # or "collapsed"
+        th.Property("profile_sample_rate", th.NumberType, default=0.1),
+        # Time between stack samples of the "collapsed" format
+        th.Property("profile_interval_ms", th.IntegerType, default=10),
     ).to_dict()
 
     def __init__(
         self,
         config: Optional[Dict[str, Any]] = None,
         parse_env_config: bool = False,
+        validate_config: bool = True,
     ) -> None:
-        super().__init__(config=config, parse_env_config=parse_env_config)
+        super().__init__(
+            config=config,
+            parse_env_config=parse_env_config,
+            validate_config=validate_config,
+        )
         self.table_schema = self.config["snowflake"]["schema"].upper()
+        self.metrics = Metrics(self.logger, self.config.get("metrics_textfile"))
+        self.profiler = Profiler(
+            self.logger,
+            self.config.get("profile_dir"),
+            format=self.config["profile_format"],
+            sample_rate=self.config["profile_sample_rate"],
+            interval=self.config["profile_interval_ms"] / 1000,
+        )
+        self.connection_pool = ConnectionPool(
+            self.logger,
+            max_size=self.config["connection_pool_size"],
+            timers=self.metrics,
+            **self.config["snowflake"],
+        )
+        self.table_cache = TableSchemaCache()
+        self.files_per_batch = self.config.get("files_per_batch") or 1
+        self.parallel_encoder: Optional[ParallelEncoder] = None
+        if self.config["encoding_workers"] > 1:
+            self.parallel_encoder = ParallelEncoder(self.config["encoding_workers"])
+        self.migration_executor = ThreadPoolExecutor(
+            max_workers=self.config["max_concurrent_migrations"],
+            thread_name_prefix="migrate",
+        )
+        self._table_locks: Dict[str, threading.Lock] = {}
+        self.drain_executor = ThreadPoolExecutor(
+            max_workers=self.config["max_concurrent_drains"],
+            thread_name_prefix="drain",
+        )
+        self._pipelines: Dict[str, LoadPipeline] = {}
+        self.memory_budget: Optional[MemoryBudget] = None
+        if self.config.get("memory_budget_mb"):
+            self.memory_budget = MemoryBudget(
+                self.config["memory_budget_mb"] * 1024 * 1024
+            )
+        self._records_since_budget_check = 0
+        self.manifest: Optional[LoadManifest] = None
+        if self.config.get("load_manifest"):
+            self.manifest = LoadManifest(self.config["load_manifest"])
+        # Parquet files are compressed internally
+        self.codec: Optional[Codec] = None
+        if self.config["staging_format"] == "csv":
+            self.codec = get_codec(
+                self.config.get("staging_compression"),
+                self.config.get("compression_level"),
+            )
+        self.compression_executor = ThreadPoolExecutor(
+            max_workers=self.config["compression_threads"],
+            thread_name_prefix="compress",
+        )
         self.stage = self.stage_class(self)
+        # Nothing connects to Snowflake until the target starts listening, so
+        # e.g. validating the config doesn't have to log in
+        self._preparation: Optional[Future] = None
+        self._prepared = False
 
-        # TODO: perhaps Target should have a setup callback hook?
-        self._prepare_load()
+    @property
+    def stage_class(self) -> Type[Stage]:
+        """The stage to load through, an external one on S3 if `s3_bucket` is set."""
+        return S3Stage if self.config.get("s3_bucket") else NamedStage
+
+    def _process_lines(self, file_input: IO[str]) -> Counter:
+        # Log in and look up the tables while waiting for the tap's first message
+        self._preparation = self.migration_executor.submit(self._prepare_load)
+        return super()._process_lines(file_input)
+
+    def prepare_load(self) -> None:
+        """
+        Wait until the target is ready to load, preparing it now if it hasn't
+        started to.
+        """
+        if self._prepared:
+            return
+        self._prepared = True
+        if self._preparation is None:
+            self._prepare_load()
+        else:
+            self._preparation.result()
+        if self.manifest is None:
+            return
+        if self.config["resume_loads"]:
+            self._resume_loads(self.manifest)
+        else:
+            self._discard_unfinished_loads(self.manifest)
 
     def _prepare_load(self) -> None:
         connection = self.connect()
         connection.execute('CREATE SCHEMA IF NOT EXISTS "{}"'.format(self.table_schema))
+        # Look up every table once, rather than once per stream
+        self.table_cache.load(
+            SnowflakeSchemaMigrator.introspect_schema(
+                connection, self.config["snowflake"]["database"], self.table_schema
+            )
+        )
+        if not self.config.get("files_per_batch"):
+            self.files_per_batch = self._files_per_batch_for_warehouse(connection)
 
         connection.close()
+        self.stage.prepare()
+
+    def _resume_loads(self, manifest: LoadManifest) -> None:
+        """
+        Finish the loads an earlier run was killed during, and emit the STATE
+        that was waiting on them.
+
+        This is only safe in a recovery run before the tap is restarted, e.g.
+        on empty input. Otherwise the tap has already restarted from the STATE
+        before, and sends the records again.
+        """
+        state, batches = manifest.recoverable()
+        if state is None:
+            manifest.clear()
+            return
+
+        self.logger.info(
+            f"Resuming {len(batches)} load(s) from '{manifest.path}' left "
+            "unfinished by an earlier run..."
+        )
+        for batch in batches:
+            sink = self._sinks_active.get(batch["stream"])
+            if sink is None:
+                sink = self.add_sink(
+                    batch["stream"], batch["schema"], batch["key_properties"]
+                )
+            assert isinstance(sink, SnowflakeSink)
+            sink.resume_batch(batch)
+        self._latest_state = state
+        self._write_state_message(state)
+
+    def _discard_unfinished_loads(self, manifest: LoadManifest) -> None:
+        """Forget the loads an earlier run left, as the tap sends them again."""
+        state, batches = manifest.recoverable()
+        if state is not None:
+            self.logger.warning(
+                f"Discarding {len(batches)} unfinished load(s) in "
+                f"'{manifest.path}', whose records the tap will send again. Run "
+                "with resume_loads on empty input to finish them instead."
+            )
+        manifest.clear()
+
+    def _files_per_batch_for_warehouse(self, connection: Connection) -> int:
+        """
+        Pick how many files to split each batch into from the warehouse size.
+
+        COPY INTO loads files in parallel, one per warehouse thread (8 per
+        node), but files much smaller than a few MB compressed load slowly.
+        """
+        warehouse = self.config["snowflake"].get("warehouse")
+        if not warehouse:
+            return 1
+        res = connection.query(
+            "SHOW WAREHOUSES LIKE %(warehouse)s", warehouse=warehouse
+        )
+        if not res:
+            return 1
+        threads = 8 * WAREHOUSE_NODES.get(res[0]["size"].upper(), 1)
+        return max(1, min(threads, self.config["batch_size_mb"] // 16))
+
+    def pipeline_for(self, table_name: str) -> LoadPipeline:
+        """
+        Return the load pipeline for a table.
+
+        Every sink loading into the table shares its pipeline, so the table's
+        batches are loaded one at a time in order, while pipelines for
+        different tables share the drain workers.
+        """
+        if table_name not in self._pipelines:
+            self._pipelines[table_name] = LoadPipeline(
+                name=table_name,
+                max_inflight=self.config["max_inflight_batches"],
+                executor=self.drain_executor,
+            )
+        return self._pipelines[table_name]
+
+    def add_sink(
+        self, stream_name: str, schema: dict, key_properties: Optional[List[str]] = None
+    ) -> Sink:
+        """Create a sink and start migrating its table in the background."""
+        self.prepare_load()
+        sink = super().add_sink(stream_name, schema, key_properties)
+        if isinstance(sink, SnowflakeSink):
+            table_name = sink.migrator.table_name
+            table_lock = self._table_locks.setdefault(table_name, threading.Lock())
+            sink.begin_migration(self.migration_executor, table_lock)
+        return sink
+
+    def _process_record_message(self, message_dict: dict) -> None:
+        super()._process_record_message(message_dict)
+        if self.memory_budget is not None:
+            # Summing usage across every sink is too slow to do per record
+            self._records_since_budget_check += 1
+            if self._records_since_budget_check >= MEMORY_CHECK_INTERVAL:
+                self._records_since_budget_check = 0
+                self._enforce_memory_budget()
+
+    def _enforce_memory_budget(self) -> None:
+        """
+        Drain the sinks holding the most records in memory once buffered
+        records across all sinks exceed `memory_budget_mb`.
+
+        Draining only hands the batch to the sink's load pipeline, where its
+        records are held until the batch is written out. So intake then stops
+        until enough queued batches are written to be back under budget.
+        """
+        budget = self.memory_budget
+        assert budget is not None
+        usage = {
+            sink: sink.buffered_bytes
+            for sink in self._sinks_active.values()
+            if isinstance(sink, SnowflakeSink)
+        }
+        if not budget.over_budget(usage):
+            return
+
+        sinks = budget.sinks_to_drain(usage)
+        self.logger.info(
+            f"Buffered records use {sum(usage.values()) / 1024 / 1024:.0f} MB and "
+            f"queued batches {budget.queued_bytes / 1024 / 1024:.0f} MB, over the "
+            f"memory budget of {self.config['memory_budget_mb']} MB. Draining "
+            f"{[sink.stream_name for sink in sinks]}..."
+        )
+        for sink in sinks:
+            self.metrics.counter(
+                "memory_budget_drain_count", 1, stream=sink.stream_name
+            )
+            self.drain_one(sink)
+
+        buffered_bytes = sum(size for sink, size in usage.items() if sink not in sinks)
+        with self.metrics.timer("memory_budget_wait_duration"):
+            while not budget.wait_for_queue(buffered_bytes, timeout=1.0):
+                # A failed load skips the batches queued after it
+                for pipeline in self._pipelines.values():
+                    pipeline.raise_if_failed()
+
+    def _drain_all(self, sink_list: List[Sink], parallelism: int) -> None:
+        super()._drain_all(sink_list, parallelism)
+        if self.manifest is not None:
+            # Every record before the latest state is now in a batch, so the
+            # state can be recovered once those batches are loaded
+            self.manifest.checkpoint(self._latest_state)
+
+    def _write_state_message(self, state: dict) -> None:
+        """Emit state only once every load it covers has been committed."""
+        for pipeline in list(self._pipelines.values()):
+            pipeline.join()
+        super()._write_state_message(state)
+        if self.manifest is not None:
+            self.manifest.clear()
+
+    def _process_endofpipe(self) -> None:
+        # Finishes any loads left by an earlier run, even without input
+        self.prepare_load()
+        # Drains every sink and cleans each up once
+        super()._process_endofpipe()
+        self.stage.cleanup()
+        self.migration_executor.shutdown()
+        self.drain_executor.shutdown()
+        self.compression_executor.shutdown()
+        if self.parallel_encoder is not None:
+            self.parallel_encoder.close()
+        self.connection_pool.close()
+        for name, value in self.connection_pool.metrics.to_dict().items():
+            self.metrics.counter(f"connection_pool_{name}", value)
+        self.metrics.write_textfile()
+        self.profiler.write()
 
     def connect(self) -> Connection:
-        """Create a new database connection."""
-        return Connection(self.logger, **self.config["snowflake"])
+        """Create a new database connection backed by the shared pool."""
+        return Connection(self.logger, pool=self.connection_pool)
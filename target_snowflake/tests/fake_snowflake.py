@@ -0,0 +1,266 @@
+"""A local stand-in for Snowflake, for running the target without an account."""
+
+import csv
+import gzip
+import io
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from target_snowflake.target import SnowflakeTarget
+
+PUT = re.compile(
+    r"PUT 'file://(?P<source>[^']+)' @\S+?/(?P<prefix>\S+)/ "
+    r"AUTO_COMPRESS = (?P<compress>TRUE|FALSE)"
+)
+LIST = re.compile(r"LIST @\S+?/(?P<prefix>\S+)/")
+COPY = re.compile(
+    r'COPY INTO "[^"]+"\."(?P<table>[^"]+)" \((?P<columns>[^)]*)\) FROM .* '
+    r"FILES = \((?P<files>[^)]*)\) FILE_FORMAT = \(TYPE = '(?P<type>\w+)'",
+    re.DOTALL,
+)
+CREATE_LIKE = re.compile(
+    r'CREATE TRANSIENT TABLE "[^"]+"\."(?P<table>[^"]+)" LIKE "[^"]+"\."(?P<like>[^"]+)"'
+)
+MERGE = re.compile(
+    r'MERGE INTO "[^"]+"\."(?P<table>[^"]+)" t USING "[^"]+"\."(?P<staging>[^"]+)" s '
+    r".* INSERT \((?P<columns>[^)]*)\)"
+)
+ADD_COLUMNS = re.compile(r'(?P<table>ALTER TABLE "[^"]+") ADD COLUMN (?P<columns>.*)')
+QUALIFIED = re.compile(r'"[^"]+"\.(?=")')
+
+
+class FakeSnowflake:
+    """
+    A SQLite database that understands the subset of Snowflake SQL the target
+    issues: schema and stage DDL, INFORMATION_SCHEMA introspection, table
+    DDL, PUT, COPY INTO and MERGE.
+
+    Schemas are ignored, so every table lives in one namespace. PUT copies
+    files into a local stage directory, gzipping them like the client does,
+    and COPY INTO reads them back and inserts the rows. Time spent in each
+    kind of statement is added up in `timings`.
+    """
+
+    def __init__(self, stage_dir: Path) -> None:
+        self.stage_dir = stage_dir
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.timings: Dict[str, float] = defaultdict(float)
+        # Table name to clustering key, e.g. "LINEAR(CREATED_AT)"
+        self.clustering_keys: Dict[str, str] = {}
+        self.loaded_files: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def connect(self, logger: Logger) -> "FakeConnection":
+        return FakeConnection(self, logger)
+
+    def run(self, sql: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        with self._lock:
+            kind, res = self._run(sql, params)
+            self.timings[kind] += time.perf_counter() - start
+        return res
+
+    def table(self, table_name: str) -> List[Dict[str, Any]]:
+        """Return every row of a table."""
+        cur = self.db.execute(f'SELECT * FROM "{table_name}"')
+        names = [column[0] for column in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def _run(self, sql: str, params: Dict[str, Any]):
+        statement = sql.split(None, 2)[:2]
+        if statement in (["CREATE", "SCHEMA"], ["CREATE", "STAGE"]):
+            return "migrate", []
+        if sql.startswith("CREATE OR REPLACE STAGE"):
+            return "migrate", []
+        if statement[0] in ("START", "COMMIT", "ROLLBACK"):
+            return "other", []
+        if statement == ["SHOW", "WAREHOUSES"]:
+            return "other", []
+        if "INFORMATION_SCHEMA.TABLES" in sql:
+            clustering_key = self.clustering_keys.get(params["table_name"])
+            return "migrate", [{"CLUSTERING_KEY": clustering_key}]
+        if "INFORMATION_SCHEMA.COLUMNS" in sql:
+            return "migrate", self._columns(params.get("table_name"))
+        if statement[0] == "PUT":
+            return "stage", self._put(sql)
+        if statement[0] == "LIST":
+            return "stage", self._list(sql)
+        if statement == ["COPY", "INTO"]:
+            return "copy", self._copy(sql)
+
+        match = CREATE_LIKE.match(sql)
+        if match:
+            self.db.execute(
+                'CREATE TABLE "{table}" AS SELECT * FROM "{like}" WHERE 0'.format(
+                    **match.groupdict()
+                )
+            )
+            return "copy", []
+        match = MERGE.match(sql)
+        if match:
+            self.db.execute(
+                'INSERT OR REPLACE INTO "{table}" ({columns}) '
+                'SELECT {columns} FROM "{staging}"'.format(**match.groupdict())
+            )
+            return "copy", []
+
+        sql = QUALIFIED.sub("", sql).replace(", PRIMARY KEY ()", "")
+        match = ADD_COLUMNS.match(sql)
+        if match:
+            # SQLite adds one column per statement
+            for column in match.group("columns").split(", "):
+                self.db.execute("{} ADD COLUMN {}".format(match.group("table"), column))
+            return "migrate", []
+        self.db.execute(sql, params)
+        return "migrate" if statement[0] in ("CREATE", "ALTER") else "other", []
+
+    def _columns(self, table_name=None) -> List[Dict[str, Any]]:
+        tables = [
+            name
+            for (name,) in self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+            )
+            if table_name is None or name == table_name
+        ]
+        return [
+            {"TABLE_NAME": table, "COLUMN_NAME": column[1], "DATA_TYPE": column[2]}
+            for table in tables
+            for column in self.db.execute(f'PRAGMA table_info("{table}")')
+        ]
+
+    def _put(self, sql: str) -> List[Dict[str, Any]]:
+        match = PUT.match(sql)
+        assert match, sql
+        source = Path(match.group("source"))
+        sources = sorted(source.parent.glob(source.name))
+        destination = self.stage_dir / match.group("prefix")
+        destination.mkdir(parents=True, exist_ok=True)
+
+        res = []
+        for path in sources:
+            if match.group("compress") == "TRUE":
+                target = path.name + ".gz"
+                with open(path, "rb") as src, gzip.open(
+                    destination / target, "wb"
+                ) as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                target = path.name
+                shutil.copyfile(path, destination / target)
+            res.append(
+                {
+                    "source": path.name,
+                    "target": target,
+                    "source_size": path.stat().st_size,
+                    "target_size": (destination / target).stat().st_size,
+                    "status": "UPLOADED",
+                }
+            )
+        return res
+
+    def _list(self, sql: str) -> List[Dict[str, Any]]:
+        match = LIST.match(sql)
+        assert match, sql
+        directory = self.stage_dir / match.group("prefix")
+        if not directory.exists():
+            return []
+        return [
+            {"name": "stage/" + path.relative_to(self.stage_dir).as_posix()}
+            for path in sorted(directory.iterdir())
+        ]
+
+    def _copy(self, sql: str) -> List[Dict[str, Any]]:
+        match = COPY.match(sql)
+        assert match, sql
+        table = match.group("table")
+        columns = [column.strip('" ') for column in match.group("columns").split(",")]
+        insert = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            table,
+            ", ".join(f'"{column}"' for column in columns),
+            ", ".join("?" for _ in columns),
+        )
+        for file in re.findall(r"'([^']+)'", match.group("files")):
+            # Like Snowflake's load metadata, skip files already loaded
+            if (table, file) in self.loaded_files:
+                continue
+            self.loaded_files.add((table, file))
+            path = self.stage_dir / file
+            if match.group("type") == "PARQUET":
+                rows = self._read_parquet(path, columns)
+            else:
+                rows = self._read_csv(path)
+            self.db.executemany(insert, rows)
+            if "PURGE = TRUE" in sql:
+                path.unlink()
+        return [{"status": "LOADED"}]
+
+    @staticmethod
+    def _read_csv(path: Path) -> List[List[Union[str, None]]]:
+        if path.suffix == ".zst":
+            import zstandard
+
+            raw: Any = zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_across_frames=True
+            )
+        elif path.suffix == ".gz":
+            raw = gzip.open(path, "rb")
+        else:
+            raw = open(path, "rb")
+        with io.TextIOWrapper(raw, newline="", encoding="utf-8") as fp:
+            reader = csv.reader(fp)
+            next(reader)
+            return [[value if value != "" else None for value in row] for row in reader]
+
+    @staticmethod
+    def _read_parquet(path: Path, columns: List[str]) -> List[List[Any]]:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(io.BytesIO(path.read_bytes()), columns=columns)
+        # NUMBER columns are staged as decimals, which sqlite can't bind
+        return [
+            [int(value) if isinstance(value, Decimal) else value for value in row]
+            for row in (row.values() for row in table.to_pylist())
+        ]
+
+
+class FakeConnection:
+    """A drop-in for `Connection` that runs statements on a `FakeSnowflake`."""
+
+    def __init__(self, database: FakeSnowflake, logger: Logger) -> None:
+        self.database = database
+        self.logger = logger
+
+    def execute(self, sql: str, *args, secret: bool = False) -> None:
+        self.logger.debug(sql)
+        self.database.run(sql, args[0] if args else {})
+
+    def query(self, sql: Union[str, List[str]], **kwargs) -> List[Dict[str, Any]]:
+        result: List[Dict[str, Any]] = []
+        for query in [sql] if isinstance(sql, str) else sql:
+            self.logger.debug(query)
+            result = self.database.run(query, kwargs)
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+class LocalSnowflakeTarget(SnowflakeTarget):
+    """A `SnowflakeTarget` that loads into a `FakeSnowflake`."""
+
+    def __init__(
+        self, database: FakeSnowflake, config: Optional[Dict[str, Any]] = None
+    ) -> None:
+        self.database = database
+        super().__init__(config=config)
+
+    def connect(self) -> FakeConnection:  # type: ignore[override]
+        return self.database.connect(self.logger)
@@ -0,0 +1,72 @@
+import gzip
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from target_snowflake.database_target.compression import (
+    BlockCompressor,
+    Codec,
+    GzipCodec,
+    ZstdCodec,
+    get_codec,
+)
+
+
+def compress(data: bytes, codec, **kwargs) -> bytes:
+    out = io.BytesIO()
+    out.close = lambda: None  # type: ignore[assignment]
+    compressor = BlockCompressor(out, codec, block_size=1000, **kwargs)
+    for i in range(0, len(data), 777):
+        compressor.write(data[i : i + 777])
+    assert compressor.tell() == len(data)
+    compressor.close()
+    return out.getvalue()
+
+
+DATA = b"".join(
+    b"%d,user %d,%s\n" % (i, i, os.urandom(4).hex().encode()) for i in range(2000)
+)
+
+
+@pytest.mark.parametrize("data", [DATA, b""])
+def test_gzip_blocks_make_one_stream(data: bytes):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        compressed = compress(
+            data, GzipCodec(), executor=executor, max_pending_blocks=3
+        )
+
+    assert gzip.decompress(compressed) == data
+    # Each block is primed with the last, so it compresses about as well as gzip
+    assert len(compressed) < 1.1 * len(gzip.compress(data)) + 100
+
+
+def test_gzip_blocks_compress_inline():
+    assert gzip.decompress(compress(DATA, GzipCodec(level=1))) == DATA
+
+
+def test_zstd_blocks_are_frames():
+    zstandard = pytest.importorskip("zstandard")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        compressed = compress(DATA, ZstdCodec(), executor=executor)
+
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(compressed), read_across_frames=True
+    )
+    assert reader.read() == DATA
+
+
+def test_unknown_codec():
+    assert get_codec("none") is None
+    with pytest.raises(ValueError):
+        get_codec("lzma")
+
+
+def test_incomplete_codec_cannot_be_created():
+    class NoCompression(Codec):
+        name = "NONE"
+        extension = "raw"
+
+    with pytest.raises(TypeError):
+        NoCompression()  # type: ignore[abstract]
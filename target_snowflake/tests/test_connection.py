@@ -0,0 +1,98 @@
+import logging
+import threading
+
+import pytest
+import snowflake.connector
+
+from target_snowflake.connection import Connection, ConnectionPool
+
+
+class FakeCursor:
+    sfqid = "query"
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, sql, params=None) -> None:
+        # Like the connector, log the statement with its parameters bound
+        logging.getLogger("snowflake.connector.cursor").debug(
+            "query: [%s]", sql % params if params else sql
+        )
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.closed = False
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor()
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch) -> ConnectionPool:
+    monkeypatch.setattr(
+        snowflake.connector,
+        "connect",
+        lambda **kwargs: FakeSession(),
+    )
+    return ConnectionPool(logging.getLogger(), max_size=2)
+
+
+def test_sessions_are_reused(pool: ConnectionPool):
+    for _ in range(5):
+        with pool.session():
+            pass
+
+    assert pool.metrics.logins == 1
+    assert pool.metrics.checkouts == 5
+
+
+def test_checkout_waits_when_exhausted(pool: ConnectionPool):
+    first = pool.checkout()
+    pool.checkout()
+
+    checked_out = threading.Event()
+
+    def checkout_third():
+        pool.checkout()
+        checked_out.set()
+
+    thread = threading.Thread(target=checkout_third)
+    thread.start()
+    assert not checked_out.wait(timeout=0.1)
+
+    pool.checkin(first)
+    assert checked_out.wait(timeout=5)
+    thread.join()
+    assert pool.metrics.logins == 2
+    assert pool.metrics.waits == 1
+
+
+def test_closed_sessions_are_replaced(pool: ConnectionPool):
+    session = pool.checkout()
+    pool.checkin(session)
+    session.closed = True
+
+    assert pool.checkout() is not session
+    assert pool.metrics.logins == 2
+    assert pool.metrics.failed_health_checks == 1
+
+
+def test_secret_parameters_are_not_logged(pool: ConnectionPool, caplog):
+    connection = Connection(logging.getLogger(), pool)
+    with caplog.at_level(logging.DEBUG):
+        connection.execute("SELECT %(secret)s", {"secret": "hunter2"}, secret=True)
+        connection.execute("SELECT %(value)s", {"value": "shown"})
+
+    assert "SELECT %(secret)s" in caplog.text
+    assert "hunter2" not in caplog.text
+    assert "query: [SELECT shown]" in caplog.text
@@ -0,0 +1,86 @@
+import csv
+from pathlib import Path
+
+from target_snowflake.database_target.batch_writer import ShardedBatchWriter
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+
+
+def test_streaming_writer(tmp_path: Path):
+    filepath = tmp_path / "users.csv"
+    writer = CSVBatchWriter(filepath)
+    writer.write_record({"id": 1, "name": "alice"})
+    writer.write_record({"id": 2, "name": "bob, jr."})
+    writer.close()
+
+    assert writer.record_count == 2
+    assert writer.bytes_written == filepath.stat().st_size
+    with open(filepath, newline="") as fp:
+        rows = list(csv.reader(fp))
+    assert rows == [["id", "name"], ["1", "alice"], ["2", "bob, jr."]]
+
+
+def test_sharded_writer(tmp_path: Path):
+    writer = ShardedBatchWriter(
+        tmp_path / "users.csv",
+        shard_count=3,
+        open_writer=lambda filepath: CSVBatchWriter(filepath),
+    )
+    for i in range(7):
+        writer.write_record({"id": i})
+    writer.close()
+
+    assert writer.record_count == 7
+    assert [path.name for path in writer.filepaths] == [
+        "part-000.csv",
+        "part-001.csv",
+        "part-002.csv",
+    ]
+    assert all(path.parent == tmp_path / "users" for path in writer.filepaths)
+    with open(writer.filepaths[0], newline="") as fp:
+        assert list(csv.reader(fp)) == [["id"], ["0"], ["3"], ["6"]]
+
+
+def test_sharded_writer_by_key(tmp_path: Path):
+    writer = ShardedBatchWriter(
+        tmp_path / "users.csv",
+        shard_count=4,
+        open_writer=lambda filepath: CSVBatchWriter(filepath),
+        shard_key=lambda record: record["id"],
+    )
+    for i in range(20):
+        writer.write_record({"id": i % 5, "version": i})
+    writer.close()
+
+    ids_per_shard = []
+    for filepath in writer.filepaths:
+        with open(filepath, newline="") as fp:
+            ids_per_shard.append({row["id"] for row in csv.DictReader(fp)})
+    for i, ids in enumerate(ids_per_shard):
+        for other in ids_per_shard[i + 1 :]:
+            assert not ids & other
+
+
+def test_writer_encodes_nested_values_as_json(tmp_path: Path):
+    filepath = tmp_path / "users.csv"
+    writer = CSVBatchWriter(filepath)
+    writer.write_record({"id": 1, "tags": ["a", "b"], "profile": {"age": 30}})
+    writer.close()
+
+    with open(filepath, newline="") as fp:
+        rows = list(csv.reader(fp))
+    assert rows[1] == ["1", '["a","b"]', '{"age":30}']
+
+
+def test_sharded_writer_keeps_compressed_extension(tmp_path: Path):
+    writer = ShardedBatchWriter(
+        tmp_path / "users-2021-09-20.T124500.csv.gz",
+        shard_count=2,
+        open_writer=lambda filepath: CSVBatchWriter(filepath),
+    )
+    writer.close()
+
+    assert [path.name for path in writer.filepaths] == [
+        "part-000.csv.gz",
+        "part-001.csv.gz",
+    ]
+    assert writer.directory == tmp_path / "users-2021-09-20.T124500"
@@ -0,0 +1,330 @@
+import io
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from target_snowflake.sinks import SnowflakeSink
+from target_snowflake.tests.fake_snowflake import FakeSnowflake, LocalSnowflakeTarget
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer"},
+        "name": {"type": ["null", "string"]},
+        "tags": {"type": ["null", "array"]},
+    },
+}
+
+
+def run_target(database: FakeSnowflake, messages, **config) -> None:
+    target = LocalSnowflakeTarget(
+        database,
+        config={
+            "snowflake": {
+                "account": "local",
+                "user": "user",
+                "password": "password",
+                "database": "TEST",
+            },
+            "batch_size_rows": 3,
+            **config,
+        },
+    )
+    lines = "\n".join(json.dumps(message) for message in messages)
+    target.listen(io.TextIOWrapper(io.BytesIO(lines.encode()), encoding="utf-8"))
+
+
+def messages(records):
+    yield {
+        "type": "SCHEMA",
+        "stream": "users",
+        "schema": SCHEMA,
+        "key_properties": ["id"],
+    }
+    for record in records:
+        yield {"type": "RECORD", "stream": "users", "record": record}
+    yield {"type": "STATE", "value": {"users": len(records)}}
+
+
+def test_append(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}", "tags": ["a", i]} for i in range(10)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        metrics_textfile=str(tmp_path / "metrics.prom"),
+    )
+
+    rows = database.table("USERS")
+    assert len(rows) == 10
+    assert rows[3] == {"ID": 3, "NAME": "user 3", "TAGS": '["a",3]'}
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'target_snowflake_record_count_total{stream="users"} 10' in metrics
+    assert "target_snowflake_batch_copy_duration_seconds_count" in metrics
+
+
+def test_upsert(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i % 4, "name": f"version {i}"} for i in range(10)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        load_method="upsert",
+    )
+
+    rows = database.table("USERS")
+    assert {row["ID"]: row["NAME"] for row in rows} == {
+        0: "version 8",
+        1: "version 9",
+        2: "version 6",
+        3: "version 7",
+    }
+
+
+def test_upsert_dedupes_keys_within_batch(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i % 4, "name": f"version {i}"} for i in range(10)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        load_method="upsert",
+        batch_size_rows=100,
+        metrics_textfile=str(tmp_path / "metrics.prom"),
+    )
+
+    rows = database.table("USERS")
+    assert {row["ID"]: row["NAME"] for row in rows} == {
+        0: "version 8",
+        1: "version 9",
+        2: "version 6",
+        3: "version 7",
+    }
+    # Only the last record for each key was staged and merged
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'target_snowflake_record_count_total{stream="users"} 4' in metrics
+    # The staging table is dropped once merged
+    assert [
+        table
+        for table, in database.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    ] == ["USERS"]
+
+
+def test_upsert_updates_existing_rows(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    database.db.execute(
+        'CREATE TABLE "USERS" ("ID" NUMBER, "NAME" TEXT, "TAGS" ARRAY, '
+        'PRIMARY KEY ("ID"))'
+    )
+    database.db.executemany(
+        'INSERT INTO "USERS" ("ID", "NAME") VALUES (?, ?)',
+        [(1, "alice"), (2, "bob")],
+    )
+
+    run_target(
+        database,
+        messages([{"id": 2, "name": "robert"}, {"id": 3, "name": "carol"}]),
+        output_path_prefix=f"{tmp_path}/",
+        load_method="upsert",
+    )
+
+    rows = database.table("USERS")
+    assert {row["ID"]: row["NAME"] for row in rows} == {
+        1: "alice",
+        2: "robert",
+        3: "carol",
+    }
+
+
+def test_sort_by_clustering_key(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    database.db.execute('CREATE TABLE "USERS" ("ID" NUMBER, "NAME" TEXT, "TAGS" ARRAY)')
+    database.clustering_keys["USERS"] = 'LINEAR(SUBSTRING("NAME", 1, 3))'
+    names = [f"user {i:02d}" for i in range(20)]
+    random.shuffle(names)
+    records = [{"id": i, "name": name} for i, name in enumerate(names)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        batch_size_rows=100,
+        sort_by_clustering_key=True,
+        sort_buffer_rows=6,
+    )
+
+    assert [row["NAME"] for row in database.table("USERS")] == sorted(names)
+
+
+def test_memory_budget(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": "x" * 2000} for i in range(2500)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        batch_size_rows=100000,
+        memory_budget_mb=1,
+        metrics_textfile=str(tmp_path / "metrics.prom"),
+    )
+
+    assert len(database.table("USERS")) == 2500
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert (
+        'target_snowflake_memory_budget_drain_count_total{stream="users"} 2' in metrics
+    )
+
+
+def test_resume_from_manifest(tmp_path: Path, capsys):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}"} for i in range(10)]
+    config = {
+        "output_path_prefix": f"{tmp_path}/",
+        "load_manifest": str(tmp_path / "manifest.jsonl"),
+        "purge_stage_on_complete": False,
+    }
+    copy = database._copy
+
+    def fail_last_copy(sql):
+        if len(database.table("USERS")) == 9:
+            raise RuntimeError("connection lost")
+        return copy(sql)
+
+    database._copy = fail_last_copy  # type: ignore[assignment]
+    with pytest.raises(RuntimeError):
+        run_target(database, messages(records), **config)
+    assert len(database.table("USERS")) == 9
+    assert capsys.readouterr().out == ""
+
+    database._copy = copy  # type: ignore[assignment]
+    run_target(database, [], resume_loads=True, **config)
+
+    assert len(database.table("USERS")) == 10
+    states = capsys.readouterr().out.splitlines()
+    assert [json.loads(state) for state in states] == [{"users": 10}] * len(states)
+    assert (tmp_path / "manifest.jsonl").read_text() == ""
+
+
+def test_restart_discards_unfinished_loads(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}"} for i in range(10)]
+    config = {
+        "output_path_prefix": f"{tmp_path}/",
+        "load_manifest": str(tmp_path / "manifest.jsonl"),
+        "batch_size_rows": 100,
+    }
+    copy = database._copy
+
+    def fail_copy(sql):
+        raise RuntimeError("connection lost")
+
+    database._copy = fail_copy  # type: ignore[assignment]
+    with pytest.raises(RuntimeError):
+        run_target(database, messages(records), **config)
+    assert database.table("USERS") == []
+
+    # The tap never saw a STATE, so sends every record again
+    database._copy = copy  # type: ignore[assignment]
+    run_target(database, messages(records), **config)
+
+    assert len(database.table("USERS")) == 10
+    assert (tmp_path / "manifest.jsonl").read_text() == ""
+
+
+def test_flatten_nested_objects(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    schema = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "address": {
+                "type": ["null", "object"],
+                "properties": {"city": {"type": ["null", "string"]}},
+            },
+        },
+    }
+    stream = [
+        {"type": "SCHEMA", "stream": "users", "schema": schema, "key_properties": []},
+        {"type": "RECORD", "stream": "users", "record": {"id": 1}},
+        {
+            "type": "RECORD",
+            "stream": "users",
+            "record": {"id": 2, "address": {"city": "Paris"}},
+        },
+    ]
+
+    run_target(database, stream, output_path_prefix=f"{tmp_path}/", flatten_max_depth=1)
+
+    assert database.table("USERS") == [
+        {"ID": 1, "ADDRESS__CITY": None},
+        {"ID": 2, "ADDRESS__CITY": "Paris"},
+    ]
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd", "none"])
+def test_compress_while_writing(tmp_path: Path, compression: str):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}", "tags": ["a", i]} for i in range(10)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        files_per_batch=2,
+        staging_compression=compression,
+        compression_level=1,
+    )
+
+    rows = database.table("USERS")
+    assert len(rows) == 10
+    assert rows[3] == {"ID": 3, "NAME": "user 3", "TAGS": '["a",3]'}
+
+
+def test_profile_phases(tmp_path: Path):
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}"} for i in range(10)]
+
+    run_target(
+        database,
+        messages(records),
+        output_path_prefix=f"{tmp_path}/",
+        profile_dir=str(tmp_path / "profiles"),
+        profile_sample_rate=1,
+    )
+
+    assert len(database.table("USERS")) == 10
+    assert sorted(path.name for path in (tmp_path / "profiles").iterdir()) == [
+        "read_messages.pstats",
+        "users.load_batch.pstats",
+        "users.process_batch.pstats",
+        "users.sync_table_schema.pstats",
+        "users.write_csv.pstats",
+    ]
+
+
+def test_sinks_cleaned_up_once(tmp_path: Path, monkeypatch):
+    cleaned_up = []
+    clean_up = SnowflakeSink.clean_up
+
+    def count_clean_up(sink: SnowflakeSink) -> None:
+        cleaned_up.append(sink.stream_name)
+        clean_up(sink)
+
+    monkeypatch.setattr(SnowflakeSink, "clean_up", count_clean_up)
+    database = FakeSnowflake(tmp_path / "stage")
+
+    run_target(database, messages([{"id": 1}]), output_path_prefix=f"{tmp_path}/")
+
+    assert cleaned_up == ["users"]
@@ -0,0 +1,59 @@
+import datetime
+import random
+from pathlib import Path
+
+from target_snowflake.database_target.external_sort import (
+    ExternalSorter,
+    record_sort_key,
+)
+from target_snowflake.migrator import SnowflakeSchemaMigrator
+
+
+def test_sort_spilled_runs(tmp_path: Path):
+    records = [{"n": random.randint(0, 50), "i": i} for i in range(1000)]
+    sorter = ExternalSorter(record_sort_key(["n"]), run_size=64, directory=tmp_path)
+    for record in records:
+        sorter.add(record)
+
+    assert len(sorter) == 1000
+    assert len(sorter.runs) == 15
+    # Stable, like sorted()
+    assert list(sorter) == sorted(records, key=lambda record: record["n"])
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sort_mixed_types():
+    records = [{"v": v} for v in ["b", None, 2, "a", 1.5, None, True]]
+    sorter = ExternalSorter(record_sort_key(["v"]), run_size=3)
+    for record in records:
+        sorter.add(record)
+
+    assert [record["v"] for record in sorter] == [True, 1.5, 2, "a", "b", None, None]
+
+
+def test_sort_naive_and_aware_datetimes():
+    utc = datetime.timezone.utc
+    plus_two = datetime.timezone(datetime.timedelta(hours=2))
+    values = [
+        datetime.datetime(2021, 1, 1, 12, 0),
+        datetime.datetime(2021, 1, 1, 11, 0, tzinfo=utc),
+        datetime.datetime(2021, 1, 1, 13, 15, tzinfo=plus_two),
+        datetime.datetime(2021, 1, 1, 11, 30),
+    ]
+    sorter = ExternalSorter(record_sort_key(["v"]), run_size=2)
+    for value in values:
+        sorter.add({"v": value})
+
+    # Naive values sort as UTC
+    assert [record["v"] for record in sorter] == [
+        values[1],
+        values[2],
+        values[3],
+        values[0],
+    ]
+
+
+def test_parse_clustering_key():
+    parse = SnowflakeSchemaMigrator.parse_clustering_key
+    assert parse('LINEAR(TO_DATE(created_at), "id")') == ["CREATED_AT", "id"]
+    assert parse("LINEAR(DATE_TRUNC('DAY', TS), USER_ID)") == ["TS", "USER_ID"]
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+from target_snowflake.manifest import LoadManifest
+
+
+def write_batch(manifest: LoadManifest, batch_id: str, path: Path) -> None:
+    path.write_text("ID\n1\n")
+    manifest.submitted(batch_id)
+    manifest.written(
+        batch_id,
+        stream="users",
+        files=[str(path)],
+        record_count=1,
+        upsert=False,
+    )
+
+
+def test_recover_state_waiting_on_loads(tmp_path: Path):
+    manifest = LoadManifest(str(tmp_path / "manifest.jsonl"))
+    write_batch(manifest, "a", tmp_path / "a.csv")
+    manifest.copied("a")
+    write_batch(manifest, "b", tmp_path / "b.csv")
+    manifest.staged("b", ["USERS/b.csv.gz"])
+    write_batch(manifest, "c", tmp_path / "c.csv")
+    manifest.checkpoint({"bookmark": 3})
+
+    state, batches = LoadManifest(manifest.path).recoverable()
+
+    assert state == {"bookmark": 3}
+    assert [batch["batch"] for batch in batches] == ["b", "c"]
+    assert batches[0]["staged_files"] == ["USERS/b.csv.gz"]
+
+
+def test_unrecoverable_batch_falls_back_to_earlier_state(tmp_path: Path):
+    manifest = LoadManifest(str(tmp_path / "manifest.jsonl"))
+    write_batch(manifest, "a", tmp_path / "a.csv")
+    manifest.checkpoint({"bookmark": 1})
+    manifest.submitted("b")
+    manifest.checkpoint({"bookmark": 2})
+    with open(manifest.path, "a") as fp:
+        fp.write('{"event": "cop')
+
+    state, batches = manifest.recoverable()
+
+    assert state == {"bookmark": 1}
+    assert [batch["batch"] for batch in batches] == ["a"]
+
+    (tmp_path / "a.csv").unlink()
+    assert manifest.recoverable() == (None, [])
+
+
+def test_clear(tmp_path: Path):
+    manifest = LoadManifest(str(tmp_path / "manifest.jsonl"))
+    write_batch(manifest, "a", tmp_path / "a.csv")
+    manifest.checkpoint({"bookmark": 1})
+    manifest.clear()
+
+    assert manifest.recoverable() == (None, [])
+
+
+def test_streamed_batch_is_recoverable_without_local_files(tmp_path: Path):
+    manifest = LoadManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.submitted("a")
+    manifest.written(
+        "a",
+        stream="users",
+        files=[str(tmp_path / "a.csv")],
+        record_count=1,
+        upsert=True,
+        streamed=True,
+        staged_files=["USERS/a/a.csv"],
+    )
+    manifest.checkpoint({"bookmark": 1})
+
+    state, batches = manifest.recoverable()
+
+    assert state == {"bookmark": 1}
+    assert [batch["batch"] for batch in batches] == ["a"]
+    assert batches[0]["staged_files"] == ["USERS/a/a.csv"]
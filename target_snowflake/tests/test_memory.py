@@ -0,0 +1,40 @@
+import sys
+import threading
+
+from target_snowflake.memory import MemoryBudget, RecordSizeEstimator, deep_sizeof
+
+
+def test_deep_sizeof():
+    text = "x" * 1000
+    assert deep_sizeof({"a": [text]}) > sys.getsizeof(text)
+
+
+def test_record_size_estimator_samples():
+    estimator = RecordSizeEstimator(sample_every=10)
+    estimator.observe({"a": "x" * 1000})
+    size = estimator.bytes_per_record
+    for _ in range(9):
+        estimator.observe({})
+    assert estimator.bytes_per_record == size
+
+
+def test_drain_largest_sinks_first():
+    budget = MemoryBudget(budget_bytes=100, low_water=0.5)
+
+    assert budget.sinks_to_drain({"a": 40, "b": 50}) == []
+    assert budget.sinks_to_drain({"a": 40, "b": 50, "c": 30}) == ["b", "a"]
+    assert budget.sinks_to_drain({"a": 200, "b": 0}) == ["a"]
+
+
+def test_queued_batches_count_towards_budget():
+    budget = MemoryBudget(budget_bytes=100, low_water=0.5)
+    budget.queue(80)
+
+    assert budget.over_budget({"a": 30})
+    assert budget.sinks_to_drain({"a": 30}) == ["a"]
+    assert not budget.wait_for_queue(buffered_bytes=0, timeout=0.01)
+
+    thread = threading.Timer(0.01, budget.dequeue, args=(80,))
+    thread.start()
+    assert budget.wait_for_queue(buffered_bytes=0, timeout=5)
+    assert not budget.over_budget({"a": 30})
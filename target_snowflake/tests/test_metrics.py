@@ -0,0 +1,79 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+
+from target_snowflake.metrics import Metrics
+
+
+def test_metric_lines(caplog):
+    metrics = Metrics(logging.getLogger("test-metrics"))
+    with caplog.at_level(logging.INFO):
+        metrics.counter("record_count", 10, stream="users", batch_id="abc")
+        with pytest.raises(ValueError):
+            with metrics.timer("batch_copy_duration", stream="users") as tags:
+                tags["query_id"] = "01a2"
+                raise ValueError()
+
+    points = [
+        json.loads(record.getMessage()[len("METRIC: ") :]) for record in caplog.records
+    ]
+    assert points[0] == {
+        "type": "counter",
+        "metric": "record_count",
+        "value": 10,
+        "tags": {"stream": "users", "batch_id": "abc"},
+    }
+    assert points[1]["type"] == "timer"
+    assert points[1]["tags"] == {
+        "stream": "users",
+        "query_id": "01a2",
+        "status": "failed",
+    }
+
+
+def test_textfile(tmp_path: Path):
+    textfile = tmp_path / "target_snowflake.prom"
+    metrics = Metrics(logging.getLogger("test-metrics"), textfile=str(textfile))
+    metrics.counter("record_count", 10, stream="users", batch_id="a")
+    metrics.counter("record_count", 5, stream="users", batch_id="b")
+    metrics.counter("record_count", 1, stream='odd "name"')
+    metrics.time("batch_copy_duration", 1.5, stream="users", query_id="01a2")
+    metrics.time("batch_copy_duration", 0.5, stream="users", query_id="01a3")
+    metrics.write_textfile()
+
+    assert textfile.read_text().splitlines() == [
+        "# TYPE target_snowflake_record_count_total counter",
+        'target_snowflake_record_count_total{stream="odd \\"name\\""} 1',
+        'target_snowflake_record_count_total{stream="users"} 15',
+        "# TYPE target_snowflake_batch_copy_duration_seconds summary",
+        'target_snowflake_batch_copy_duration_seconds_count{stream="users"} 2',
+        'target_snowflake_batch_copy_duration_seconds_sum{stream="users"} 2.0',
+    ]
+
+
+def test_textfile_written_from_many_threads(tmp_path: Path):
+    textfile = tmp_path / "target_snowflake.prom"
+    metrics = Metrics(logging.getLogger("test-metrics"), textfile=str(textfile))
+    errors = []
+
+    def load_batches() -> None:
+        try:
+            for _ in range(100):
+                metrics.counter("record_count", 1, stream="users")
+                metrics.write_textfile()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load_batches) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # The last write saw every count
+    assert 'record_count_total{stream="users"} 400' in textfile.read_text()
+    assert [path.name for path in tmp_path.iterdir()] == [textfile.name]
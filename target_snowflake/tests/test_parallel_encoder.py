@@ -0,0 +1,68 @@
+import gzip
+from pathlib import Path
+
+from target_snowflake.database_target.compression import GzipCodec
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.database_target.parallel_encoder import ParallelEncoder
+from target_snowflake.database_target.row_encoder import RowEncoder
+
+
+def test_parts_match_single_writer(tmp_path: Path):
+    encoder = RowEncoder(
+        column_definitions={"ID": "NUMBER", "NAME": "TEXT", "TAGS": "VARIANT"},
+        column_properties={"ID": "id", "NAME": "name", "TAGS": "tags"},
+    )
+    records = [
+        {"id": i, "name": f"user, {i}", "tags": {"n": [i, str(i)]}} for i in range(50)
+    ]
+
+    single = CSVBatchWriter(tmp_path / "single.csv", encoder=encoder)
+    for record in records:
+        single.write_record(record)
+    single.close()
+
+    parallel = ParallelEncoder(workers=2, min_records_per_part=10)
+    try:
+        assert parallel.should_encode(records)
+        batch = parallel.write(
+            tmp_path / "batch.csv", records, CSVBatchWriter, encoder, part_count=3
+        )
+    finally:
+        parallel.close()
+
+    assert batch.record_count == 50
+    assert batch.header == ["ID", "NAME", "TAGS"]
+    assert batch.bytes_written == sum(path.stat().st_size for path in batch.filepaths)
+    expected = (tmp_path / "single.csv").read_bytes().splitlines()
+    rows = [expected[0]]
+    for path in batch.filepaths:
+        lines = path.read_bytes().splitlines()
+        assert lines[0] == expected[0]
+        rows.extend(lines[1:])
+    assert rows == expected
+
+
+def test_parts_keep_compressed_extension(tmp_path: Path):
+    encoder = RowEncoder(
+        column_definitions={"ID": "NUMBER"}, column_properties={"ID": "id"}
+    )
+    records = [{"id": i} for i in range(20)]
+
+    parallel = ParallelEncoder(workers=2, min_records_per_part=10)
+    try:
+        batch = parallel.write(
+            tmp_path / "batch.csv.gz",
+            records,
+            CSVBatchWriter,
+            encoder,
+            part_count=2,
+            codec=GzipCodec(),
+        )
+    finally:
+        parallel.close()
+
+    assert [path.name for path in batch.filepaths] == [
+        "part-000.csv.gz",
+        "part-001.csv.gz",
+    ]
+    assert gzip.decompress(batch.filepaths[1].read_bytes()).splitlines()[1] == b"10"
@@ -0,0 +1,73 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from target_snowflake.database_target.row_encoder import RowEncoder
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_writer(tmp_path: Path):
+    from target_snowflake.database_target.parquet_writer import ParquetBatchWriter
+
+    encoder = RowEncoder(
+        column_definitions={
+            "ID": "NUMBER",
+            "NAME": "TEXT",
+            "CREATED_AT": "TIMESTAMP_TZ",
+            "BIRTHDAY": "DATE",
+            "PROFILE": "VARIANT",
+        },
+        column_properties={
+            "ID": "id",
+            "NAME": "name",
+            "CREATED_AT": "created_at",
+            "BIRTHDAY": "birthday",
+            "PROFILE": "profile",
+        },
+    )
+    filepath = tmp_path / "users.parquet"
+    writer = ParquetBatchWriter(filepath, encoder=encoder, row_group_size=2)
+    writer.write_record(
+        {
+            "id": 1,
+            "name": "alice",
+            "created_at": datetime.datetime(
+                2021, 9, 20, 12, 45, tzinfo=datetime.timezone.utc
+            ),
+            "birthday": "1990-01-02",
+            "profile": {"age": 30},
+        }
+    )
+    writer.write_record({"id": 2})
+    writer.write_record({"id": 3, "name": "carol"})
+    writer.close()
+
+    table = pq.read_table(filepath)
+    assert table.column_names == ["ID", "NAME", "CREATED_AT", "BIRTHDAY", "PROFILE"]
+    assert table.column("ID").to_pylist() == [1, 2, 3]
+    assert table.column("NAME").to_pylist() == ["alice", None, "carol"]
+    assert table.column("BIRTHDAY").to_pylist() == [
+        datetime.date(1990, 1, 2),
+        None,
+        None,
+    ]
+    assert table.column("PROFILE").to_pylist() == ['{"age":30}', None, None]
+    assert pq.ParquetFile(filepath).num_row_groups == 2
+
+
+def test_parquet_writer_numbers_beyond_int64(tmp_path: Path):
+    from target_snowflake.database_target.parquet_writer import ParquetBatchWriter
+
+    encoder = RowEncoder(
+        column_definitions={"ID": "NUMBER"}, column_properties={"ID": "id"}
+    )
+    filepath = tmp_path / "users.parquet"
+    writer = ParquetBatchWriter(filepath, encoder=encoder)
+    for id in (1, 2**63, -(10**37), None):
+        writer.write_record({"id": id})
+    writer.close()
+
+    table = pq.read_table(filepath)
+    assert table.column("ID").to_pylist() == [1, 2**63, -(10**37), None]
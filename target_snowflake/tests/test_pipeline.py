@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from target_snowflake.pipeline import LoadPipeline
+
+
+def test_loads_run_in_order():
+    loaded = []
+    pipeline = LoadPipeline(name="users", max_inflight=2)
+    for i in range(10):
+        pipeline.submit(lambda i=i: loaded.append(i))
+    pipeline.join()
+
+    assert loaded == list(range(10))
+    pipeline.close()
+
+
+def test_submit_blocks_when_full():
+    release = threading.Event()
+    pipeline = LoadPipeline(name="users", max_inflight=1)
+    pipeline.submit(release.wait)
+
+    submitted = threading.Event()
+
+    def submit_next():
+        pipeline.submit(lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=submit_next)
+    thread.start()
+    assert not submitted.wait(timeout=0.1)
+
+    release.set()
+    assert submitted.wait(timeout=5)
+    thread.join()
+    pipeline.close()
+
+
+def test_failed_load_is_raised():
+    loaded = []
+
+    def fail():
+        raise ValueError("COPY failed")
+
+    pipeline = LoadPipeline(name="users", max_inflight=2)
+    pipeline.submit(fail)
+    pipeline.submit(lambda: loaded.append(1))
+    with pytest.raises(ValueError):
+        pipeline.join()
+    assert loaded == []
+
+
+def test_pipelines_share_executor():
+    # Each table's loads wait on the other table's, so this only finishes if
+    # the two pipelines run concurrently
+    users_loaded = threading.Event()
+    orders_loaded = threading.Event()
+    loaded = []
+
+    def load(table, i, mine, theirs):
+        def job():
+            loaded.append((table, i))
+            mine.set()
+            assert theirs.wait(timeout=5)
+
+        return job
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    users = LoadPipeline(name="users", max_inflight=3, executor=executor)
+    orders = LoadPipeline(name="orders", max_inflight=3, executor=executor)
+    for i in range(3):
+        users.submit(load("users", i, users_loaded, orders_loaded))
+        orders.submit(load("orders", i, orders_loaded, users_loaded))
+    users.close()
+    orders.close()
+    executor.shutdown()
+
+    assert [i for table, i in loaded if table == "users"] == [0, 1, 2]
+    assert [i for table, i in loaded if table == "orders"] == [0, 1, 2]
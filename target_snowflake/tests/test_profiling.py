@@ -0,0 +1,52 @@
+import logging
+import pstats
+import time
+from pathlib import Path
+
+from target_snowflake.profiling import Profiler
+
+logger = logging.getLogger(__name__)
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_pstats_per_stream_and_phase(tmp_path: Path):
+    profiler = Profiler(logger, str(tmp_path))
+    for _ in range(2):
+        with profiler.phase("write_csv", "public-users"):
+            busy(0.01)
+            # Covered by the outer profile
+            with profiler.phase("load_batch", "public-users"):
+                busy(0.01)
+    profiler.write()
+
+    assert [path.name for path in tmp_path.iterdir()] == [
+        "public-users.write_csv.pstats"
+    ]
+    stats = pstats.Stats(str(tmp_path / "public-users.write_csv.pstats")).stats
+    calls = {func[2]: stat[1] for func, stat in stats.items()}  # type: ignore
+    assert calls["busy"] == 4
+
+
+def test_collapsed_stacks(tmp_path: Path):
+    profiler = Profiler(logger, str(tmp_path), format="collapsed", interval=0.001)
+    with profiler.phase("read_messages"):
+        busy(0.1)
+    profiler.write()
+
+    lines = (tmp_path / "read_messages.collapsed").read_text().splitlines()
+    assert any("test_collapsed_stacks" in line and ";busy (" in line for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) > 10
+
+
+def test_sample_rate(tmp_path: Path):
+    profiler = Profiler(logger, str(tmp_path / "profiles"), sample_rate=0)
+    with profiler.phase("write_csv", "users"):
+        busy(0.01)
+    profiler.write()
+
+    assert list((tmp_path / "profiles").iterdir()) == []
@@ -0,0 +1,66 @@
+import io
+import logging
+
+import pytest
+
+from target_snowflake.reader import FastSingerReader, iter_lines
+
+
+def test_iter_lines_across_blocks():
+    data = b'{"a": 1}\n\n{"b": "two"}\n{"c": [3]}'
+    for block_size in [1, 4, 7, 1024]:
+        assert list(iter_lines(io.BytesIO(data), block_size)) == [
+            b'{"a": 1}',
+            b'{"b": "two"}',
+            b'{"c": [3]}',
+        ]
+
+
+class RecordingReader(FastSingerReader):
+    name = "target-test"
+    logger = logging.getLogger("target-test")
+
+    def __init__(self):
+        self.messages = []
+
+    def _process_record_message(self, message):
+        self.messages.append(message)
+
+    _process_schema_message = _process_record_message
+    _process_state_message = _process_record_message
+    _process_activate_version_message = _process_record_message
+
+    @staticmethod
+    def _assert_line_requires(line_dict, requires):
+        if not requires.issubset(line_dict):
+            raise Exception("missing keys")
+
+
+def test_messages_are_dispatched_in_order():
+    lines = [
+        '{"type": "SCHEMA", "stream": "users", "schema": {}, "key_properties": []}',
+        '{"type": "RECORD", "stream": "users", "record": {"id": 1, "name": "é"}}',
+        '{"type": "STATE", "value": {"users": 1}}',
+        '{"type": "RECORD", "stream": "users", "record": {"id": 2}}',
+    ]
+    text = io.TextIOWrapper(io.BytesIO("\n".join(lines).encode()), encoding="utf-8")
+    reader = RecordingReader()
+
+    counter = reader._process_lines(text)
+
+    assert [m["type"] for m in reader.messages] == [
+        "SCHEMA",
+        "RECORD",
+        "STATE",
+        "RECORD",
+    ]
+    assert reader.messages[1]["record"] == {"id": 1, "name": "é"}
+    assert counter == {"SCHEMA": 1, "RECORD": 2, "STATE": 1}
+
+
+def test_unknown_message_type():
+    reader = RecordingReader()
+    with pytest.raises(ValueError):
+        reader._process_lines(io.StringIO('{"type": "NOPE"}\n'))
+    with pytest.raises(Exception, match="missing keys"):
+        reader._process_lines(io.StringIO('{"stream": "users"}\n'))
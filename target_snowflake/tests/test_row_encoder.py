@@ -0,0 +1,149 @@
+import datetime
+from pathlib import Path
+
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.database_target.row_encoder import RowEncoder
+from target_snowflake.database_target.variant_encoder import StreamedJSON
+
+
+def test_encode_in_column_order():
+    encoder = RowEncoder(
+        column_definitions={
+            "ID": "NUMBER",
+            "NAME": "TEXT",
+            "ACTIVE": "BOOLEAN",
+            "CREATED_AT": "TIMESTAMP_TZ",
+            "BIRTHDAY": "DATE",
+            "TAGS": "ARRAY",
+            "PROFILE": "VARIANT",
+        },
+        column_properties={
+            "ID": "id",
+            "NAME": "name",
+            "ACTIVE": "active",
+            "CREATED_AT": "created_at",
+            "BIRTHDAY": "birthday",
+            "TAGS": "tags",
+            "PROFILE": "profile",
+        },
+    )
+
+    assert encoder.columns == [
+        "ID",
+        "NAME",
+        "ACTIVE",
+        "CREATED_AT",
+        "BIRTHDAY",
+        "TAGS",
+        "PROFILE",
+    ]
+    assert encoder.encode(
+        {
+            "profile": {"age": 30},
+            "tags": ["a", "b"],
+            "birthday": datetime.date(1990, 1, 2),
+            "created_at": datetime.datetime(
+                2021, 9, 20, 12, 45, tzinfo=datetime.timezone.utc
+            ),
+            "active": True,
+            "name": "alice",
+            "id": 1,
+            "unknown": "dropped",
+        }
+    ) == (
+        1,
+        "alice",
+        True,
+        datetime.datetime(2021, 9, 20, 12, 45, tzinfo=datetime.timezone.utc),
+        datetime.date(1990, 1, 2),
+        '["a","b"]',
+        '{"age":30}',
+    )
+
+
+def test_encode_converts_values():
+    encoder = RowEncoder(
+        column_definitions={"COUNT": "NUMBER", "BIRTHDAY": "DATE"},
+        column_properties={"COUNT": "count", "BIRTHDAY": "birthday"},
+    )
+
+    assert encoder.encode(
+        {"count": True, "birthday": datetime.datetime(1990, 1, 2, 3, 4)}
+    ) == (1, datetime.date(1990, 1, 2))
+
+
+def test_encode_sparse_record():
+    encoder = RowEncoder(
+        column_definitions={"ID": "NUMBER", "ACTIVE": "BOOLEAN", "TAGS": "ARRAY"},
+        column_properties={"ID": "id", "ACTIVE": "active", "TAGS": "tags"},
+    )
+
+    assert encoder.encode({"id": 1}) == (1, None, None)
+
+
+def test_encode_flattened_properties():
+    encoder = RowEncoder(
+        column_definitions={
+            "ID": "NUMBER",
+            "ADDRESS__CITY": "TEXT",
+            "ADDRESS__GEO__LAT": "FLOAT",
+            "ADDRESS__GEO__EXTRA": "VARIANT",
+        },
+        column_properties={
+            "ID": "id",
+            "ADDRESS__CITY": ("address", "city"),
+            "ADDRESS__GEO__LAT": ("address", "geo", "lat"),
+            "ADDRESS__GEO__EXTRA": ("address", "geo", "extra"),
+        },
+    )
+
+    assert encoder.encode(
+        {"id": 1, "address": {"city": "Paris", "geo": {"lat": 48.8, "extra": {}}}}
+    ) == (1, "Paris", 48.8, "{}")
+    assert encoder.encode({"id": 2, "address": {"geo": None}}) == (2, None, None, None)
+    assert encoder.encode({"id": 3, "address": "unknown"}) == (3, None, None, None)
+
+
+def test_encode_nested_values():
+    encoder = RowEncoder(
+        column_definitions={"PROFILE": "VARIANT"},
+        column_properties={"PROFILE": "profile"},
+    )
+    profile = {
+        "name": 'alice "al" \\ smith',
+        "city": "Zürich",
+        "seen": datetime.datetime(2021, 9, 20, 12, 45),
+        3: [],
+    }
+
+    assert encoder.encode({"profile": profile}) == (
+        '{"name":"alice \\"al\\" \\\\ smith","city":"Zürich",'
+        '"seen":"2021-09-20 12:45:00","3":[]}',
+    )
+    assert encoder.encode({"profile": {}}) == ("{}",)
+    assert encoder.encode({"profile": 2**70}) == (str(2**70),)
+
+
+def test_stream_large_nested_values(tmp_path: Path):
+    encoder = RowEncoder(
+        column_definitions={"ID": "NUMBER", "NAME": "TEXT", "EVENTS": "ARRAY"},
+        column_properties={"ID": "id", "NAME": "name", "EVENTS": "events"},
+    )
+    streaming_encoder = RowEncoder(
+        encoder.column_definitions, encoder.column_properties, stream_threshold=2
+    )
+    records = [
+        {"id": 1, "name": "a, b", "events": [{"type": 'say "hi"'}] * 3},
+        {"id": 2, "name": "", "events": [1, 2]},
+        {"id": 3, "events": ["x\ny", None, {}]},
+    ]
+    assert isinstance(streaming_encoder.encode(records[0])[2], StreamedJSON)
+
+    for name, row_encoder in [("plain", encoder), ("streamed", streaming_encoder)]:
+        writer = CSVBatchWriter(tmp_path / f"{name}.csv", encoder=row_encoder)
+        for record in records:
+            writer.write_record(record)
+        writer.close()
+    assert (tmp_path / "streamed.csv").read_bytes() == (
+        tmp_path / "plain.csv"
+    ).read_bytes()
@@ -0,0 +1,224 @@
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from target_snowflake.database_target.csv_sink import CSVBatchWriter
+from target_snowflake.s3 import S3MultipartUpload
+from target_snowflake.stages import S3Stage
+from target_snowflake.tests.fake_snowflake import (
+    COPY,
+    FakeSnowflake,
+    LocalSnowflakeTarget,
+)
+from target_snowflake.tests.test_end_to_end import messages, run_target
+
+MB = 1024 * 1024
+
+
+class FakeS3Client:
+    def __init__(self) -> None:
+        self.parts: Dict[int, bytes] = {}
+        self.completed: List[Dict[str, Any]] = []
+        self.aborted = False
+
+    def create_multipart_upload(self, **kwargs) -> Dict[str, Any]:
+        return {"UploadId": "upload"}
+
+    def upload_part(self, PartNumber: int, Body: bytes, **kwargs) -> Dict[str, Any]:
+        if Body == b"fail":
+            raise IOError("upload failed")
+        self.parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs) -> None:
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, **kwargs) -> None:
+        self.aborted = True
+
+
+def test_multipart_upload_sends_parts_while_writing():
+    client = FakeS3Client()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        upload = S3MultipartUpload(client, "bucket", "key", executor, part_size=5 * MB)
+        upload.write(b"a" * 3 * MB)
+        upload.write(b"b" * 3 * MB)
+        assert upload.tell() == 6 * MB
+        upload.write(b"c" * 5 * MB)
+        upload.close()
+
+    assert client.completed == [
+        {"PartNumber": 1, "ETag": "etag-1"},
+        {"PartNumber": 2, "ETag": "etag-2"},
+        {"PartNumber": 3, "ETag": "etag-3"},
+    ]
+    assert b"".join(client.parts[i] for i in (1, 2, 3)) == (
+        b"a" * 3 * MB + b"b" * 3 * MB + b"c" * 5 * MB
+    )
+    assert [len(client.parts[i]) for i in (1, 2, 3)] == [5 * MB, 5 * MB, MB]
+
+
+def test_multipart_upload_aborts_on_failure():
+    client = FakeS3Client()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        upload = S3MultipartUpload(client, "bucket", "key", executor)
+        upload.write(b"fail")
+        with pytest.raises(IOError):
+            upload.close()
+
+    assert client.aborted
+    assert client.completed == []
+
+
+@pytest.fixture
+def mock_s3(monkeypatch):
+    moto = pytest.importorskip("moto")
+    mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def s3_stage(mock_s3):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = {
+            "snowflake": {
+                "account": "local",
+                "user": "user",
+                "password": "password",
+                "database": "TEST",
+            },
+            "s3_bucket": "staging",
+            "s3_prefix": "loads",
+            "aws_access_key_id": "key",
+            "aws_secret_access_key": "secret",
+            "s3_streaming_upload": True,
+        }
+        target = LocalSnowflakeTarget(
+            FakeSnowflake(Path(tmpdir) / "stage"), config=config
+        )
+        stage = target.stage
+        assert isinstance(stage, S3Stage)
+        stage.client.create_bucket(Bucket="staging")
+        yield stage
+        stage.cleanup()
+
+
+def test_s3_stage_uploads_batch_files(s3_stage: S3Stage, tmp_path: Path):
+    batch_dir = tmp_path / "batch-1"
+    batch_dir.mkdir()
+    files = []
+    for i in range(3):
+        files.append(batch_dir / f"part-{i}.csv")
+        files[-1].write_text(f"ID\n{i}\n")
+
+    staged_files = s3_stage.upload(s3_stage.connection, files, "USERS")
+
+    assert staged_files == [f"USERS/batch-1/part-{i}.csv" for i in range(3)]
+    body = s3_stage.client.get_object(Bucket="staging", Key="loads/" + staged_files[1])
+    assert body["Body"].read() == b"ID\n1\n"
+
+    s3_stage.client.delete_object(Bucket="staging", Key="loads/" + staged_files[0])
+    assert s3_stage.still_staged(s3_stage.connection, staged_files) == staged_files[1:]
+
+
+def test_s3_stage_streams_files_as_they_are_written(s3_stage: S3Stage, tmp_path: Path):
+    filepath = tmp_path / "users.csv"
+    writer = CSVBatchWriter(filepath, fileobj=s3_stage.open_upload(filepath, "USERS"))
+    writer.write_record({"ID": 1, "NAME": "a"})
+    writer.close()
+
+    assert not filepath.exists()
+    staged_files = s3_stage.upload(s3_stage.connection, [filepath], "USERS")
+    assert staged_files == ["USERS/users.csv"]
+    body = s3_stage.client.get_object(Bucket="staging", Key="loads/" + staged_files[0])
+    assert body["Body"].read() == b"ID,NAME\r\n1,a\r\n"
+
+
+def test_s3_stage_streams_shards_under_batch_directory(
+    s3_stage: S3Stage, tmp_path: Path
+):
+    batch_dir = tmp_path / "batch-1"
+    files = [batch_dir / f"part-{i}.csv" for i in range(2)]
+    for i, filepath in enumerate(files):
+        fileobj = s3_stage.open_upload(filepath, "USERS", sharded=True)
+        writer = CSVBatchWriter(filepath, fileobj=fileobj)
+        writer.write_record({"ID": i})
+        writer.close()
+
+    staged_files = s3_stage.upload(s3_stage.connection, files, "USERS")
+    assert staged_files == ["USERS/batch-1/part-0.csv", "USERS/batch-1/part-1.csv"]
+    assert s3_stage.still_staged(s3_stage.connection, staged_files) == staged_files
+
+
+def test_s3_stage_points_at_bucket_without_logging_secret(s3_stage: S3Stage, caplog):
+    with caplog.at_level(logging.DEBUG):
+        s3_stage.prepare()
+
+    assert (
+        'CREATE OR REPLACE STAGE "PUBLIC"."target-snowflake-s3" URL = %(url)s '
+        "CREDENTIALS = (AWS_KEY_ID = %(key_id)s AWS_SECRET_KEY = %(secret)s)"
+    ) in caplog.text
+    assert "secret" not in caplog.text.replace("%(secret)s", "")
+
+
+def test_resume_streamed_batch_from_stage(mock_s3, monkeypatch, tmp_path: Path):
+    import boto3
+
+    client = boto3.client("s3")
+    client.create_bucket(Bucket="staging")
+    database = FakeSnowflake(tmp_path / "stage")
+    records = [{"id": i, "name": f"user {i}"} for i in range(10)]
+    config = {
+        "output_path_prefix": f"{tmp_path}/",
+        "load_manifest": str(tmp_path / "manifest.jsonl"),
+        "batch_size_rows": 100,
+        "s3_bucket": "staging",
+        "s3_prefix": "loads",
+        "aws_access_key_id": "key",
+        "aws_secret_access_key": "secret",
+        "s3_streaming_upload": True,
+    }
+
+    def lost_connection(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(S3Stage, "upload", lost_connection)
+        with pytest.raises(RuntimeError):
+            run_target(database, messages(records), **config)
+    assert len(database.table("USERS")) == 0
+    # The batch was only ever written to S3
+    assert not list(tmp_path.glob("**/*.csv*"))
+
+    copy = database._copy
+
+    def copy_from_s3(sql):
+        # Snowflake reads the external stage straight from the bucket
+        for file in COPY.match(sql).group("files").split(","):  # type: ignore
+            path = database.stage_dir / file.strip(" '")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            client.download_file("staging", "loads/" + file.strip(" '"), str(path))
+        return copy(sql)
+
+    database._copy = copy_from_s3  # type: ignore[assignment]
+    run_target(database, [], resume_loads=True, **config)
+
+    assert len(database.table("USERS")) == 10
+    assert (tmp_path / "manifest.jsonl").read_text() == ""
+
+
+def test_s3_stage_prefers_storage_integration(s3_stage: S3Stage, caplog):
+    s3_stage._config["s3_storage_integration"] = "S3_INTEGRATION"
+    with caplog.at_level(logging.DEBUG):
+        s3_stage.prepare()
+
+    assert (
+        'CREATE OR REPLACE STAGE "PUBLIC"."target-snowflake-s3" URL = %(url)s '
+        "STORAGE_INTEGRATION = S3_INTEGRATION"
+    ) in caplog.text
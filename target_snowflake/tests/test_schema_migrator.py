@@ -0,0 +1,168 @@
+import logging
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from freezegun import freeze_time
+
+from target_snowflake.database_target.schema_migrator import ColumnType
+from target_snowflake.migrator import SnowflakeSchemaMigrator
+
+
+class RecordingMigrator(SnowflakeSchemaMigrator):
+    """Migrator that records DDL instead of running it."""
+
+    def __init__(self, existing: Optional[Dict[str, ColumnType]], **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.existing = existing
+        self.statements: List[tuple] = []
+
+    def get_table(self, table_name: str) -> Optional[Dict[str, ColumnType]]:
+        return self.existing
+
+    def create_table(self, table_name, key_properties, column_definitions) -> None:
+        self.statements.append(("create", table_name, column_definitions))
+
+    def add_columns(self, table_name, columns) -> None:
+        self.statements.append(("add", table_name, columns))
+
+    def rename_column(self, table_name, old_name, new_name) -> None:
+        self.statements.append(("rename", table_name, old_name, new_name))
+
+
+def make_sink(properties: dict, **config) -> SimpleNamespace:
+    return SimpleNamespace(
+        logger=logging.getLogger(),
+        stream_name="users",
+        key_properties=["id"],
+        schema={"type": "object", "properties": properties},
+        config=config,
+    )
+
+
+@freeze_time("2021-09-20 12:45")
+def test_migration_is_planned_before_it_is_applied():
+    migrator = RecordingMigrator(
+        existing={"ID": "NUMBER", "AGE": "NUMBER"},
+        sink=make_sink(
+            {
+                "id": {"type": "integer"},
+                "age": {"type": ["null", "number"]},
+                "name": {"type": ["null", "string"]},
+                "email": {"type": ["null", "string"]},
+            }
+        ),
+    )
+    migrator.sync_table_schema()
+
+    assert migrator.statements == [
+        ("rename", "USERS", "AGE", "AGE_20210920_1245"),
+        ("add", "USERS", {"AGE": "FLOAT", "NAME": "TEXT", "EMAIL": "TEXT"}),
+    ]
+
+
+def test_up_to_date_table_is_not_migrated():
+    migrator = RecordingMigrator(
+        existing={"ID": "NUMBER"},
+        sink=make_sink({"id": {"type": "integer"}}),
+    )
+    migrator.sync_table_schema()
+
+    assert migrator.statements == []
+
+
+def test_narrower_type_is_kept_in_wider_column():
+    migrator = RecordingMigrator(
+        existing={"ID": "NUMBER", "AGE": "FLOAT", "BORN": "TIMESTAMP_TZ"},
+        sink=make_sink(
+            {
+                "id": {"type": "integer"},
+                "age": {"type": ["null", "integer"]},
+                "born": {"type": ["null", "string"], "format": "date"},
+            },
+            widen_column_types=True,
+        ),
+    )
+
+    assert migrator.sync_table_schema() == {
+        "ID": "NUMBER",
+        "AGE": "FLOAT",
+        "BORN": "TIMESTAMP_TZ",
+    }
+    assert migrator.statements == []
+
+
+@freeze_time("2021-09-20 12:45")
+def test_column_is_versioned_to_common_type():
+    migrator = RecordingMigrator(
+        existing={"ID": "NUMBER", "AGE": "NUMBER", "BORN": "DATE"},
+        sink=make_sink(
+            {
+                "id": {"type": "integer"},
+                "age": {"type": ["null", "number"]},
+                "born": {"type": ["null", "boolean"]},
+            },
+            widen_column_types=True,
+        ),
+    )
+
+    assert migrator.sync_table_schema() == {
+        "ID": "NUMBER",
+        "AGE": "FLOAT",
+        "BORN": "TEXT",
+    }
+    assert migrator.statements == [
+        ("rename", "USERS", "AGE", "AGE_20210920_1245"),
+        ("rename", "USERS", "BORN", "BORN_20210920_1245"),
+        ("add", "USERS", {"AGE": "FLOAT", "BORN": "TEXT"}),
+    ]
+
+
+def test_cyclic_type_lattice_has_no_common_type():
+    migrator = RecordingMigrator(
+        existing=None,
+        sink=make_sink(
+            {"id": {"type": "integer"}},
+            widen_column_types=True,
+            column_type_lattice={"A": "B", "B": "A"},
+        ),
+    )
+
+    assert migrator.common_type("NUMBER", "A") is None
+    assert migrator.common_type("A", "B") == "B"
+
+
+def test_flatten_nested_objects():
+    address = {
+        "type": ["null", "object"],
+        "properties": {
+            "city": {"type": ["null", "string"]},
+            "geo": {
+                "type": "object",
+                "properties": {"lat": {"type": "number"}, "lng": {"type": "number"}},
+            },
+        },
+    }
+    migrator = RecordingMigrator(
+        existing=None,
+        sink=make_sink(
+            {
+                "id": {"type": "integer"},
+                "address": address,
+                "extra": {"type": "object"},
+            },
+            flatten_max_depth=1,
+        ),
+    )
+
+    assert migrator.sync_table_schema() == {
+        "ID": "NUMBER",
+        "ADDRESS__CITY": "TEXT",
+        "ADDRESS__GEO": "VARIANT",
+        "EXTRA": "VARIANT",
+    }
+    assert migrator.column_properties == {
+        "ID": "id",
+        "ADDRESS__CITY": ("address", "city"),
+        "ADDRESS__GEO": ("address", "geo"),
+        "EXTRA": "extra",
+    }
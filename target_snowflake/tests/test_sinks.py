@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from target_snowflake.sinks import SnowflakeSink
+from target_snowflake.tests.fake_snowflake import FakeSnowflake, LocalSnowflakeTarget
+
+MB = 1024 * 1024
+
+
+def make_sink(tmp_path: Path, **config) -> SnowflakeSink:
+    target = LocalSnowflakeTarget(
+        FakeSnowflake(tmp_path / "stage"),
+        config={
+            "snowflake": {
+                "account": "local",
+                "user": "user",
+                "password": "password",
+                "database": "TEST",
+            },
+            "output_path_prefix": f"{tmp_path}/",
+            **config,
+        },
+    )
+    return SnowflakeSink(
+        target=target,
+        stream_name="users",
+        key_properties=[],
+        schema={
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer"},
+                "name": {"type": ["null", "string"]},
+            },
+        },
+    )
+
+
+def test_batch_rows_converge_on_byte_budget(tmp_path: Path):
+    sink = make_sink(tmp_path, batch_size_rows=100000, batch_size_mb=1)
+    assert sink.max_size == 100000
+
+    sink._observe_batch_size(1000, 1000 * 1024)
+    assert sink.max_size == 1024
+
+    # Rows turn out narrower, so batches grow towards 1MB / 512B
+    sizes = []
+    for _ in range(20):
+        sink._observe_batch_size(1000, 1000 * 512)
+        sizes.append(sink.max_size)
+    assert sizes == sorted(sizes)
+    assert sizes[0] == int(MB / 768)
+    assert abs(sizes[-1] - 2048) <= 1
+
+
+def test_batch_rows_never_exceed_batch_size_rows(tmp_path: Path):
+    sink = make_sink(tmp_path, batch_size_rows=500, batch_size_mb=1)
+
+    for _ in range(5):
+        sink._observe_batch_size(1000, 1000 * 10)
+        assert sink.max_size == 500
+
+    # Even rows wider than the budget make batches of one row
+    sink._observe_batch_size(1, 10 * MB)
+    sink._observe_batch_size(1, 10 * MB)
+    assert sink.max_size == 1
+
+
+def test_streamed_batch_full_on_bytes_before_rows(tmp_path: Path):
+    sink = make_sink(
+        tmp_path, batch_size_rows=100000, batch_size_mb=1, streaming_writes=True
+    )
+    context = {"batch_id": "1"}
+    sink.start_batch(context)
+
+    records = 0
+    while not sink.is_full:
+        sink.process_record({"id": records, "name": "x" * 1000}, context)
+        records += 1
+        assert records < 100000
+    context["writer"].close()
+
+    assert context["writer"].bytes_written >= MB
+    # Rows are a little over 1000 bytes, and the writer buffers a few
+    assert 1000 < records < 1100
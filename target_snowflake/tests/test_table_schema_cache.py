@@ -0,0 +1,38 @@
+from target_snowflake.database_target.schema_migrator import TableSchemaCache
+
+
+def test_loaded_cache_knows_missing_tables():
+    cache = TableSchemaCache()
+    assert not cache.is_known("USERS")
+
+    cache.load({"USERS": {"ID": "NUMBER"}})
+    assert cache.is_known("USERS")
+    assert cache.get("USERS") == {"ID": "NUMBER"}
+    assert cache.is_known("ORDERS")
+    assert cache.get("ORDERS") is None
+
+
+def test_ddl_updates_cache():
+    cache = TableSchemaCache()
+    cache.load({})
+    cache.set_table("USERS", {"ID": "NUMBER", "AGE": "NUMBER"})
+    cache.add_column("USERS", "EMAIL", "TEXT")
+    cache.rename_column("USERS", "AGE", "AGE_20210920_0745")
+
+    assert cache.get("USERS") == {
+        "ID": "NUMBER",
+        "AGE_20210920_0745": "NUMBER",
+        "EMAIL": "TEXT",
+    }
+
+
+def test_invalidated_table_is_unknown_until_refreshed():
+    cache = TableSchemaCache()
+    cache.load({"USERS": {"ID": "NUMBER"}})
+
+    cache.invalidate("USERS")
+    assert not cache.is_known("USERS")
+    assert cache.is_known("ORDERS")
+
+    cache.set_table("USERS", {"ID": "NUMBER", "NAME": "TEXT"})
+    assert cache.get("USERS") == {"ID": "NUMBER", "NAME": "TEXT"}